@@ -0,0 +1,102 @@
+import logging
+import time
+
+import arviz as az
+import numpy as np
+import pymc as pm
+import xarray as xr
+
+from warm_start import warm_start_sample_kwargs, resume_initvals
+
+# Sampling stops once every element of these variables has at least TARGET_ESS bulk ESS (over all chains)
+# and an R-hat of at most TARGET_RHAT. The opponent effects are left out: most cells are opponents a player
+# rarely faced, only identified through the prior, and would hold every player to the worst of them.
+TARGET_VARS = ['pred_total_points', 'mu_assists_t', 'mu_goals_t', 'beta_goal']
+TARGET_ESS = 400
+TARGET_RHAT = 1.01
+# Draws per chain of the first round, and the fewest any later round adds
+ROUND_DRAWS = 100
+# Per-player budget: draws per chain (tuning not counted) and seconds, compilation included
+MAX_DRAWS = 2000
+TIME_BUDGET = 600
+
+
+def convergence(trace, var_names=TARGET_VARS):
+    # Lowest bulk ESS and highest R-hat over every element of the variables
+    var_names = [var for var in var_names if var in trace.posterior]
+    ess = az.ess(trace, var_names=var_names, method='bulk')
+    rhat = az.rhat(trace, var_names=var_names)
+    return min(float(ess[var].min()) for var in var_names), max(float(rhat[var].max()) for var in var_names)
+
+
+def merge_rounds(rounds):
+    # The draws of every round back to back, as one trace of longer chains
+    groups = {}
+    for group in ['posterior', 'sample_stats']:
+        merged = xr.concat([trace[group] for trace in rounds], dim='draw')
+        merged.attrs['sampling_time'] = sum(trace[group].attrs.get('sampling_time', 0) for trace in rounds)
+        groups[group] = merged.assign_coords(draw=np.arange(merged.sizes['draw']))
+    groups.update({group: rounds[0][group] for group in rounds[0].groups() if group not in groups})
+    return az.InferenceData(**groups)
+
+
+def sample_until_converged(model, finish, draws=ROUND_DRAWS, tune=100, chains=None, cores=None,
+                           max_draws=MAX_DRAWS, time_budget=TIME_BUDGET, target_ess=TARGET_ESS,
+                           target_rhat=TARGET_RHAT, var_names=TARGET_VARS, progressbar=True, label='',
+                           **sample_kwargs):
+    # NUTS in rounds until var_names meet the targets or the draw or time budget runs out. The first round
+    # tunes as pm.sample does; every later round extends the same chains from their last draw with one fixed
+    # kernel (the final step size and a mass matrix from the first round's draws, see warm_start.py), so no
+    # draw is thrown away. finish(trace) turns the merged draws into the trace that is checked and returned,
+    # e.g. adds the predicted totals. The posterior attrs record the rounds and whether the targets were met.
+    if chains is not None and chains < 2:
+        raise ValueError("Adaptive sampling needs at least 2 chains, R-hat is undefined for one")
+    start = time.perf_counter()
+    with model:
+        rounds = [pm.sample(draws, tune=tune, chains=chains, cores=cores, return_inferencedata=True,
+                            progressbar=progressbar, **sample_kwargs)]
+    chains = rounds[0].posterior.sizes['chain']
+    first_kwargs = sample_kwargs
+    step = None
+    while True:
+        trace = finish(merge_rounds(rounds))
+        n_draws = trace.posterior.sizes['draw']
+        ess, rhat = convergence(trace, var_names)
+        # NaN (e.g. the ESS of a constant) is not met: the fit is never reported converged unchecked
+        ess_met, rhat_met = ess >= target_ess, rhat <= target_rhat
+        elapsed = time.perf_counter() - start
+        logging.info(f"{label} round {len(rounds)}: {n_draws} draws per chain, min ESS {ess:.0f}, "
+                     f"max R-hat {rhat:.3f}, {elapsed:.0f}s")
+        if ess_met and rhat_met:
+            break
+
+        # Enough draws to reach the ESS target at the rate so far, and at least one more round's worth. The
+        # time per draw counts the tuning draws, which are the slower ones.
+        next_draws = draws if ess_met else max(draws, int(np.ceil(n_draws * (target_ess / max(ess, 1) - 1))))
+        seconds_per_draw = trace.posterior.attrs['sampling_time'] / (n_draws + trace.posterior.attrs['tuning_steps'])
+        next_draws = min(next_draws, max_draws - n_draws, int((time_budget - elapsed) / seconds_per_draw))
+        if next_draws < 1:
+            logging.warning(f"{label} stopped at the budget ({n_draws} draws per chain, {elapsed:.0f}s) without "
+                            f"reaching ESS {target_ess} and R-hat {target_rhat}")
+            break
+
+        round_tune = 0
+        if step is None and len(rounds) == 1:
+            sample_kwargs = warm_start_sample_kwargs(model, rounds[0], chains)
+            step = sample_kwargs.get('step')
+            if step is None:
+                logging.warning(f"{label} first round has no adapted step size, every later round tunes afresh")
+        if step is not None:
+            sample_kwargs = {'step': step, 'initvals': resume_initvals(model, rounds[-1], chains)}
+        else:
+            # A fresh kernel per round, tuned from the last draws like the first round, tuning draws discarded
+            sample_kwargs = dict(first_kwargs, initvals=resume_initvals(model, rounds[-1], chains))
+            round_tune = tune
+        with model:
+            rounds.append(pm.sample(next_draws, tune=round_tune, chains=chains, cores=cores,
+                                    return_inferencedata=True, progressbar=progressbar, **sample_kwargs))
+
+    # NetCDF attributes cannot be booleans
+    trace.posterior.attrs.update({'adaptive_rounds': len(rounds), 'converged': int(ess_met and rhat_met),
+                                  'min_ess_bulk': ess, 'max_rhat': rhat})
+    return trace
@@ -1,19 +1,70 @@
-import arviz as az
+import argparse
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import os
+from superiority import prob_greater, hdi
 
 OUTPUT_DIR = os.path.join('outputs')
-player_1_name = 'Kirill Kaprizov'
-player_2_name = 'JT Miller'
-
-def load_model(file_name):
-    return az.from_netcdf(os.path.join(OUTPUT_DIR, file_name))
-def calculate_and_print_hdi(data, player_name, stat_name):
-    hdi = az.hdi(data, hdi_prob=0.95)
-    print(f"{player_name} 95% HDI for {stat_name}: [{hdi[0]:.1f}, {hdi[1]:.1f}]")
+REPORT_FILE = os.path.join(OUTPUT_DIR, 'league_report')
+STATS = ['points', 'goals', 'assists']
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+HDI_PROBS = [0.5, 0.8, 0.95]
+
+
+def load_draws(players=None, stat='points', source='predictions'):
+    # Draws of one season total per player, from the compact prediction store or the full traces
+    var = f'pred_total_{stat}'
+    if source == 'predictions':
+        from prediction_store import prediction_draws
+        return prediction_draws(var, players)
+    from trace_catalog import TraceCatalog
+    return TraceCatalog().draws(var, players)
+
+
+def stack_draws(draws):
+    # {player: draws} -> groups of players with the same number of draws, each as one (players, draws) array
+    groups = {}
+    for player_name, values in draws.items():
+        groups.setdefault(len(values), []).append(player_name)
+    return [(names, np.stack([np.ravel(draws[name]) for name in names])) for names in groups.values()]
+
+
+def summarize(draws, stat, quantiles=QUANTILES, hdi_probs=HDI_PROBS):
+    # Mean, SD, quantiles and HDIs of every player at once, along the draw axis
+    summaries = []
+    for names, stacked in stack_draws(draws):
+        stacked = np.sort(stacked, axis=1)
+        summary = {f'{stat}_mean': stacked.mean(axis=1), f'{stat}_sd': stacked.std(axis=1)}
+        for q, values in zip(quantiles, np.quantile(stacked, quantiles, axis=1)):
+            summary[f'{stat}_q{round(q * 100):02d}'] = values
+        for hdi_prob in hdi_probs:
+            low, high = hdi(stacked, hdi_prob)
+            summary[f'{stat}_hdi{round(hdi_prob * 100)}_low'] = low
+            summary[f'{stat}_hdi{round(hdi_prob * 100)}_high'] = high
+        summaries.append(pd.DataFrame(summary, index=pd.Index(names, name='player')))
+    return pd.concat(summaries)
+
+
+def league_report(players=None, stats=STATS, quantiles=QUANTILES, hdi_probs=HDI_PROBS, source='predictions'):
+    report = pd.concat([summarize(load_draws(players, stat, source), stat, quantiles, hdi_probs) for stat in stats],
+                       axis=1)
+    return report.sort_values(report.columns[0], ascending=False)
+
+
+def write_report(report, output_format='csv', report_file=REPORT_FILE):
+    path = f'{report_file}.{output_format}'
+    if output_format == 'parquet':
+        report.to_parquet(path)
+    else:
+        report.to_csv(path)
+    return path
+
+
 def calculate_probability(player1_data, player2_data):
-    return (player1_data[:, None] > player2_data).mean()
+    return prob_greater(player1_data, player2_data)
+
+
 def plot_distributions(player1_data, player2_data, player1_name, player2_name, stat_name):
     plt.figure(figsize=(10, 6))
     plt.hist(player1_data, bins=50, alpha=0.5, label=player1_name)
@@ -25,104 +76,33 @@ def plot_distributions(player1_data, player2_data, player1_name, player2_name, s
     plt.savefig(os.path.join(OUTPUT_DIR, f'{stat_name.lower()}_distribution.png'))
     plt.close()
 
-def calculate_lower_bound(data, percentile=5):
-    return np.percentile(data, percentile)
-
-# Load model results
-player_1_model = load_model(f'{player_1_name}_model_results.nc')
-player_2_model = load_model(f'{player_2_name}_model_results.nc')
-
-# Extract relevant data
-player_1_points = player_1_model.posterior['pred_total_points'].values.flatten()
-player_2_points = player_2_model.posterior['pred_total_points'].values.flatten()
-
-player_1_goals = player_1_model.posterior['pred_total_goals'].values.flatten()
-player_2_goals = player_2_model.posterior['pred_total_goals'].values.flatten()
-
-player_1_assists = player_1_model.posterior['pred_total_assists'].values.flatten()
-player_2_assists = player_2_model.posterior['pred_total_assists'].values.flatten()
-
-# Calculate probabilities
-prob_points = calculate_probability(player_1_points, player_2_points)
-prob_goals = calculate_probability(player_1_goals, player_2_goals)
-prob_assists = calculate_probability(player_1_assists, player_2_assists)
-
-print(f"Probability {player_1_name} > {player_2_name} (Points): {prob_points:.3f}")
-print(f"Probability {player_1_name} > {player_2_name} (Goals): {prob_goals:.3f}")
-print(f"Probability {player_1_name} > {player_2_name} (Assists): {prob_assists:.3f}")
-
-# Plot distributions
-plot_distributions(player_1_points, player_2_points, player_1_name, player_2_name, 'Points')
-plot_distributions(player_1_goals, player_2_goals, player_1_name, player_2_name, 'Goals')
-plot_distributions(player_1_assists, player_2_assists, player_1_name, player_2_name, 'Assists')
-
-# Calculate 95% lower bounds
-player_1_points_lb = calculate_lower_bound(player_1_points)
-player_1_goals_lb = calculate_lower_bound(player_1_goals)
-player_1_assists_lb = calculate_lower_bound(player_1_assists)
-
-player_2_points_lb = calculate_lower_bound(player_2_points)
-player_2_goals_lb = calculate_lower_bound(player_2_goals)
-player_2_assists_lb = calculate_lower_bound(player_2_assists)
-
-player_1_points_ub = calculate_lower_bound(player_1_points, 95)
-player_1_goals_ub = calculate_lower_bound(player_1_goals, 95)
-player_1_assists_ub = calculate_lower_bound(player_1_assists, 95)
-
-player_2_points_ub = calculate_lower_bound(player_2_points, 95)
-player_2_goals_ub = calculate_lower_bound(player_2_goals, 95)
-player_2_assists_ub = calculate_lower_bound(player_2_assists, 95)
-
-print(f"\n95% Lower Bounds:")
-print(f"{player_1_name} Points: {player_1_points_lb:.1f}")
-print(f"{player_2_name} Points: {player_2_points_lb:.1f}")
-
-print(f"{player_1_name} Goals: {player_1_goals_lb:.1f}")
-print(f"{player_2_name} Goals: {player_2_goals_lb:.1f}")
-
-print(f"{player_1_name} Assists: {player_1_assists_lb:.1f}")
-print(f"{player_2_name} Assists: {player_2_assists_lb:.1f}")
-
-
-print(f"\n 95% Upper Bounds:")
-print(f"{player_1_name} Points: {player_1_points_ub:.1f}")
-print(f"{player_2_name} Points: {player_2_points_ub:.1f}")
-
-print(f"{player_1_name} Goals: {player_1_goals_ub:.1f}")
-print(f"{player_2_name} Goals: {player_2_goals_ub:.1f}")
-
-print(f"{player_1_name} Assists: {player_1_assists_ub:.1f}")
-print(f"{player_2_name} Assists: {player_2_assists_ub:.1f}")
-
-
-# Calculate and print 95% HDI
-calculate_and_print_hdi(player_1_points, player_1_name, "Points")
-calculate_and_print_hdi(player_2_points, player_2_name, "Points")
-
-calculate_and_print_hdi(player_1_goals, player_1_name, "Goals")
-calculate_and_print_hdi(player_2_goals, player_2_name, "Goals")
-
-calculate_and_print_hdi(player_1_assists, player_1_name, "Assists")
-calculate_and_print_hdi(player_2_assists, player_2_name, "Assists")
-
-
-# Calculate variances
-player_1_points_var = np.std(player_1_points)
-player_1_goals_var = np.std(player_1_goals)
-player_1_assists_var = np.std(player_1_assists)
-
-player_2_points_var = np.std(player_2_points)
-player_2_goals_var = np.std(player_2_goals)
-player_2_assists_var = np.std(player_2_assists)
-
-# Print variances
-print("\nVariances:")
-print(f"{player_1_name} Points Variance: {player_1_points_var:.2f}")
-print(f"\n{player_2_name} Points Variance: {player_2_points_var:.2f}")
-
-print(f"{player_1_name} Goals Variance: {player_1_goals_var:.2f}")
-print(f"{player_2_name} Goals Variance: {player_2_goals_var:.2f}")
-
-print(f"{player_1_name} Assists Variance: {player_1_assists_var:.2f}")
-print(f"{player_2_name} Assists Variance: {player_2_assists_var:.2f}")
 
+def compare_players(player_1_name, player_2_name, source='predictions'):
+    # The old two-player script: P(player 1 > player 2) per stat and overlaid histograms
+    for stat in STATS:
+        draws = load_draws([player_1_name, player_2_name], stat, source)
+        player_1_data, player_2_data = draws[player_1_name], draws[player_2_name]
+        print(f"Probability {player_1_name} > {player_2_name} ({stat.capitalize()}): "
+              f"{calculate_probability(player_1_data, player_2_data):.3f}")
+        plot_distributions(player_1_data, player_2_data, player_1_name, player_2_name, stat.capitalize())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summary report of projected season totals')
+    parser.add_argument('players', nargs='*', help='players to report on (default: every stored player)')
+    parser.add_argument('--source', choices=['predictions', 'traces'], default='predictions',
+                        help="'predictions' reads the compact prediction store, 'traces' the NetCDF traces")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--sort', default=None, help='column to sort by, e.g. points_q05 (default: points_mean)')
+    parser.add_argument('--compare', nargs=2, metavar=('PLAYER_1', 'PLAYER_2'),
+                        help='also print P(player 1 > player 2) and plot both distributions')
+    args = parser.parse_args()
+
+    report = league_report(args.players or None, source=args.source)
+    if args.sort is not None:
+        report = report.sort_values(args.sort, ascending=False)
+    print(f"Report written to {write_report(report, args.format)}")
+    print(report.round(1).to_string())
+
+    if args.compare:
+        compare_players(*args.compare, source=args.source)
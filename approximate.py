@@ -0,0 +1,100 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+from predictive import PRED_VARS
+
+# Approximate alternatives to NUTS. 'pathfinder' needs pymc-extras installed.
+APPROX_METHODS = ['advi', 'fullrank_advi', 'pathfinder']
+APPROX_DRAWS = 1000
+APPROX_ITERATIONS = 5000
+# ADVI's default step size needs several times more iterations to reach the same loss on this model
+APPROX_LEARNING_RATE = 1e-2
+
+# Reference players for checking an approximation against NUTS
+REFERENCE_PLAYERS = ['Sidney Crosby', 'Cale Makar', 'JT Miller']
+REFERENCE_TEAMS = ['penguins', 'avalanche', 'canucks']
+
+
+def fit_approximation(model, method='advi', draws=APPROX_DRAWS, n_iter=APPROX_ITERATIONS, random_seed=None,
+                      progressbar=True):
+    # Posterior draws from an approximation instead of MCMC, as an InferenceData with a single chain,
+    # so the predictive pass and everything reading the trace works as for a NUTS fit
+    if method == 'pathfinder':
+        import pymc_extras as pmx
+        with model:
+            trace = pmx.fit(method='pathfinder', num_draws=draws, random_seed=random_seed, progressbar=progressbar)
+    else:
+        with model:
+            # Stops before n_iter if the variational parameters settle
+            approx = pm.fit(n=n_iter, method=method, random_seed=random_seed, progressbar=progressbar,
+                            obj_optimizer=pm.adagrad_window(learning_rate=APPROX_LEARNING_RATE),
+                            callbacks=[pm.callbacks.CheckParametersConvergence(tolerance=1e-3, diff='relative')])
+        trace = approx.sample(draws, random_seed=random_seed)
+    trace.posterior.attrs['inference'] = method
+    return trace
+
+
+def compare_to_nuts(approx_trace, nuts_trace, var_names=PRED_VARS):
+    # How far the approximate predictions are from NUTS: mean shift in NUTS posterior SDs,
+    # SD ratio (VI typically under-disperses) and the shift of the 5% / 95% quantiles
+    rows = {}
+    for var in var_names:
+        approx = approx_trace.posterior[var].values.ravel()
+        nuts = nuts_trace.posterior[var].values.ravel()
+        approx_q05, approx_q95 = np.percentile(approx, [5, 95])
+        nuts_q05, nuts_q95 = np.percentile(nuts, [5, 95])
+        rows[var] = {
+            'approx_mean': approx.mean(),
+            'nuts_mean': nuts.mean(),
+            'nuts_sd': nuts.std(),
+            'mean_shift_sd': (approx.mean() - nuts.mean()) / nuts.std(),
+            'sd_ratio': approx.std() / nuts.std(),
+            'q05_shift': approx_q05 - nuts_q05,
+            'q95_shift': approx_q95 - nuts_q95,
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def check_against_nuts(player_names=REFERENCE_PLAYERS, team_names=REFERENCE_TEAMS, method='advi',
+                       team_mapping_file="team_mapping.csv"):
+    from game_level_modelling import load_and_prepare_data, build_and_sample_model
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    comparisons = {}
+    for player_name, team_name in zip(player_names, team_names):
+        player_df, remaining_schedule, curr_assists, curr_goals = load_and_prepare_data(
+            player_name, f"{player_name}_df.csv", f"{team_name}_schedule_2425_formatted.csv", team_mapping_file)
+
+        # The NUTS reference comes from (and stays in) the trace cache, the approximate fit is not published
+        start = time.time()
+        nuts_trace = build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name,
+                                            progressbar=False)
+        nuts_time = time.time() - start
+        start = time.time()
+        approx_trace = build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name,
+                                              inference=method, progressbar=False, publish=False)
+        approx_time = time.time() - start
+
+        comparison = compare_to_nuts(approx_trace, nuts_trace)
+        comparison['nuts_time'] = nuts_time
+        comparison['approx_time'] = approx_time
+        comparisons[player_name] = comparison
+        logging.info(f"{player_name}: {method} in {approx_time:.1f}s vs NUTS in {nuts_time:.1f}s, "
+                     f"points mean shift {comparison.loc['pred_total_points', 'mean_shift_sd']:+.2f} SD")
+    return pd.concat(comparisons, names=['player', 'variable'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare approximate inference to NUTS on reference players')
+    parser.add_argument('--method', choices=APPROX_METHODS, default='advi')
+    parser.add_argument('--players', nargs='+', default=REFERENCE_PLAYERS)
+    parser.add_argument('--teams', nargs='+', default=REFERENCE_TEAMS)
+    args = parser.parse_args()
+
+    comparison = check_against_nuts(args.players, args.teams, method=args.method)
+    print(comparison.to_string(float_format='{:.3f}'.format))
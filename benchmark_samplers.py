@@ -0,0 +1,95 @@
+import argparse
+import importlib.util
+import logging
+import os
+import time
+
+import arviz as az
+import pandas as pd
+import pymc as pm
+
+from game_level_modelling import (PLAYER_NAMES, TEAM_NAMES, NUTS_SAMPLERS, OUTPUT_DIR, build_model,
+                                  load_and_prepare_data)
+
+BENCHMARK_FILE = os.path.join(OUTPUT_DIR, 'sampler_benchmark.csv')
+
+# Parameters whose slowest-mixing element sets a backend's effective sampling speed
+ESS_VARS = ['mu_assists_t', 'mu_goals_t', 'b_home', 'beta_goal']
+
+
+def available_samplers(samplers=NUTS_SAMPLERS):
+    # 'pymc' ships with PyMC, the compiled backends only run if their package is installed
+    return [sampler for sampler in samplers if sampler == 'pymc' or importlib.util.find_spec(sampler) is not None]
+
+
+def benchmark_sampler(model, nuts_sampler, draws=1000, tune=1000, chains=4, random_seed=None):
+    # Wall time minus the time spent drawing samples is everything before the first step:
+    # graph compilation (numba/JAX/C), initialisation and process start up. A backend that does not report
+    # its sampling time gets NaN for both, rather than all of the wall time as sampling.
+    start = time.time()
+    with model:
+        trace = pm.sample(draws, tune=tune, chains=chains, nuts_sampler=nuts_sampler, random_seed=random_seed,
+                          return_inferencedata=True, progressbar=False)
+    wall_time = time.time() - start
+    sampling_time = trace.posterior.attrs.get('sampling_time')
+    if sampling_time is None:
+        logging.warning(f"{nuts_sampler} did not report its sampling time, compile time and ESS/s are NaN")
+        sampling_time = float('nan')
+
+    ess = az.ess(trace, var_names=ESS_VARS, method='bulk')
+    min_ess = min(float(ess[var].min()) for var in ESS_VARS)
+    return {
+        'sampler': nuts_sampler,
+        'compile_time': wall_time - sampling_time,
+        'sampling_time': sampling_time,
+        'wall_time': wall_time,
+        'min_ess_bulk': min_ess,
+        'ess_per_sec': min_ess / sampling_time,
+        'ess_per_wall_sec': min_ess / wall_time,
+        'max_rhat': float(az.rhat(trace, var_names=ESS_VARS).to_array().max()),
+        'divergences': int(trace.sample_stats['diverging'].sum()),
+    }
+
+
+def run_benchmark(player_names, team_names, samplers=None, team_mapping_file="team_mapping.csv", draws=1000,
+                  tune=1000, chains=4, likelihood='game', random_seed=0, output_file=BENCHMARK_FILE):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    requested = NUTS_SAMPLERS if samplers is None else samplers
+    samplers = available_samplers(requested)
+    for sampler in requested:
+        if sampler not in samplers:
+            logging.warning(f"Skipping {sampler}, its package is not installed")
+
+    results = []
+    for player_name, team_name in zip(player_names, team_names):
+        player_df, _, _, _ = load_and_prepare_data(player_name, f"{player_name}_df.csv",
+                                                   f"{team_name}_schedule_2425_formatted.csv", team_mapping_file)
+        for sampler in samplers:
+            # A fresh model per backend, so no backend reuses another's compiled functions
+            model = build_model(player_df, likelihood=likelihood)
+            logging.info(f"Benchmarking {sampler} on {player_name}")
+            result = benchmark_sampler(model, sampler, draws=draws, tune=tune, chains=chains,
+                                       random_seed=random_seed)
+            results.append({'player': player_name, **result})
+
+    results = pd.DataFrame(results)
+    results.to_csv(output_file, index=False)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare NUTS backends on the bundled players')
+    parser.add_argument('--samplers', nargs='+', choices=NUTS_SAMPLERS, default=None,
+                        help='backends to compare (default: every installed one)')
+    parser.add_argument('--draws', type=int, default=1000)
+    parser.add_argument('--tune', type=int, default=1000)
+    parser.add_argument('--chains', type=int, default=4)
+    parser.add_argument('--likelihood', choices=['game', 'cell'], default='game')
+    args = parser.parse_args()
+
+    results = run_benchmark(PLAYER_NAMES, TEAM_NAMES, samplers=args.samplers, draws=args.draws, tune=args.tune,
+                            chains=args.chains, likelihood=args.likelihood)
+    print(results.to_string(index=False))
+    # Mean over players, fastest backend first
+    summary = results.groupby('sampler')[['compile_time', 'sampling_time', 'ess_per_sec', 'ess_per_wall_sec']].mean()
+    print(summary.sort_values('ess_per_wall_sec', ascending=False).to_string())
@@ -0,0 +1,263 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import arviz as az
+import numpy as np
+import pandas as pd
+import pymc as pm
+
+from analysis import summarize
+from data_prep_bayesian import ingest_game_logs, player_view
+from data_prep_schedules import format_league_schedules, team_schedule_view
+from game_level_modelling import INPUT_DIR, OUTPUT_DIR, build_model, prepare_data
+from predictive import add_predictions
+
+BENCHMARK_DIR = os.path.join(OUTPUT_DIR, 'benchmarks')
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baselines.json')
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, 'latest.json')
+
+# Raw hockey-reference layouts of the _df.txt and _schedule_2425.txt files
+GAME_LOG_HEADER = ['Rk', 'Date', 'G', 'Age', 'Tm', '', 'Opp', '', 'G', 'A', 'PTS', '+/-', 'PIM', 'EV', 'PP', 'SH',
+                   'GW', 'EV', 'PP', 'SH', 'S', 'S%', 'SHFT', 'TOI', 'HIT', 'BLK', 'FOW', 'FOL', 'FO%']
+SCHEDULE_HEADER = ['GP', 'Date', 'Time', '', 'Opponent', 'GF', 'GA', '', '', 'W', 'L', 'OL', 'Streak', 'Att.', 'LOG',
+                   'Notes']
+# Season whose schedule is projected; game logs run back from the season before it
+CURRENT_SEASON_START = 2024
+
+# Parameters timed together: ESS/sec of the slowest-mixing element in each group
+PARAMETER_GROUPS = {
+    'player_trend': ['mu_assists_t', 'mu_goals_t'],
+    'opponent': ['mu_assists_team', 'mu_goals_team', 'sigma_assists_team', 'sigma_goals_team', 'rho_a', 'rho_g'],
+    'home': ['b_home'],
+    'goal_effect': ['beta_goal'],
+}
+# A time more than this fraction above its baseline (or an ESS/sec this fraction below) is a regression
+TOLERANCE = 0.25
+
+
+def season_dates(start_year, n_games, rng):
+    # Game days from early October, one to three days apart
+    gaps = rng.integers(1, 4, size=n_games)
+    return pd.Timestamp(f'{start_year}-10-08') + pd.to_timedelta(np.cumsum(gaps), unit='D')
+
+
+def synthetic_game_log(n_seasons, games_per_season, current_games, team_abbrev, opponents, rng):
+    # One player's raw game log: the current season's games first, then one block per season, newest first,
+    # with goals and assists from a per-season Poisson rate
+    seasons = [(CURRENT_SEASON_START, current_games)] + [(CURRENT_SEASON_START - s, games_per_season)
+                                                         for s in range(1, n_seasons + 1)]
+    blocks = []
+    for start_year, n_games in seasons:
+        if n_games == 0:
+            continue
+        goals = rng.poisson(rng.uniform(0.15, 0.5), size=n_games)
+        assists = rng.poisson(rng.uniform(0.25, 0.7), size=n_games)
+        pp_goals = rng.binomial(goals, 0.25)
+        sh_goals = rng.binomial(goals - pp_goals, 0.05)
+        pp_assists = rng.binomial(assists, 0.3)
+        sh_assists = rng.binomial(assists - pp_assists, 0.03)
+        shots = goals + rng.poisson(2.5, size=n_games)
+        toi = rng.integers(14 * 60, 24 * 60, size=n_games)
+        shooting = np.where(shots > 0, np.round(100 * goals / np.maximum(shots, 1), 1), np.nan)
+        blocks.append(pd.DataFrame([
+            np.arange(1, n_games + 1),
+            season_dates(start_year, n_games, rng).strftime('%Y-%m-%d'),
+            np.arange(1, n_games + 1),
+            np.full(n_games, '25-100'),
+            np.full(n_games, team_abbrev),
+            np.where(rng.random(n_games) < 0.5, '@', ''),
+            rng.choice(opponents, size=n_games),
+            rng.choice(['W', 'L', 'L-OT'], size=n_games),
+            goals, assists, goals + assists,
+            rng.integers(-3, 4, size=n_games),
+            2 * rng.binomial(1, 0.2, size=n_games),
+            goals - pp_goals - sh_goals, pp_goals, sh_goals, rng.binomial(goals, 0.15),
+            assists - pp_assists - sh_assists, pp_assists, sh_assists,
+            shots, shooting,
+            rng.integers(18, 32, size=n_games),
+            [f'{t // 60}:{t % 60:02d}' for t in toi],
+            rng.poisson(1.0, size=n_games), rng.poisson(0.8, size=n_games),
+            np.zeros(n_games, dtype=int), np.zeros(n_games, dtype=int), np.full(n_games, np.nan),
+        ]).T)
+    return pd.concat(blocks, ignore_index=True)
+
+
+def synthetic_schedule(n_games, opponents, rng):
+    dates = season_dates(CURRENT_SEASON_START, n_games, rng)
+    columns = [np.arange(1, n_games + 1), dates.strftime('%Y-%m-%d'), np.full(n_games, '7:00 PM'),
+               np.where(rng.random(n_games) < 0.5, '@', ''), rng.choice(opponents, size=n_games)]
+    columns += [np.full(n_games, '')] * (len(SCHEDULE_HEADER) - len(columns))
+    return pd.DataFrame(columns).T
+
+
+def generate_synthetic_inputs(input_dir, n_players=2, n_seasons=3, games_per_season=82, current_games=20,
+                              random_seed=0):
+    # Raw game logs and schedules of controlled size in input_dir, plus the team mapping they refer to.
+    # Returns player name -> team name.
+    os.makedirs(input_dir, exist_ok=True)
+    shutil.copy(os.path.join(INPUT_DIR, 'team_mapping.csv'), input_dir)
+    team_mapping = pd.read_csv(os.path.join(input_dir, 'team_mapping.csv'))
+    rng = np.random.default_rng(random_seed)
+
+    player_teams = {}
+    for p in range(n_players):
+        team = team_mapping.iloc[p % len(team_mapping)]
+        others = team_mapping[team_mapping['id'] != team['id']]
+        player_name, team_name = f'Synthetic Player {p}', f'synthetic{p}'
+        synthetic_game_log(n_seasons, games_per_season, current_games, team['abbreviation'],
+                           others['abbreviation'].to_numpy(), rng).to_csv(
+            os.path.join(input_dir, f'{player_name}_df.txt'), header=GAME_LOG_HEADER, index=False)
+        synthetic_schedule(games_per_season, others['team_name_2'].to_numpy(), rng).to_csv(
+            os.path.join(input_dir, f'{team_name}_schedule_2425.txt'), header=SCHEDULE_HEADER, index=False)
+        player_teams[player_name] = team_name
+    return player_teams
+
+
+def timed(function, *args, repeat=1, **kwargs):
+    # Best of repeat calls, as (seconds, result of the last call)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def ess_per_sec(trace, sampling_time, groups=PARAMETER_GROUPS):
+    ess = az.ess(trace, method='bulk')
+    return {group: min(float(ess[var].min()) for var in variables) / sampling_time
+            for group, variables in groups.items()}
+
+
+def run_suite(n_players=2, n_seasons=3, games_per_season=82, current_games=20, draws=200, tune=200, chains=2,
+              likelihood='game', repeat=3, random_seed=0, benchmark_dir=BENCHMARK_DIR):
+    # Times every stage on freshly generated synthetic players: data prep (best of repeat), then per player
+    # model build, compilation, sampling and the predictive pass, then the report summaries over all players
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = {'players': n_players, 'seasons': n_seasons, 'games_per_season': games_per_season,
+              'current_games': current_games, 'draws': draws, 'tune': tune, 'chains': chains,
+              'likelihood': likelihood}
+    input_dir = os.path.join(benchmark_dir, 'inputs')
+    player_teams = generate_synthetic_inputs(input_dir, n_players, n_seasons, games_per_season, current_games,
+                                             random_seed)
+    team_names = sorted(set(player_teams.values()))
+
+    times = {}
+    times['format_schedules'], league_schedule = timed(format_league_schedules, team_names, input_dir,
+                                                       repeat=repeat)
+    times['ingest_game_logs'], games = timed(ingest_game_logs, player_teams, league_schedule, input_dir,
+                                             repeat=repeat)
+    times['prepare_data'], prepared = timed(
+        lambda: {player_name: prepare_data(player_view(games, player_name),
+                                           team_schedule_view(league_schedule, team_name), 'team_mapping.csv')
+                 for player_name, team_name in player_teams.items()}, repeat=repeat)
+
+    for stage in ['build_model', 'compile', 'sampling', 'predict']:
+        times[stage] = 0.0
+    group_rates = {group: [] for group in PARAMETER_GROUPS}
+    draws_by_stat = {stat: {} for stat in ['points', 'goals', 'assists']}
+    for player_name, (player_df, remaining_schedule, curr_assists, curr_goals) in prepared.items():
+        logging.info(f"Benchmarking {player_name}")
+        seconds, model = timed(build_model, player_df, likelihood=likelihood)
+        times['build_model'] += seconds
+        with model:
+            # Building the NUTS step compiles the logp and gradient
+            seconds, step = timed(pm.NUTS)
+            times['compile'] += seconds
+            trace = pm.sample(draws, tune=tune, chains=chains, step=step, random_seed=random_seed,
+                              return_inferencedata=True, progressbar=False, compute_convergence_checks=False)
+        sampling_time = trace.posterior.attrs['sampling_time']
+        times['sampling'] += sampling_time
+        for group, rate in ess_per_sec(trace, sampling_time).items():
+            group_rates[group].append(rate)
+        seconds, _ = timed(add_predictions, trace, remaining_schedule, curr_assists, curr_goals)
+        times['predict'] += seconds
+        for stat in draws_by_stat:
+            draws_by_stat[stat][player_name] = trace.posterior[f'pred_total_{stat}'].values.ravel()
+
+    times['summarize'], _ = timed(lambda: [summarize(draws, stat) for stat, draws in draws_by_stat.items()],
+                                  repeat=repeat)
+
+    metrics = {f'time/{stage}': seconds for stage, seconds in times.items()}
+    # Mean over players
+    metrics.update({f'ess_per_sec/{group}': float(np.mean(rates)) for group, rates in group_rates.items()})
+    return {'config': config, 'metrics': metrics, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'versions': {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+                         'pymc': pm.__version__}}
+
+
+def config_key(config):
+    return ','.join(f'{key}={value}' for key, value in sorted(config.items()))
+
+
+def load_baselines(baseline_file=BASELINE_FILE):
+    if not os.path.exists(baseline_file):
+        return {}
+    with open(baseline_file) as f:
+        return json.load(f)
+
+
+def save_baseline(result, baseline_file=BASELINE_FILE):
+    # One baseline per configuration, replacing an older one
+    baselines = load_baselines(baseline_file)
+    baselines[config_key(result['config'])] = result
+    with open(baseline_file, 'w') as f:
+        json.dump(baselines, f, indent=2)
+
+
+def compare_to_baseline(result, baseline, tolerance=TOLERANCE):
+    # Table of every metric against the baseline; times regress upwards, ESS/sec downwards
+    rows = []
+    for metric, value in result['metrics'].items():
+        base = baseline['metrics'].get(metric)
+        if base is None:
+            continue
+        ratio = value / base if base else np.nan
+        if metric.startswith('time/'):
+            regression = ratio > 1 + tolerance
+        else:
+            regression = ratio < 1 / (1 + tolerance)
+        rows.append({'metric': metric, 'baseline': base, 'current': value, 'ratio': ratio,
+                     'regression': bool(regression)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on synthetic players and compare the '
+                                                 'results against a stored baseline')
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--seasons', type=int, default=3, help='completed seasons per player')
+    parser.add_argument('--games', type=int, default=82, help='games per season')
+    parser.add_argument('--current-games', type=int, default=20, help='games already played this season')
+    parser.add_argument('--draws', type=int, default=200)
+    parser.add_argument('--tune', type=int, default=200)
+    parser.add_argument('--chains', type=int, default=2)
+    parser.add_argument('--likelihood', choices=['game', 'cell'], default='game')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each data prep stage, the fastest counts')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline for its config')
+    args = parser.parse_args()
+
+    result = run_suite(args.players, args.seasons, args.games, args.current_games, draws=args.draws,
+                       tune=args.tune, chains=args.chains, likelihood=args.likelihood, repeat=args.repeat)
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    baseline = load_baselines().get(config_key(result['config']))
+    if baseline is None:
+        print(pd.Series(result['metrics']).round(4).to_string())
+        print("No baseline for this configuration yet (store one with --save-baseline)")
+    else:
+        comparison = compare_to_baseline(result, baseline, args.tolerance)
+        print(comparison.round(4).to_string(index=False))
+        print(f"Compared against the baseline from {baseline['timestamp']}")
+    if args.save_baseline:
+        save_baseline(result)
+        print(f"Baseline saved to {BASELINE_FILE}")
+    elif baseline is not None and comparison['regression'].any():
+        sys.exit(f"Regressions: {', '.join(comparison.loc[comparison['regression'], 'metric'])}")
@@ -1,70 +1,66 @@
 import pandas as pd
-import datetime
-from datetime import datetime, timedelta
+import numpy as np
 import os
 
-def process_player_data(player_name, team_name):
-    INPUT_DIR = os.path.join('inputs')
-    schedule_file = f'{team_name}_schedule_2425_formatted.csv'
-
-    # Read the Jack Hughes data
-    df = pd.read_csv(os.path.join(INPUT_DIR, f'{player_name}_df.txt'), delimiter=',')
-    schedule = pd.read_csv(os.path.join(INPUT_DIR, schedule_file))
-
-    # Replace 'PHX' with 'ARI' and 'ATL' with 'WPG' in the 'Opp' column
-    df['Opp'] = df['Opp'].replace({'PHX': 'ARI', 'ATL': 'WPG'})
-
-
-
-    # Function to convert age to birth date
-    def age_to_birthdate(age_str, game_date):
-        years, days = map(int, age_str.split('-'))
-        game_date = datetime.strptime(game_date, '%Y-%m-%d')
-        birth_date = game_date - timedelta(days=days) - timedelta(days=years*365)
-        return birth_date
-
-    def load_team_mapping(mapping_file):
-        team_mapping = pd.read_csv(mapping_file)
-        full_name_to_id = dict(zip(team_mapping['team_name'], team_mapping['id']))
-        abbrev_to_id = dict(zip(team_mapping['abbreviation'], team_mapping['id']))
-        full_name_to_abbrev = dict(zip(team_mapping['team_name'], team_mapping['abbreviation']))
-        return full_name_to_id, abbrev_to_id, full_name_to_abbrev
-
-
-    # Calculate season2
-    def calculate_season(date):
-        game_date = pd.to_datetime(date)
-        age = (game_date - birth_date).days / 365.25  # More precise calculation
-        return int(age) + 1
-
-    def time_to_seconds(time_str):
-        parts = time_str.split(':')
-        if len(parts) == 2:
-            minutes, seconds = map(int, parts)
-            return minutes * 60 + seconds
-        elif len(parts) == 3:
-            hours, minutes, seconds = map(int, parts)
-            return hours * 3600 + minutes * 60 + seconds
-        else:
-            raise ValueError(f"Unexpected time format: {time_str}")
-
-    # Get birth date from the first game
-    birth_date = age_to_birthdate(df['Age'].iloc[0], df['Date'].iloc[0])
-
-    # Function to calculate season
-    def get_season(date):
-        year = int(date[:4])
-        month = int(date[5:7])
-        if month >= 9:
-            return f"{year}{year+1-2000}"
-        else:
-            return f"{year-1}{year-2000}"
-
-    # Create new dataframe with desired columns
-    new_df = pd.DataFrame()
-
+INPUT_DIR = os.path.join('inputs')
+GAME_LOG_SUFFIX = '_df.txt'
+CURRENT_SEASON = '202425'
+
+# Reorder columns to match McDavid's data
+COLUMN_ORDER = ['Date', 'Team', 'Goals', 'Assists', 'Points', 'Plusminus', 'PIM', 'PPG', 'PPP', 'SHG', 'SHP', 'GWG',
+                'OTG', 'Shots', 'TOI', 'Shifts', 'Year', 'season', 'Home', 'toi2', 'toi3', 'toi_seconds', 'opponent',
+                'opp_2', 'Hits', 'Blocks', 'SHA']
+# Opponent effects are (team, season) matrices indexed directly by the ids of team_mapping.csv, 0 to 31
+NUM_TEAMS = 32
+
+
+def load_team_mapping(mapping_file):
+    team_mapping = pd.read_csv(mapping_file)
+    full_name_to_id = dict(zip(team_mapping['team_name'], team_mapping['id']))
+    abbrev_to_id = dict(zip(team_mapping['abbreviation'], team_mapping['id']))
+    full_name_to_abbrev = dict(zip(team_mapping['team_name'], team_mapping['abbreviation']))
+    return full_name_to_id, abbrev_to_id, full_name_to_abbrev
+
+
+def opponent_index(opp_int):
+    # Row of each opponent in the opponent effect matrices. An id outside them would silently wrap around
+    # (id -1 is the last team), so it is an error.
+    opp_idx = np.asarray(opp_int).astype('int32')
+    outside = (opp_idx < 0) | (opp_idx >= NUM_TEAMS)
+    if outside.any():
+        raise ValueError(f"Team ids {sorted(set(opp_idx[outside].tolist()))} outside 0..{NUM_TEAMS - 1}, "
+                         f"NUM_TEAMS no longer matches team_mapping.csv")
+    return opp_idx
+
+
+def toi_to_seconds(toi):
+    # Vectorized 'MM:SS' / 'HH:MM:SS' -> seconds
+    parts = toi.str.split(':', expand=True)
+    if parts.shape[1] not in (2, 3) or parts[1].isna().any():
+        raise ValueError(f"Unexpected time format in: {toi[parts[1].isna()].unique()[:5]}")
+    parts = parts.astype(float)
+    if parts.shape[1] == 2:
+        return (parts[0] * 60 + parts[1]).astype(int)
+    three_parts = parts[2].notna()
+    seconds = np.where(three_parts, parts[0] * 3600 + parts[1] * 60 + parts[2], parts[0] * 60 + parts[1])
+    return pd.Series(seconds.astype(int), index=toi.index)
+
+
+def date_to_season(dates):
+    # Vectorized season label: games from September on belong to the season starting that year, e.g. '202324'
+    year = dates.str[:4].astype(int)
+    month = dates.str[5:7].astype(int)
+    start = year - (month < 9).astype(int)
+    return start.astype(str) + (start + 1 - 2000).astype(str)
+
+
+def format_game_logs(df):
+    # Raw hockey-reference game logs (one or many players) -> the modelling layout
+    opp = df['Opp'].replace({'PHX': 'ARI', 'ATL': 'WPG'})
+
+    new_df = pd.DataFrame(index=df.index)
     new_df['Date'] = df['Date']
-    new_df['Team'] = df['Unnamed: 5'].fillna('vs') + ' ' + df['Opp']
+    new_df['Team'] = df['Unnamed: 5'].fillna('vs') + ' ' + opp
     new_df['Goals'] = df['G.1']
     new_df['Assists'] = df['A']
     new_df['Points'] = df['PTS']
@@ -73,66 +69,101 @@ def process_player_data(player_name, team_name):
     new_df['PPG'] = df['PP']
     new_df['PPP'] = df['PP']  # Assuming PP points are same as PP goals for now
     new_df['SHG'] = df['SH']
-    new_df['SHP'] = df['SH'] # Assuming SH points are same as SH goals for now
+    new_df['SHP'] = df['SH']  # Assuming SH points are same as SH goals for now
     new_df['GWG'] = df['GW']
     new_df['OTG'] = 0  # This information is not in the original data
     new_df['Shots'] = df['S']
     new_df['TOI'] = df['TOI']
     new_df['Shifts'] = df['SHFT']
     new_df['Year'] = pd.to_datetime(df['Date']).dt.year
-    new_df['season'] = df['Date'].apply(get_season)
+    new_df['season'] = date_to_season(df['Date'])
     new_df['Home'] = new_df['Team'].str.contains('vs').astype(int)
     new_df['toi2'] = df['TOI']
     new_df['toi3'] = df['TOI']
-    new_df['toi_seconds'] = df['TOI'].apply(time_to_seconds)
-    new_df['opponent'] = df['Opp'].str.replace('@', '')
+    new_df['toi_seconds'] = toi_to_seconds(df['TOI'])
+    new_df['opponent'] = opp.str.replace('@', '')
     new_df['opp_2'] = new_df['opponent']
-    #new_df['season2'] = df['Date'].apply(calculate_season)
+    # Not recorded in older seasons, left missing rather than zero
+    new_df['Hits'] = df['HIT'].astype('Int64')
+    new_df['Blocks'] = df['BLK'].astype('Int64')
+    new_df['SHA'] = df['SH.1'].astype('Int64')
+    return new_df[COLUMN_ORDER]
+
+
+def season_start_rows(first_games, full_name_to_abbrev):
+    # Placeholder 2024-25 rows (no stats) built from each team's first scheduled game
+    opponent = first_games['Opponent'].map(full_name_to_abbrev).fillna(first_games['Opponent'])
+    dummy_rows = pd.DataFrame({column: 0 for column in COLUMN_ORDER}, index=first_games.index)
+    dummy_rows['Date'] = first_games['Date']
+    dummy_rows['Team'] = first_games['Vs'] + ' ' + opponent
+    dummy_rows[['TOI', 'toi2', 'toi3']] = '00:00'
+    dummy_rows['Year'] = 2024
+    dummy_rows['season'] = CURRENT_SEASON
+    dummy_rows['Home'] = (first_games['Vs'] == 'vs').astype(int)
+    dummy_rows['opponent'] = opponent
+    dummy_rows['opp_2'] = opponent
+    return dummy_rows[COLUMN_ORDER]
+
+
+def ingest_game_logs(player_teams, league_schedule=None, input_dir=INPUT_DIR):
+    # Parse every player's _df.txt in one pass, returning one long table with a 'player' column.
+    # player_teams maps player name -> team name, whose schedule supplies the 2024-25 placeholder rows. The
+    # teams are passed in rather than discovered: a player without a 2024-25 game yet has only last season's
+    # team in their log (wrong after a trade or signing), and team_mapping.csv has no schedule file names
+    # ('devils', ...) to map an abbreviation to.
+    full_name_to_id, abbrev_to_id, full_name_to_abbrev = load_team_mapping(os.path.join(input_dir, "team_mapping.csv"))
+    if league_schedule is None:
+        from data_prep_schedules import format_league_schedules
+        league_schedule = format_league_schedules(sorted(set(player_teams.values())), input_dir)
+
+    player_names = list(player_teams)
+    raw = pd.concat([pd.read_csv(os.path.join(input_dir, f"{player_name}{GAME_LOG_SUFFIX}"), delimiter=',')
+                     for player_name in player_names],
+                    keys=player_names, names=['player', 'row'])
+    games = format_game_logs(raw.reset_index(level='row', drop=True)).reset_index()
+
+    # Check which players have no 2024-2025 games yet and add a placeholder for all of them at once
+    has_current = games.loc[games['season'] == CURRENT_SEASON, 'player'].unique()
+    missing = [player_name for player_name in player_names if player_name not in set(has_current)]
+    if missing:
+        first_games = league_schedule.xs(1, level='game_number').reindex([player_teams[p] for p in missing])
+        first_games.index = pd.Index(missing, name='player')
+        games = pd.concat([games, season_start_rows(first_games, full_name_to_abbrev).reset_index()],
+                          ignore_index=True)
+        # Keep each player's rows together, placeholder last
+        games = games.iloc[np.argsort(games['player'].map({p: i for i, p in enumerate(player_names)}).to_numpy(),
+                                      kind='stable')].reset_index(drop=True)
+
+    games['opp_int'] = games['opponent'].map(abbrev_to_id).astype('Int64')
+    games['player'] = pd.Categorical(games['player'], categories=player_names)
+    return games
+
+
+def player_view(games, player_name):
+    # One player's rows in the layout of the _df.csv files (or the subset of columns that was loaded)
+    columns = [column for column in COLUMN_ORDER if column in games.columns]
+    return games.loc[games['player'] == player_name, columns].reset_index(drop=True)
+
+
+def write_player_csvs(games, input_dir=INPUT_DIR):
+    for player_name in games['player'].cat.categories:
+        player_view(games, player_name).to_csv(os.path.join(input_dir, f'{player_name}_df.csv'), index=False)
 
-    # Reorder columns to match McDavid's data
-    column_order = ['Date', 'Team', 'Goals', 'Assists', 'Points', 'Plusminus', 'PIM', 'PPG', 'PPP', 'SHG', 'SHP', 'GWG', 'OTG', 'Shots', 'TOI', 'Shifts', 'Year', 'season', 'Home', 'toi2', 'toi3', 'toi_seconds', 'opponent', 'opp_2']
-    new_df = new_df[column_order]
 
-    # Check if 2024-2025 season exists
-    team_mapping_file = "team_mapping.csv"
-    full_name_to_id, abbrev_to_id, full_name_to_abbrev = load_team_mapping(os.path.join(INPUT_DIR, team_mapping_file))
-    first_game = schedule.iloc[0]
-
-    if '202425' not in new_df['season'].values:
-        # Create a dummy row for 2024-2025 season
-        dummy_row = pd.DataFrame({
-            'Date': [first_game['Date']],  # Example date, adjust as needed
-            'Team': [f"{first_game['Vs']} {full_name_to_abbrev.get(first_game['Opponent'], first_game['Opponent'])}"],
-            'Goals': [0],
-            'Assists': [0],
-            'Points': [0],
-            'Plusminus': [0],
-            'PIM': [0],
-            'PPG': [0],
-            'PPP': [0],
-            'SHG': [0],
-            'SHP': [0],
-            'GWG': [0],
-            'OTG': [0],
-            'Shots': [0],
-            'TOI': ['00:00'],
-            'Shifts': [0],
-            'Year': ['2024'],
-            'season': ['202425'],
-            'Home': [1 if first_game['Vs'] == 'vs' else 0],
-            'toi2': ['00:00'],
-            'toi3': ['00:00'],
-            'toi_seconds': [0],
-            'opponent': [full_name_to_abbrev.get(first_game['Opponent'], first_game['Opponent'])],
-            'opp_2': [full_name_to_abbrev.get(first_game['Opponent'], first_game['Opponent'])],
-        })
-
-        # Append the dummy row to new_df
-        new_df = pd.concat([new_df, dummy_row], ignore_index=True)
+def process_player_data(player_name, team_name):
+    schedule_file = f'{team_name}_schedule_2425_formatted.csv'
+    schedule = pd.read_csv(os.path.join(INPUT_DIR, schedule_file))
+    full_name_to_id, abbrev_to_id, full_name_to_abbrev = load_team_mapping(os.path.join(INPUT_DIR, "team_mapping.csv"))
+
+    df = pd.read_csv(os.path.join(INPUT_DIR, f'{player_name}{GAME_LOG_SUFFIX}'), delimiter=',')
+    new_df = format_game_logs(df)
 
+    # Check if 2024-2025 season exists
+    if CURRENT_SEASON not in new_df['season'].values:
+        new_df = pd.concat([new_df, season_start_rows(schedule.iloc[[0]], full_name_to_abbrev)], ignore_index=True)
 
     # Save to CSV
     new_df.to_csv(os.path.join(INPUT_DIR, f'{player_name}_df.csv'), index=False)
 
     print(f"Data has been reformatted and saved to '{player_name}_df.csv'")
-    return new_df
\ No newline at end of file
+    return new_df
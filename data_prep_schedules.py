@@ -1,42 +1,83 @@
 import pandas as pd
-from datetime import datetime
+import glob
 import os
 
-def format_team_schedule(team_name):
-    INPUT_DIR = os.path.join('inputs')
-    # Read the Devils schedule
-    devils_schedule = pd.read_csv(os.path.join(INPUT_DIR, f"{team_name}_schedule_2425.txt"))
-    team_mapping = pd.read_csv(os.path.join(INPUT_DIR, "team_mapping.csv"))
+INPUT_DIR = os.path.join('inputs')
+SCHEDULE_SUFFIX = '_schedule_2425.txt'
+
 
-    # Create a dictionary for team name mapping
+def load_team_name_mapping(input_dir=INPUT_DIR):
+    team_mapping = pd.read_csv(os.path.join(input_dir, "team_mapping.csv"))
+    # Full franchise name (as in the raw schedules) -> team_name and id used everywhere else
     team_name_mapping = dict(zip(team_mapping['team_name_2'], team_mapping['team_name']))
+    team_id_mapping = dict(zip(team_mapping['team_name'], team_mapping['id']))
+    return team_name_mapping, team_id_mapping
+
+
+def available_teams(input_dir=INPUT_DIR):
+    return sorted(os.path.basename(path)[:-len(SCHEDULE_SUFFIX)]
+                  for path in glob.glob(os.path.join(input_dir, f"*{SCHEDULE_SUFFIX}")))
+
+
+def format_league_schedules(team_names=None, input_dir=INPUT_DIR):
+    # All teams' raw schedules formatted at once, as one long table indexed by (team, game_number)
+    team_names = available_teams(input_dir) if team_names is None else list(team_names)
+    team_name_mapping, team_id_mapping = load_team_name_mapping(input_dir)
 
-    # Create a new DataFrame with the desired structure
-    formatted_schedule = pd.DataFrame(columns=["", "Date", "Vs", "Opponent"])
+    raw = pd.concat([pd.read_csv(os.path.join(input_dir, f"{team_name}{SCHEDULE_SUFFIX}")) for team_name in team_names],
+                    keys=team_names, names=['team', 'row'])
 
-    # Fill the new DataFrame
-    for index, row in devils_schedule.iterrows():
-        date = datetime.strptime(row['Date'], '%Y-%m-%d')
-        formatted_date = date.strftime('%a, %b %d')
+    # The home/away marker is the unnamed column right before the opponent
+    away = raw.iloc[:, 3].eq('@').to_numpy()
+    # Replace 'Utah Hockey Club' with 'Arizona Coyotes', then map to the team_name from the mapping table
+    opponent = raw['Opponent'].replace({'Utah Hockey Club': 'Arizona Coyotes'})
+    opponent = opponent.map(team_name_mapping).fillna(opponent)
 
-        vs = "@" if pd.notna(row.iloc[3]) and row.iloc[3] == '@' else "vs"
+    league_schedule = pd.DataFrame({
+        'team': raw.index.get_level_values('team'),
+        'game_number': raw.groupby(level='team').cumcount().to_numpy() + 1,
+        'game_date': pd.to_datetime(raw['Date'], format='%Y-%m-%d').to_numpy(),
+        'Date': pd.to_datetime(raw['Date'], format='%Y-%m-%d').dt.strftime('%a, %b %d').to_numpy(),
+        'Vs': pd.Series(away).map({True: '@', False: 'vs'}).to_numpy(),
+        'Home': (~away).astype(int),
+        'Opponent': opponent.to_numpy(),
+        'opp_int': opponent.map(team_id_mapping).astype('Int64').to_numpy(),
+    })
+    league_schedule['team'] = league_schedule['team'].astype('category')
+    return league_schedule.set_index(['team', 'game_number'])
 
-        # Replace 'Utah Hockey Club' with 'Arizona Coyotes'
-        opponent = 'Arizona Coyotes' if row['Opponent'] == 'Utah Hockey Club' else row['Opponent']
-        # Map the opponent name to the team_name from the mapping table
-        opponent = team_name_mapping.get(opponent, opponent)
 
-        new_row = pd.DataFrame({
-            "": [str(index + 1)],
-            "Date": [formatted_date],
-            "Vs": [vs],
-            "Opponent": opponent
-        })
+def team_schedule_view(league_schedule, team_name):
+    # One team's schedule in the layout of the _schedule_2425_formatted.csv files
+    team_schedule = league_schedule.xs(team_name, level='team')
+    return pd.DataFrame({
+        "": team_schedule.index.astype(str),
+        "Date": team_schedule['Date'].to_numpy(),
+        "Vs": team_schedule['Vs'].to_numpy(),
+        "Opponent": team_schedule['Opponent'].to_numpy(),
+    })
 
-        formatted_schedule = pd.concat([formatted_schedule, new_row], ignore_index=True)
+
+def write_team_schedules(league_schedule, input_dir=INPUT_DIR):
+    team_schedules = {}
+    for team_name in league_schedule.index.unique(level='team'):
+        team_schedules[team_name] = team_schedule_view(league_schedule, team_name)
+        team_schedules[team_name].to_csv(os.path.join(input_dir, f"{team_name}_schedule_2425_formatted.csv"),
+                                         index=False)
+    return team_schedules
+
+
+def format_team_schedule(team_name):
+    formatted_schedule = team_schedule_view(format_league_schedules([team_name]), team_name)
 
     # Save the formatted schedule
     formatted_schedule.to_csv(os.path.join(INPUT_DIR, f"{team_name}_schedule_2425_formatted.csv"), index=False)
 
     print(formatted_schedule.head())
-    return formatted_schedule
\ No newline at end of file
+    return formatted_schedule
+
+
+if __name__ == '__main__':
+    league_schedule = format_league_schedules()
+    write_team_schedules(league_schedule)
+    print(league_schedule.head())
@@ -0,0 +1,271 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_prep_bayesian import opponent_index
+from predictive import game_rates
+
+INPUT_DIR = os.path.join('inputs')
+OUTPUT_DIR = os.path.join('outputs')
+
+# Partial kkupfl scoring (see data_prep.py), used when the players only have the goals and assists model: shots,
+# blocks, hits and the short-handed bonus are then left out of simulated seasons, which favours the scorers. With
+# every player's multi-stat trace (multistat.py) seasons are scored in full, with multistat.FANTASY_WEIGHTS.
+SCORING_WEIGHTS = {'goals': 4.5, 'assists': 3.0}
+# Upper bound on the number of elements in any block of rates or draws held at once
+MAX_CHUNK_ELEMENTS = 2 ** 24
+
+_state = None
+
+
+def game_weeks(game_dates, season_start=None):
+    # Fantasy week of each game, weeks running Monday to Sunday from the week of season_start
+    game_dates = pd.to_datetime(pd.Series(game_dates))
+    season_start = game_dates.min() if season_start is None else pd.Timestamp(season_start)
+    first_monday = season_start.normalize() - pd.Timedelta(days=season_start.weekday())
+    return ((game_dates - first_monday).dt.days // 7).to_numpy()
+
+
+def weekly_rates(posterior, remaining_schedule, weeks, n_weeks):
+    # (draw, week) expected goals and assists of one player: a week's games sum to one Poisson rate
+    week_onehot = np.zeros((len(weeks), n_weeks))
+    week_onehot[np.arange(len(weeks)), weeks] = 1
+    return {stat: rate.reshape(-1, rate.shape[-1]) @ week_onehot
+            for stat, rate in game_rates(posterior, remaining_schedule).items()}
+
+
+def multistat_weekly_rates(posterior, remaining_schedule, weeks, n_weeks):
+    # weekly_rates of every stat of a multi-stat posterior, in its current (last) season
+    week_onehot = np.zeros((len(weeks), n_weeks))
+    week_onehot[np.arange(len(weeks)), weeks] = 1
+    opp_idx = opponent_index(remaining_schedule['opp_int'])
+    home = remaining_schedule['Home'].values
+    # (chain, draw, stat, game)
+    rate = np.exp(posterior['mu_t'].values[..., -1, None] + posterior['mu_team'].values[:, :, :, opp_idx, -1] +
+                  home * posterior['b_home'].values[..., None])
+    return {stat: rate[:, :, s].reshape(-1, len(weeks)) @ week_onehot
+            for s, stat in enumerate(posterior['stat'].values)}
+
+
+def stack_rates(player_rates):
+    # Per-player weekly rates with different numbers of draws -> (player, max draws, week) arrays, padded
+    n_draws = np.array([rates['goals'].shape[0] for rates in player_rates])
+    n_weeks = player_rates[0]['goals'].shape[1]
+    stacked = {}
+    for stat in player_rates[0]:
+        stacked[stat] = np.zeros((len(player_rates), n_draws.max(), n_weeks))
+        for p, rates in enumerate(player_rates):
+            stacked[stat][p, :n_draws[p]] = rates[stat]
+    return stacked, n_draws
+
+
+def round_robin(n_rosters, n_weeks):
+    # (week, roster) -> opponent, by the circle method; with an odd count one roster per week has a bye
+    # (its opponent is itself)
+    slots = list(range(n_rosters)) + ([n_rosters] if n_rosters % 2 else [])
+    n_slots = len(slots)
+    matchups = np.empty((n_weeks, n_rosters), dtype=int)
+    for week in range(n_weeks):
+        rotation = n_slots - 1
+        order = [slots[0]] + [slots[1 + (i + week) % rotation] for i in range(rotation)]
+        opponents = dict(zip(order, order[::-1]))
+        matchups[week] = [opponents[r] if opponents[r] < n_rosters else r for r in range(n_rosters)]
+    return matchups
+
+
+def roster_rate_tables(rates, n_draws, rosters, fit_groups=None, max_chunk_elements=MAX_CHUNK_ELEMENTS):
+    # Each simulated season picks the posterior draws of every fit with one uniform u, scaled to each of its
+    # players' draw counts: players from the same roster fit share the draw (their parameters are correlated),
+    # players fitted separately (fit_groups, by default every player on their own) get independent draws. The
+    # draw indices only change at u = k / n_draws, so between those edges a fit's contribution to every
+    # roster's weekly rate is fixed: tabulate it once per interval. One (edges, tables) per fit, with tables of
+    # (interval, week, roster) per stat.
+    n_players, _, n_weeks = rates['goals'].shape
+    fit_groups = np.arange(n_players) if fit_groups is None else np.asarray(fit_groups)
+    group_tables = []
+    for group in np.unique(fit_groups):
+        players = np.flatnonzero(fit_groups == group)
+        edges = np.unique(np.concatenate([np.arange(n) / n for n in np.unique(n_draws[players])] + [[1.0]]))
+        midpoints = (edges[:-1] + edges[1:]) / 2
+        chunk = max(1, max_chunk_elements // (len(players) * n_weeks))
+        tables = {}
+        for stat in rates:
+            tables[stat] = np.concatenate([
+                rates[stat][players[None, :], (midpoints[start:start + chunk, None] * n_draws[players]).astype(int)]
+                .transpose(0, 2, 1) @ rosters[:, players].T
+                for start in range(0, len(midpoints), chunk)])
+        group_tables.append((edges[:-1], tables))
+    return group_tables
+
+
+def _init_worker(state):
+    global _state
+    _state = state
+
+
+def _simulate_chunk(size, seed):
+    group_tables, weights, matchups, roster_current = _state
+    rng = np.random.default_rng(seed)
+    season_rates = {stat: 0 for stat in weights}
+    for edges, tables in group_tables:
+        interval = np.searchsorted(edges, rng.random(size), side='right') - 1
+        for stat in weights:
+            season_rates[stat] = season_rates[stat] + tables[stat][interval]
+    points = np.zeros((size,) + matchups.shape)
+    for stat, weight in weights.items():
+        points += weight * rng.poisson(season_rates[stat])
+
+    opponent_points = np.take_along_axis(points, np.broadcast_to(matchups, points.shape), axis=2)
+    has_game = matchups != np.arange(matchups.shape[1])[None, :]
+    wins = (((points > opponent_points) + 0.5 * (points == opponent_points)) * has_game).sum(axis=1)
+    return {'points': roster_current + points.sum(axis=1), 'wins': wins}
+
+
+def simulate_seasons(rates, n_draws, rosters, matchups, n_seasons, current_points=None, chunk_size=None,
+                     weights=SCORING_WEIGHTS, random_seed=None, n_jobs=1, fit_groups=None):
+    # Streams simulated seasons in chunks: each yields the season points (seasons, roster) and head-to-head
+    # wins (seasons, roster). rosters is a (roster, player) 0/1 matrix; rosters are assumed not to share players.
+    # fit_groups labels the players fitted together (see roster_rate_tables).
+    # A roster's weekly goals (assists) are the sum of independent Poissons, i.e. one Poisson with the summed
+    # rate, so nothing is drawn per player. Every chunk has its own seed, so results do not depend on n_jobs.
+    global _state
+    rosters = np.asarray(rosters, dtype=float)
+    n_weeks, n_rosters = matchups.shape
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // (n_weeks * n_rosters))
+    current_points = np.zeros(rosters.shape[1]) if current_points is None else np.asarray(current_points)
+    group_tables = roster_rate_tables(rates, n_draws, rosters, fit_groups)
+    state = (group_tables, weights, matchups, rosters @ current_points)
+
+    sizes = [min(chunk_size, n_seasons - start) for start in range(0, n_seasons, chunk_size)]
+    seeds = np.random.SeedSequence(random_seed).spawn(len(sizes))
+    if n_jobs == 1:
+        _state = state
+        yield from map(_simulate_chunk, sizes, seeds)
+        _state = None
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(state,)) as pool:
+            yield from pool.map(_simulate_chunk, sizes, seeds)
+
+
+def summarize_seasons(chunks, roster_names):
+    # Running league table over the streamed chunks, nothing per season is kept
+    n_seasons = 0
+    points_sum = wins_sum = first = 0
+    for chunk in chunks:
+        n_seasons += len(chunk['wins'])
+        points_sum = points_sum + chunk['points'].sum(axis=0)
+        wins_sum = wins_sum + chunk['wins'].sum(axis=0)
+        # Most wins takes first place, points break ties
+        ranking = chunk['wins'] + chunk['points'] / (chunk['points'].max() + 1)
+        first = first + np.bincount(ranking.argmax(axis=1), minlength=len(roster_names))
+    summary = pd.DataFrame({'mean_points': points_sum / n_seasons, 'mean_wins': wins_sum / n_seasons,
+                            'p_first': first / n_seasons}, index=pd.Index(roster_names, name='roster'))
+    return summary.sort_values('p_first', ascending=False)
+
+
+def multistat_trace_file(player_name):
+    return os.path.join(OUTPUT_DIR, f"{player_name}_multistat_results.nc")
+
+
+def load_player_rates(player_teams, team_mapping_file="team_mapping.csv"):
+    # Weekly rates over each player's remaining schedule from their stored trace, fantasy points so far, the
+    # scoring weights and the fit each trace comes from (the 'fit' attribute of a roster fit's slices, otherwise
+    # the player's own). Every stat is scored when every player has a multi-stat trace, otherwise only goals
+    # and assists (one roster cannot be scored in full against another scored in part).
+    import arviz as az
+    from data_prep_schedules import format_league_schedules
+    from game_level_modelling import load_and_prepare_data
+    from trace_catalog import TraceCatalog
+
+    catalog = TraceCatalog()
+    full_scoring = all(os.path.exists(multistat_trace_file(player_name)) for player_name in player_teams)
+    if full_scoring:
+        from multistat import FANTASY_WEIGHTS, STATS, current_totals
+        weights = FANTASY_WEIGHTS
+    else:
+        weights = SCORING_WEIGHTS
+        missing = [player_name for player_name in player_teams if not os.path.exists(multistat_trace_file(player_name))]
+        logging.warning(f"No multi-stat trace for {', '.join(missing)}: scoring only goals and assists")
+    league_schedule = format_league_schedules(sorted(set(player_teams.values())))
+    season_start = league_schedule['game_date'].min()
+    n_weeks = int(game_weeks([league_schedule['game_date'].max()], season_start)[0]) + 1
+
+    player_rates, current_points, fits = [], [], []
+    for player_name, team_name in player_teams.items():
+        player_df, remaining_schedule, curr_assists, curr_goals = load_and_prepare_data(
+            player_name, f"{player_name}_df.csv", f"{team_name}_schedule_2425_formatted.csv", team_mapping_file)
+        # remaining_schedule keeps the row positions of the team's full schedule
+        dates = league_schedule.xs(team_name, level='team')['game_date'].iloc[remaining_schedule.index]
+        weeks = game_weeks(dates, season_start)
+        if full_scoring:
+            posterior = az.from_netcdf(multistat_trace_file(player_name)).posterior[['mu_t', 'mu_team', 'b_home']]
+            player_rates.append(multistat_weekly_rates(posterior, remaining_schedule, weeks, n_weeks))
+            current_points.append(current_totals(player_df) @ np.array([weights[stat] for stat in STATS]))
+        else:
+            posterior = catalog.load(player_name, ['mu_assists_t', 'mu_goals_t', 'mu_assists_team',
+                                                   'mu_goals_team', 'b_home'])
+            player_rates.append(weekly_rates(posterior, remaining_schedule, weeks, n_weeks))
+            current_points.append(weights['goals'] * curr_goals + weights['assists'] * curr_assists)
+        fits.append(posterior.attrs.get('fit', player_name))
+
+    rates, n_draws = stack_rates(player_rates)
+    fit_groups, _ = pd.factorize(pd.Series(fits))
+    return rates, n_draws, np.array(current_points), weights, fit_groups
+
+
+def load_rosters(roster_file):
+    # CSV in inputs/ with roster, player_name and team_name columns
+    rosters = pd.read_csv(os.path.join(INPUT_DIR, roster_file))
+    return {roster: dict(zip(players['player_name'], players['team_name']))
+            for roster, players in rosters.groupby('roster', sort=False)}
+
+
+def run_league(rosters, n_seasons=100000, chunk_size=None, random_seed=None, n_jobs=1,
+               team_mapping_file="team_mapping.csv"):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    roster_names = list(rosters)
+    player_teams = {player_name: team_name for players in rosters.values()
+                    for player_name, team_name in players.items()}
+    player_names = list(player_teams)
+    membership = np.array([[player_name in rosters[roster] for player_name in player_names]
+                           for roster in roster_names])
+
+    rates, n_draws, current_points, weights, fit_groups = load_player_rates(player_teams, team_mapping_file)
+    matchups = round_robin(len(roster_names), rates['goals'].shape[2])
+    logging.info(f"Simulating {n_seasons} seasons of {len(roster_names)} rosters over {matchups.shape[0]} weeks")
+    chunks = simulate_seasons(rates, n_draws, membership, matchups, n_seasons, current_points=current_points,
+                              chunk_size=chunk_size, weights=weights, random_seed=random_seed, n_jobs=n_jobs,
+                              fit_groups=fit_groups)
+    summary = summarize_seasons(chunks, roster_names)
+    summary.attrs['scoring'] = weights
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo fantasy seasons from the game level posteriors')
+    parser.add_argument('--rosters', help='CSV in inputs/ with roster, player_name and team_name columns '
+                                          '(defaults to the game_level_modelling players split in two)')
+    parser.add_argument('--seasons', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--jobs', type=int, default=1, help='worker processes drawing chunks of seasons')
+    args = parser.parse_args()
+
+    if args.rosters:
+        rosters = load_rosters(args.rosters)
+    else:
+        from game_level_modelling import PLAYER_NAMES, TEAM_NAMES
+        players = list(zip(PLAYER_NAMES, TEAM_NAMES))
+        rosters = {'roster_1': dict(players[::2]), 'roster_2': dict(players[1::2])}
+
+    summary = run_league(rosters, n_seasons=args.seasons, random_seed=args.seed, n_jobs=args.jobs)
+    scoring = ', '.join(f"{stat} {weight:g}" for stat, weight in summary.attrs['scoring'].items())
+    if summary.attrs['scoring'] is SCORING_WEIGHTS:
+        scoring += (" (partial kkupfl scoring: no shots, blocks, hits or short-handed points, fit multistat.py "
+                    "for every player to score them)")
+    print(f"Scoring: {scoring}\n")
+    print(summary.to_string())
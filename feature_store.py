@@ -0,0 +1,192 @@
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+INPUT_DIR = os.path.join('inputs')
+STORE_DIR = os.path.join(INPUT_DIR, 'feature_store')
+GAME_LOG_DIR = os.path.join(STORE_DIR, 'game_logs')
+SCHEDULE_FILE = os.path.join(STORE_DIR, 'schedules.parquet')
+TEAM_MAPPING_FILE = os.path.join(STORE_DIR, 'team_mapping.parquet')
+
+# Columns the game level model needs from a game log
+MODEL_COLUMNS = ['season', 'opponent', 'Home', 'Goals', 'Assists']
+# ... and the multi-stat model (see multistat.py)
+MULTISTAT_COLUMNS = MODEL_COLUMNS + ['Shots', 'Blocks', 'Hits', 'SHG', 'SHA']
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+GAME_LOG_SCHEMA = pa.schema([
+    ('game_number', pa.int32()),
+    ('Date', pa.string()),
+    ('Team', pa.string()),
+    ('Goals', pa.int16()),
+    ('Assists', pa.int16()),
+    ('Points', pa.int16()),
+    ('Plusminus', pa.int16()),
+    ('PIM', pa.int16()),
+    ('PPG', pa.int16()),
+    ('PPP', pa.int16()),
+    ('SHG', pa.int16()),
+    ('SHP', pa.int16()),
+    ('GWG', pa.int16()),
+    ('OTG', pa.int16()),
+    ('Shots', pa.int16()),
+    ('TOI', pa.string()),
+    ('Shifts', pa.int16()),
+    ('Year', pa.int16()),
+    ('Home', pa.int8()),
+    ('toi2', pa.string()),
+    ('toi3', pa.string()),
+    ('toi_seconds', pa.int32()),
+    ('opponent', CATEGORY),
+    ('opp_2', CATEGORY),
+    ('opp_int', pa.int8()),
+    ('season', pa.string()),
+    ('Hits', pa.int16()),
+    ('Blocks', pa.int16()),
+    ('SHA', pa.int16()),
+    ('player', pa.string()),
+])
+# Directory layout: game_logs/season=202324/player=Sidney Crosby/part-0.parquet
+GAME_LOG_PARTITIONING = ds.partitioning(pa.schema([('season', pa.string()), ('player', pa.string())]),
+                                        flavor='hive')
+SCHEDULE_SCHEMA = pa.schema([
+    ('team', CATEGORY),
+    ('game_number', pa.int16()),
+    ('game_date', pa.timestamp('s')),
+    ('Date', pa.string()),
+    ('Vs', CATEGORY),
+    ('Home', pa.int8()),
+    ('Opponent', CATEGORY),
+    ('opp_int', pa.int8()),
+])
+
+
+def _game_log_table(games):
+    games = games.assign(player=games['player'].astype(str), season=games['season'].astype(str))
+    return pa.Table.from_pandas(games[GAME_LOG_SCHEMA.names], schema=GAME_LOG_SCHEMA, preserve_index=False)
+
+
+def write_game_logs(games, store_dir=GAME_LOG_DIR):
+    # games: the long table from data_prep_bayesian.ingest_game_logs. Only the (season, player)
+    # partitions present in games are replaced, everything else in the store is kept.
+    games = games.assign(game_number=games.groupby('player', observed=True).cumcount() + 1)
+    ds.write_dataset(_game_log_table(games), store_dir, format='parquet', partitioning=GAME_LOG_PARTITIONING,
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+
+
+def append_game_logs(games, store_dir=GAME_LOG_DIR, replace=False):
+    # games: new rows, with game_number continuing each player's numbering. They go into new files next to
+    # the stored ones, so nothing already stored is read or rewritten; with replace they take over the
+    # (season, player) partitions they fall in instead. Each partition's new file is named after the date of
+    # its first game, so appending the same rows again (or more rows from the same game on, numbered anew),
+    # as a watcher pass that died before saving its high-water marks does, overwrites that file instead of
+    # storing the games twice.
+    for _, partition in games.groupby([games['season'].astype(str), games['player'].astype(str)], sort=False):
+        ds.write_dataset(_game_log_table(partition), store_dir, format='parquet', partitioning=GAME_LOG_PARTITIONING,
+                         existing_data_behavior='delete_matching' if replace else 'overwrite_or_ignore',
+                         basename_template=f"part-{partition['Date'].min()}-{{i}}.parquet")
+
+
+def _game_log_dataset(store_dir=GAME_LOG_DIR):
+    # Partition values come back dictionary encoded, i.e. as pandas categoricals
+    partitioning = ds.partitioning(pa.schema([('season', CATEGORY), ('player', CATEGORY)]),
+                                   flavor='hive', dictionaries='infer')
+    return ds.dataset(store_dir, format='parquet', partitioning=partitioning)
+
+
+def read_game_logs(players=None, seasons=None, columns=None, store_dir=GAME_LOG_DIR):
+    # Only the requested columns are decoded, and the player/season filters prune whole partitions
+    # (directories) before any file is opened
+    dataset = _game_log_dataset(store_dir)
+    predicate = None
+    if players is not None:
+        predicate = pc.field('player').isin(list(players))
+    if seasons is not None:
+        season_predicate = pc.field('season').isin([str(season) for season in seasons])
+        predicate = season_predicate if predicate is None else predicate & season_predicate
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(['player', 'game_number'] + list(columns)))
+    table = dataset.to_table(columns=read_columns, filter=predicate)
+    games = table.to_pandas(split_blocks=True, self_destruct=True)
+    games = games.sort_values(['player', 'game_number'], kind='stable').reset_index(drop=True)
+    if players is not None:
+        games['player'] = games['player'].cat.set_categories(list(players))
+    return games
+
+
+def delete_game_logs(players, store_dir=GAME_LOG_DIR):
+    # Every stored season of these players. Partition directories are URL-encoded, so they are found
+    # through the dataset rather than by name.
+    if not os.path.exists(store_dir):
+        return
+    fragments = _game_log_dataset(store_dir).get_fragments(filter=pc.field('player').isin(list(players)))
+    for partition in {os.path.dirname(fragment.path) for fragment in fragments}:
+        shutil.rmtree(partition)
+
+
+def stored_players(store_dir=GAME_LOG_DIR):
+    if not os.path.exists(store_dir):
+        return []
+    return sorted(set(_game_log_dataset(store_dir).to_table(columns=['player']).column('player').to_pylist()))
+
+
+def write_schedules(league_schedule, schedule_file=SCHEDULE_FILE):
+    # league_schedule: the (team, game_number) indexed table from data_prep_schedules.format_league_schedules
+    os.makedirs(os.path.dirname(schedule_file), exist_ok=True)
+    schedules = league_schedule.reset_index()
+    schedules['team'] = schedules['team'].astype(str)
+    pq.write_table(pa.Table.from_pandas(schedules[SCHEDULE_SCHEMA.names], schema=SCHEDULE_SCHEMA,
+                                        preserve_index=False), schedule_file)
+
+
+def read_schedules(teams=None, columns=None, schedule_file=SCHEDULE_FILE):
+    filters = [('team', 'in', list(teams))] if teams is not None else None
+    if columns is not None:
+        columns = list(dict.fromkeys(['team', 'game_number'] + list(columns)))
+    schedules = pq.read_table(schedule_file, columns=columns, filters=filters).to_pandas()
+    return schedules.set_index(['team', 'game_number']).sort_index()
+
+
+def update_schedules(league_schedule, schedule_file=SCHEDULE_FILE):
+    # Replaces the schedules of the teams in league_schedule, every other team's is kept
+    if os.path.exists(schedule_file):
+        stored = read_schedules(schedule_file=schedule_file)
+        teams = league_schedule.index.unique(level='team').astype(str)
+        stored = stored[~stored.index.get_level_values('team').isin(teams)]
+        league_schedule = pd.concat([stored, league_schedule])
+    write_schedules(league_schedule, schedule_file)
+
+
+def write_team_mapping(team_mapping_csv, mapping_file=TEAM_MAPPING_FILE):
+    os.makedirs(os.path.dirname(mapping_file), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(pd.read_csv(team_mapping_csv), preserve_index=False), mapping_file)
+
+
+def read_team_mapping(mapping_file=TEAM_MAPPING_FILE):
+    return pq.read_table(mapping_file).to_pandas()
+
+
+def build_store(player_teams, input_dir=INPUT_DIR):
+    from data_prep_bayesian import ingest_game_logs
+    from data_prep_schedules import format_league_schedules
+
+    league_schedule = format_league_schedules(input_dir=input_dir)
+    write_schedules(league_schedule)
+    write_team_mapping(os.path.join(input_dir, 'team_mapping.csv'))
+    games = ingest_game_logs(player_teams, league_schedule, input_dir)
+    write_game_logs(games)
+    return games
+
+
+if __name__ == '__main__':
+    from game_level_modelling import PLAYER_NAMES, TEAM_NAMES
+
+    games = build_store(dict(zip(PLAYER_NAMES, TEAM_NAMES)))
+    print(f"Stored {len(games)} games for {games['player'].nunique()} players in {STORE_DIR}")
@@ -3,11 +3,21 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import arviz as az
-import pytensor.tensor as pt
 import logging
+import argparse
 import os
-from data_prep_bayesian import process_player_data
-from data_prep_schedules import format_team_schedule
+from data_prep_bayesian import NUM_TEAMS, process_player_data, ingest_game_logs, player_view, opponent_index
+from data_prep_schedules import format_team_schedule, format_league_schedules, team_schedule_view
+from trace_store import save_trace, trace_cache_key, load_cached_trace, cache_trace, publish_cached_trace
+from warm_start import warm_start_sample_kwargs
+from feature_store import MODEL_COLUMNS, read_game_logs, read_schedules
+from predictive import add_predictions
+from prediction_store import write_predictions
+from approximate import APPROX_METHODS, APPROX_DRAWS, APPROX_ITERATIONS, APPROX_LEARNING_RATE, fit_approximation
+from run_manifest import RunManifest, timed_stage
+from adaptive_sampling import (TARGET_VARS, TARGET_ESS, TARGET_RHAT, MAX_DRAWS, TIME_BUDGET,
+                               sample_until_converged)
+from opponent_strength import load_opponent_strength, team_offsets
 
 ## Define input and output directories
 INPUT_DIR = os.path.join('inputs')
@@ -16,6 +26,37 @@ OUTPUT_DIR = os.path.join('outputs')
 # Ensure output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Players modelled by default, with the team whose schedule they play
+PLAYER_NAMES = ['Sidney Crosby', 'Jack Hughes', 'Cale Makar', 'Kirill Kaprizov', 'JT Miller', 'Matthew Tkachuk']
+TEAM_NAMES = ['penguins', 'devils', 'avalanche', 'wild', 'canucks', 'panthers']
+
+# Prior scales, shared by the single-player and roster models
+PRIORS = {
+    'sigma_t': 0.25,  # season to season step of the player random walks
+    'sigma_team': 0.08,
+    'sigma_rho': 0.3,
+    'sigma_b_home': 0.5,
+    'sigma_beta_goal': 0.5,
+}
+# NUTS implementations pm.sample can run the model with. 'pymc' is the default Python-driven sampler,
+# the others compile the whole sampler (nutpie through numba, numpyro and blackjax through JAX) and need
+# their package installed
+NUTS_SAMPLERS = ['pymc', 'nutpie', 'numpyro', 'blackjax']
+# Bump when the model structure changes, so cached traces from the old model are not reused.
+# 5: the single-player likelihood is the original pt.subtensor.take version again (3 and 4 are retired).
+# 6: the single-player rate is mu_t[season] + mu_team[opp, season] (see build_model), which changes every
+# projection of the take version.
+# 7: opponent effects are indexed by team id (NUM_TEAMS rows) instead of id - 1 (31 rows), which put
+# Vancouver (id 0) on Edmonton's row
+MODEL_VERSION = 7
+# How a single-player model gets its opponent effects: None estimates them from the player's own games,
+# 'fixed' and 'prior' take them from the league-wide fit (see opponent_strength.py)
+OPPONENT_MODES = ['fixed', 'prior']
+# Season dimension of the compiled single-player models is rounded up to a multiple of this
+SEASON_BUCKET = 4
+# (season bucket, likelihood, opponents) -> (model, NUTS step), see compiled_model
+_compiled_models = {}
+
 def load_team_mapping(mapping_file):
     team_mapping = pd.read_csv(mapping_file)
     full_name_to_id = dict(zip(team_mapping['team_name'], team_mapping['id']))
@@ -27,7 +68,13 @@ def load_and_prepare_data(player_name, player_data_file, schedule_file, team_map
     # Load data
     player_df = pd.read_csv(os.path.join(INPUT_DIR, player_data_file))
     schedule = pd.read_csv(os.path.join(INPUT_DIR, schedule_file))
+    return prepare_data(player_df, schedule, team_mapping_file)
+
+
+def prepare_data(player_df, schedule, team_mapping_file):
     full_name_to_id, abbrev_to_id, full_name_to_abbrev = load_team_mapping(os.path.join(INPUT_DIR, team_mapping_file))
+    player_df = player_df.copy()
+    schedule = schedule.copy()
 
     # Data preparation
     schedule['Home'] = schedule['Vs'].str.contains('vs').astype(int)
@@ -38,6 +85,7 @@ def load_and_prepare_data(player_name, player_data_file, schedule_file, team_map
     schedule['opp_int'] = schedule['Opponent'].map(full_name_to_id)
 
     # Prepare player data
+    player_df['season'] = player_df['season'].astype(int)
     player_df['opp_int'] = player_df['opponent'].map(abbrev_to_id)
     # Create season2 field
     unique_seasons = sorted(player_df['season'].unique())
@@ -53,69 +101,422 @@ def load_and_prepare_data(player_name, player_data_file, schedule_file, team_map
     return player_df, remaining_schedule, curr_assists, curr_goals
 
 
-def build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name):
-    with pm.Model() as model:
+def load_and_prepare_roster(player_names, player_data_files, schedule_files, team_mapping_file):
+    prepared = [load_and_prepare_data(player_name, player_data_file, schedule_file, team_mapping_file)
+                for player_name, player_data_file, schedule_file
+                in zip(player_names, player_data_files, schedule_files)]
+    return combine_roster(prepared)
+
+
+def load_and_prepare_from_store(player_name, team_name, team_mapping_file):
+    # Reads only the columns the model uses, for this player only, from the Parquet feature store
+    player_df = read_game_logs(players=[player_name], columns=MODEL_COLUMNS)
+    schedule = team_schedule_view(read_schedules(teams=[team_name]), team_name)
+    return prepare_data(player_df, schedule, team_mapping_file)
+
+
+def prepare_roster(games, league_schedule, player_teams, team_mapping_file):
+    # Same as load_and_prepare_roster, straight from the batch ingestion tables instead of per-player CSVs
+    prepared = [prepare_data(player_view(games, player_name), team_schedule_view(league_schedule, team_name),
+                             team_mapping_file)
+                for player_name, team_name in player_teams.items()]
+    return combine_roster(prepared)
+
+
+def load_roster_games(player_teams, team_mapping_file, use_store=False):
+    # The roster's games, from the feature store or straight from the raw game logs and schedules
+    team_names = sorted(set(player_teams.values()))
+    if use_store:
+        league_schedule = read_schedules(teams=team_names)
+        games = read_game_logs(players=list(player_teams), columns=MODEL_COLUMNS)
+    else:
+        league_schedule = format_league_schedules(team_names)
+        games = ingest_game_logs(player_teams, league_schedule)
+    return prepare_roster(games, league_schedule, player_teams, team_mapping_file)
+
+
+def combine_roster(prepared):
+    # Seasons are indexed league-wide (not per player) so the shared opponent effects line up across players
+    all_seasons = sorted(set().union(*(player_df['season'].unique() for player_df, _, _, _ in prepared)))
+    season_mapping = {season: i+1 for i, season in enumerate(all_seasons)}
+
+    games, remaining_games, curr_assists, curr_goals = [], [], [], []
+    for player_idx, (player_df, remaining_schedule, player_assists, player_goals) in enumerate(prepared):
+        games.append(player_df.assign(season2=player_df['season'].map(season_mapping), player_idx=player_idx))
+        remaining_games.append(remaining_schedule.assign(player_idx=player_idx))
+        curr_assists.append(player_assists)
+        curr_goals.append(player_goals)
+
+    games = pd.concat(games, ignore_index=True)
+    remaining_games = pd.concat(remaining_games, ignore_index=True)
+
+    return games, remaining_games, np.array(curr_assists), np.array(curr_goals), all_seasons
+
+
+def collapse_games(games, keys, count):
+    # One row per distinct combination of keys: the summed count and the number of games (the exposure)
+    cells = games.groupby(keys, sort=False)[count].agg(['sum', 'size']).reset_index()
+    return cells.rename(columns={'sum': count, 'size': 'n_games'})
+
+
+def likelihood_rows(player_df, likelihood='game'):
+    # Rows of the assists and goals likelihoods: every game, or with 'cell' the games sharing season, opponent
+    # and home flag (plus goals scored, for the assists rate), which have the same Poisson rate, so each cell's
+    # counts are summed into one term with its games as exposure
+    if likelihood == 'cell':
+        return (collapse_games(player_df, ['season2', 'opp_int', 'Home', 'Goals'], 'Assists'),
+                collapse_games(player_df, ['season2', 'opp_int', 'Home'], 'Goals'))
+    games = player_df.assign(n_games=1)
+    return games, games
+
+
+def model_data(player_df, likelihood='game', team_strength=None, num_seasons=None):
+    # Values of the model's data containers for one player, with team_strength (the league-wide opponent
+    # strength) also the mean and sd of every opponent's effect in the player's seasons
+    assist_games, goal_games = likelihood_rows(player_df, likelihood)
+    data = {}
+    for prefix, rows, count in [('a', assist_games, 'Assists'), ('g', goal_games, 'Goals')]:
+        data.update({f'{prefix}_season_idx': rows['season2'].values.astype('int32') - 1,
+                     f'{prefix}_opp_idx': opponent_index(rows['opp_int']),
+                     f'{prefix}_home': rows['Home'].values.astype(float),
+                     f'{prefix}_exposure': rows['n_games'].values.astype(float),
+                     f'{prefix}_count': rows[count].values.astype('int64')})
+    data['a_goals'] = assist_games['Goals'].values.astype(float)
+    if team_strength is not None:
+        data.update(team_offsets(team_strength, sorted(player_df['season'].unique()), num_seasons))
+    return data
+
+
+def build_model(player_df, likelihood='game', num_seasons=None, opponents=None, team_strength=None):
+    # Continuous parameters only, the remaining-season totals are drawn afterwards (see predictive.py).
+    # The player's games sit in pm.Data containers, so another player can be swapped in with pm.set_data
+    # (see compiled_model). num_seasons pads the season dimension past the player's last season.
+    # opponents (see OPPONENT_MODES) replaces the player's own opponent AR processes with team_strength.
+    if num_seasons is None:
         num_seasons = int(player_df['season2'].max())  # Convert to Python int
+    with pm.Model() as model:
+        data = {name: pm.Data(name, values)
+                for name, values in model_data(player_df, likelihood, team_strength, num_seasons).items()}
+
         # Priors
-        mu_assists_t = pm.GaussianRandomWalk('mu_assists_t', sigma=0.25, shape=num_seasons)
-        mu_goals_t = pm.GaussianRandomWalk('mu_goals_t', sigma=0.25, shape=num_seasons)
+        mu_assists_t = pm.GaussianRandomWalk('mu_assists_t', sigma=PRIORS['sigma_t'], shape=num_seasons)
+        mu_goals_t = pm.GaussianRandomWalk('mu_goals_t', sigma=PRIORS['sigma_t'], shape=num_seasons)
+
+        if opponents is None:
+            sigma_assists_team = pm.HalfNormal('sigma_assists_team', sigma=PRIORS['sigma_team'])
+            sigma_goals_team = pm.HalfNormal('sigma_goals_team', sigma=PRIORS['sigma_team'])
+
+            rho_a = pm.TruncatedNormal('rho_a', mu=0, sigma=PRIORS['sigma_rho'], lower=0, upper=1)
+            rho_g = pm.TruncatedNormal('rho_g', mu=0, sigma=PRIORS['sigma_rho'], lower=0, upper=1)
+
+            mu_assists_team = pm.AR('mu_assists_team', rho=rho_a, sigma=sigma_assists_team,
+                                    shape=(NUM_TEAMS, num_seasons))
+            mu_goals_team = pm.AR('mu_goals_team', rho=rho_g, sigma=sigma_goals_team,
+                                  shape=(NUM_TEAMS, num_seasons))
+        elif opponents == 'fixed':
+            # The league-wide posterior means, recorded in the trace like the estimated effects
+            mu_assists_team = pm.Deterministic('mu_assists_team', data['assists_team_mu'])
+            mu_goals_team = pm.Deterministic('mu_goals_team', data['goals_team_mu'])
+        else:
+            # Tight priors around the league-wide posterior, which still carry its uncertainty
+            mu_assists_team = pm.Normal('mu_assists_team', mu=data['assists_team_mu'],
+                                        sigma=data['assists_team_sigma'], shape=(NUM_TEAMS, num_seasons))
+            mu_goals_team = pm.Normal('mu_goals_team', mu=data['goals_team_mu'],
+                                      sigma=data['goals_team_sigma'], shape=(NUM_TEAMS, num_seasons))
+
+        b_home = pm.Normal('b_home', mu=0, sigma=PRIORS['sigma_b_home'], shape=3)
+        beta_goal = pm.Normal('beta_goal', mu=0, sigma=PRIORS['sigma_beta_goal'])
+
+        # Likelihood, over rows of any length, with the rate the predictions use (see predictive.game_rates).
+        # The original pt.subtensor.take(mu_*_team, (opp, season)) indexed the flattened matrix once with
+        # each and summed the two rows: a rate of 2*mu_t[season] + flat_team[opp] + flat_team[season] + twice
+        # the home and goal terms.
+        mn_a = (mu_assists_t[data['a_season_idx']] +
+                mu_assists_team[data['a_opp_idx'], data['a_season_idx']] +
+                data['a_home'] * b_home[1] +
+                data['a_goals'] * beta_goal)
+        mn_g = (mu_goals_t[data['g_season_idx']] +
+                mu_goals_team[data['g_opp_idx'], data['g_season_idx']] +
+                data['g_home'] * b_home[2])
+
+        assists = pm.Poisson('assists', mu=data['a_exposure'] * pm.math.exp(mn_a), observed=data['a_count'])
+        goals = pm.Poisson('goals', mu=data['g_exposure'] * pm.math.exp(mn_g), observed=data['g_count'])
+
+    return model
+
+
+def season_bucket(num_seasons):
+    return -(-num_seasons // SEASON_BUCKET) * SEASON_BUCKET
+
+
+def compiled_model(player_df, likelihood='game', opponents=None, team_strength=None):
+    # Model and NUTS step built and compiled once per (season bucket, likelihood) and reused for every player
+    # that falls in it: their data is swapped into the containers, the compiled logp and gradient read it
+    # from there. Game rows have no fixed length; seasons are padded at the end, past the player's current
+    # season, where the random walks and opponent effects are unobserved and leave the real seasons'
+    # posterior unchanged (see trim_padded_seasons).
+    key = (season_bucket(int(player_df['season2'].max())), likelihood, opponents)
+    if key not in _compiled_models:
+        model = build_model(player_df, likelihood=likelihood, num_seasons=key[0], opponents=opponents,
+                            team_strength=team_strength)
+        with model:
+            # As pm.sample(init='adapt_diag'): every chain starts from the initial point, the diagonal mass
+            # matrix adapts from scratch for each player (pm.sample resets the step's tuning)
+            step = pm.NUTS()
+        _compiled_models[key] = model, step
+    else:
+        model, step = _compiled_models[key]
+        with model:
+            pm.set_data(model_data(player_df, likelihood, team_strength, key[0]))
+    return model, step
+
+
+def trim_padded_seasons(trace, num_seasons):
+    # Back to the layout of an unpadded fit
+    season_dims = {'mu_assists_t_dim_0', 'mu_goals_t_dim_0', 'mu_assists_team_dim_1', 'mu_goals_team_dim_1'}
+    trace.posterior = trace.posterior.isel({dim: slice(0, num_seasons) for dim in season_dims
+                                            if dim in trace.posterior.dims})
+    return trace
+
+
+def build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name,
+                           draws=100, tune=100, chains=None, cores=None, progressbar=True, use_cache=True,
+                           warm_start=None, warm_tune=25, likelihood='game', n_predictive=1, nuts_sampler='pymc',
+                           inference='nuts', publish=True, write_netcdf=True, compile_once=False, manifest=None,
+                           adaptive=False, opponents=None):
+    # manifest (a RunManifest) records the time spent in each stage and the sampler's health. adaptive keeps
+    # extending the chains past draws until the convergence targets of adaptive_sampling.py are met, and an
+    # unconverged fit is then neither cached nor published. opponents takes the opponent effects from the
+    # league-wide fit (see OPPONENT_MODES).
+    trace_file = os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc")
+    approx_settings = None
+    if inference != 'nuts':
+        # Approximate fits ignore the NUTS settings, keep them out of the cache key
+        draws, tune, chains, nuts_sampler, warm_start = APPROX_DRAWS, None, None, None, None
+        approx_settings = {'iterations': APPROX_ITERATIONS, 'learning_rate': APPROX_LEARNING_RATE}
+    if warm_start is not None and nuts_sampler != 'pymc':
+        # The warm start hands pm.sample a PyMC NUTS step, the compiled backends run their own adaptation
+        logging.info(f"Warm start is only supported by the pymc sampler, sampling {player_name} cold")
+        warm_start = None
+    if warm_start is not None and chains is None:
+        chains = warm_start.posterior.sizes['chain']
+    if adaptive and (inference != 'nuts' or nuts_sampler != 'pymc'):
+        # Extending chains needs a PyMC NUTS step, like the warm start
+        logging.info(f"Adaptive sampling needs the pymc NUTS sampler, sampling {player_name} with fixed draws")
+        adaptive = False
+    if compile_once and (inference != 'nuts' or nuts_sampler != 'pymc' or warm_start is not None):
+        # Only a PyMC NUTS step built without a warm start can be reused across players
+        compile_once = False
+    settings = {'model_version': MODEL_VERSION, 'priors': PRIORS, 'draws': draws, 'tune': tune, 'chains': chains,
+                'warm_tune': warm_tune if warm_start is not None else None, 'likelihood': likelihood,
+                'n_predictive': n_predictive, 'nuts_sampler': nuts_sampler, 'inference': inference,
+                'approx_settings': approx_settings}
+    team_strength = None
+    if opponents is not None:
+        team_strength = load_opponent_strength()
+        # A refitted league-wide fit changes every player's posterior
+        settings['opponents'] = {'mode': opponents, 'strength': team_strength.attrs['data_key']}
+    if adaptive:
+        # Only in the key when used, so the fixed-draw fits keep their cache entries
+        settings['adaptive'] = {'target_vars': TARGET_VARS, 'target_ess': TARGET_ESS, 'target_rhat': TARGET_RHAT,
+                                'max_draws': MAX_DRAWS, 'time_budget': TIME_BUDGET}
+    # compile_once samples the same posterior, so it shares the cache entries
+    cache_key = trace_cache_key(player_df, remaining_schedule, curr_assists, curr_goals, settings)
+    # The trace cache holds full NetCDF traces, so it is only used when those are written
+    if use_cache and write_netcdf:
+        with timed_stage(manifest, 'cache_lookup'):
+            trace = load_cached_trace(cache_key)
+        if trace is not None:
+            logging.info(f"Inputs unchanged for {player_name}, reusing cached trace {cache_key}")
+            if manifest is not None:
+                manifest.record['cache_hit'] = True
+            if publish:
+                with timed_stage(manifest, 'write_outputs'):
+                    publish_cached_trace(cache_key, trace_file)
+                    write_predictions(trace, player_name)
+            return trace
+
+    step = None
+    with timed_stage(manifest, 'build_model'):
+        if compile_once:
+            model, step = compiled_model(player_df, likelihood=likelihood, opponents=opponents,
+                                         team_strength=team_strength)
+        else:
+            model = build_model(player_df, likelihood=likelihood, opponents=opponents, team_strength=team_strength)
+
+    # Incremental update: start from the previous posterior with its adapted step size and mass matrix,
+    # so only a short re-tune is needed
+    sample_kwargs = {}
+    if warm_start is not None:
+        with timed_stage(manifest, 'warm_start'):
+            sample_kwargs = warm_start_sample_kwargs(model, warm_start, chains)
+        if sample_kwargs:
+            logging.info(f"Warm starting {player_name} from the previous posterior, tune={warm_tune}")
+            tune = warm_tune
+        else:
+            logging.info(f"Previous posterior for {player_name} does not match the current model, sampling cold")
+
+    def finish(trace):
+        # Back to the player's own seasons, then the season totals
+        if compile_once:
+            trim_padded_seasons(trace, int(player_df['season2'].max()))
+        with timed_stage(manifest, 'predict'):
+            return add_predictions(trace, remaining_schedule, curr_assists, curr_goals, n_predictive=n_predictive)
 
-        sigma_assists_team = pm.HalfNormal('sigma_assists_team', sigma=0.08)
-        sigma_goals_team = pm.HalfNormal('sigma_goals_team', sigma=0.08)
+    # Sampling
+    if step is not None:
+        sample_kwargs['step'] = step
+    if inference == 'nuts' and adaptive:
+        # Every round is checked on the finished trace, so the predicted totals are among the targets. The
+        # sample stage then also holds the checks and the predictions.
+        with timed_stage(manifest, 'sample'):
+            trace = sample_until_converged(model, finish, draws=draws, tune=tune, chains=chains, cores=cores,
+                                           progressbar=progressbar, label=player_name, **sample_kwargs)
+    elif inference == 'nuts':
+        # Compilation happens inside pm.sample, RunManifest.add_sampling separates it from the sampling time
+        with timed_stage(manifest, 'sample'), model:
+            trace = pm.sample(draws, tune=tune, chains=chains, cores=cores, nuts_sampler=nuts_sampler,
+                              return_inferencedata=True, progressbar=progressbar, **sample_kwargs)
+        trace = finish(trace)
+    else:
+        logging.info(f"Fitting {player_name} with {inference} instead of NUTS")
+        with timed_stage(manifest, 'fit_approximation'):
+            trace = fit_approximation(model, inference, draws=draws, progressbar=progressbar)
+        trace = finish(trace)
+    if manifest is not None:
+        manifest.add_sampling(trace)
+    trace.posterior.attrs['player'] = player_name
+    if not trace.posterior.attrs.get('converged', 1):
+        logging.warning(f"{player_name} did not converge within the sampling budget, not caching or publishing it")
+        write_netcdf = publish = False
+    with timed_stage(manifest, 'write_outputs'):
+        if write_netcdf:
+            cache_trace(trace, cache_key)
+        if publish:
+            # Compact totals for downstream consumers, always written
+            write_predictions(trace, player_name)
+            if write_netcdf:
+                publish_cached_trace(cache_key, trace_file)
+
+    return trace
+
+
+def build_roster_model(games, player_names, seasons, likelihood='game'):
+    num_seasons = len(seasons)
 
-        rho_a = pm.TruncatedNormal('rho_a', mu=0, sigma=0.3, lower=0, upper=1)
-        rho_g = pm.TruncatedNormal('rho_g', mu=0, sigma=0.3, lower=0, upper=1)
+    coords = {'player': player_names, 'season': seasons}
+    with pm.Model(coords=coords) as model:
+        # Priors: one random walk per player, opponent effects shared by the whole roster
+        mu_assists_t = pm.GaussianRandomWalk('mu_assists_t', sigma=PRIORS['sigma_t'], dims=('player', 'season'))
+        mu_goals_t = pm.GaussianRandomWalk('mu_goals_t', sigma=PRIORS['sigma_t'], dims=('player', 'season'))
+
+        sigma_assists_team = pm.HalfNormal('sigma_assists_team', sigma=PRIORS['sigma_team'])
+        sigma_goals_team = pm.HalfNormal('sigma_goals_team', sigma=PRIORS['sigma_team'])
+
+        rho_a = pm.TruncatedNormal('rho_a', mu=0, sigma=PRIORS['sigma_rho'], lower=0, upper=1)
+        rho_g = pm.TruncatedNormal('rho_g', mu=0, sigma=PRIORS['sigma_rho'], lower=0, upper=1)
 
         mu_assists_team = pm.AR('mu_assists_team', rho=rho_a, sigma=sigma_assists_team,
-                                shape=(31, num_seasons))
+                                shape=(NUM_TEAMS, num_seasons))
         mu_goals_team = pm.AR('mu_goals_team', rho=rho_g, sigma=sigma_goals_team,
-                              shape=(31, num_seasons))
-
-        b_home = pm.Normal('b_home', mu=0, sigma=0.5, shape=3)
-        beta_goal = pm.Normal('beta_goal', mu=0, sigma=0.5)
-
-        # Likelihood
-        mn_a = (pt.subtensor.take(mu_assists_t, player_df['season2'].astype('int32') - 1) +
-                pt.subtensor.take(mu_assists_team,
-                                  (player_df['opp_int'].astype('int32') - 1,
-                                   player_df['season2'].astype('int32') - 1)) +
-                player_df['Home'].values * b_home[1] +
-                player_df['Goals'].values * beta_goal)
-        mn_g = (pt.subtensor.take(mu_goals_t, player_df['season2'].astype('int32') - 1) +
-                pt.subtensor.take(mu_goals_team,
-                                  (player_df['opp_int'].astype('int32') - 1,
-                                   player_df['season2'].astype('int32') - 1)) +
-                player_df['Home'].values * b_home[2])
-
-        assists = pm.Poisson('assists', mu=pm.math.exp(mn_a.sum(axis=0)), observed=player_df['Assists'])
-        goals = pm.Poisson('goals', mu=pm.math.exp(mn_g.sum(axis=0)), observed=player_df['Goals'])
-
-        # Predictions
-        current_season = int(player_df['season2'].max())
-        pred_assists = pm.Poisson('pred_assists', mu=pt.exp(
-            mu_assists_t[current_season - 1] + mu_assists_team[
-                remaining_schedule['opp_int'].astype('int32') - 1, current_season - 1] +
-            remaining_schedule['Home'].values * b_home[1]
-        ), shape=len(remaining_schedule))
-
-        pred_goals = pm.Poisson('pred_goals', mu=pt.exp(
-            mu_goals_t[current_season - 1] + mu_goals_team[
-                remaining_schedule['opp_int'].astype('int32') - 1, current_season - 1] +
-            remaining_schedule['Home'].values * b_home[2]
-        ), shape=len(remaining_schedule))
-
-        pred_total_assists = pm.Deterministic('pred_total_assists', curr_assists + pred_assists.sum())
-        pred_total_goals = pm.Deterministic('pred_total_goals', curr_goals + pred_goals.sum())
-        pred_total_points = pm.Deterministic('pred_total_points', pred_total_assists + pred_total_goals)
+                              shape=(NUM_TEAMS, num_seasons))
+
+        b_home = pm.Normal('b_home', mu=0, sigma=PRIORS['sigma_b_home'], shape=3)
+        beta_goal = pm.Normal('beta_goal', mu=0, sigma=PRIORS['sigma_beta_goal'])
+
+        # Likelihood over every player's games at once
+        if likelihood == 'cell':
+            assist_games = collapse_games(games, ['player_idx', 'season2', 'opp_int', 'Home', 'Goals'], 'Assists')
+            goal_games = collapse_games(games, ['player_idx', 'season2', 'opp_int', 'Home'], 'Goals')
+        else:
+            assist_games = goal_games = games.assign(n_games=1)
+
+        a_season_idx = assist_games['season2'].values.astype('int32') - 1
+        a_opp_idx = opponent_index(assist_games['opp_int'])
+        mn_a = (mu_assists_t[assist_games['player_idx'].values, a_season_idx] +
+                mu_assists_team[a_opp_idx, a_season_idx] +
+                assist_games['Home'].values * b_home[1] +
+                assist_games['Goals'].values * beta_goal)
+        g_season_idx = goal_games['season2'].values.astype('int32') - 1
+        g_opp_idx = opponent_index(goal_games['opp_int'])
+        mn_g = (mu_goals_t[goal_games['player_idx'].values, g_season_idx] +
+                mu_goals_team[g_opp_idx, g_season_idx] +
+                goal_games['Home'].values * b_home[2])
+
+        assists = pm.Poisson('assists', mu=assist_games['n_games'].values * pm.math.exp(mn_a),
+                             observed=assist_games['Assists'].values)
+        goals = pm.Poisson('goals', mu=goal_games['n_games'].values * pm.math.exp(mn_g),
+                           observed=goal_games['Goals'].values)
+
+    return model
+
+
+def build_and_sample_roster_model(games, remaining_games, curr_assists, curr_goals, player_names, seasons,
+                                  draws=100, tune=100, chains=None, cores=None, progressbar=True, use_cache=True,
+                                  likelihood='game', n_predictive=1, nuts_sampler='pymc', inference='nuts',
+                                  write_netcdf=True, manifest=None):
+    # Same settings, trace cache and manifest stages as build_and_sample_model, for the whole roster at once
+    approx_settings = None
+    if inference != 'nuts':
+        draws, tune, chains, nuts_sampler = APPROX_DRAWS, None, None, None
+        approx_settings = {'iterations': APPROX_ITERATIONS, 'learning_rate': APPROX_LEARNING_RATE}
+    settings = {'model_version': MODEL_VERSION, 'priors': PRIORS, 'draws': draws, 'tune': tune, 'chains': chains,
+                'likelihood': likelihood, 'n_predictive': n_predictive, 'nuts_sampler': nuts_sampler,
+                'inference': inference, 'approx_settings': approx_settings, 'roster': player_names}
+    cache_key = trace_cache_key(games, remaining_games, curr_assists, curr_goals, settings)
+    if use_cache and write_netcdf:
+        with timed_stage(manifest, 'cache_lookup'):
+            trace = load_cached_trace(cache_key)
+        if trace is not None:
+            logging.info(f"Inputs unchanged for the roster, reusing cached trace {cache_key}")
+            if manifest is not None:
+                manifest.record['cache_hit'] = True
+            trace.posterior.attrs['fit'] = cache_key
+            with timed_stage(manifest, 'write_outputs'):
+                write_predictions(trace)
+                write_player_traces(trace, player_names)
+            return trace
+
+    with timed_stage(manifest, 'build_model'):
+        model = build_roster_model(games, player_names, seasons, likelihood=likelihood)
 
     # Sampling
-    with model:
-        trace = pm.sample(100, tune=100, return_inferencedata=True, progressbar=True)
-    az.to_netcdf(trace, os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc"))
+    if inference == 'nuts':
+        with timed_stage(manifest, 'sample'), model:
+            trace = pm.sample(draws, tune=tune, chains=chains, cores=cores, nuts_sampler=nuts_sampler,
+                              return_inferencedata=True, progressbar=progressbar)
+    else:
+        with timed_stage(manifest, 'fit_approximation'):
+            trace = fit_approximation(model, inference, draws=draws, progressbar=progressbar)
+    # Every player's remaining games are predicted in one pass and summed back per player
+    with timed_stage(manifest, 'predict'):
+        add_predictions(trace, remaining_games, curr_assists, curr_goals, n_predictive=n_predictive,
+                        player_idx=remaining_games['player_idx'].values)
+    if manifest is not None:
+        manifest.add_sampling(trace)
+    # Names the joint fit in every player's slice, their draws are correlated (see fantasy_sim.roster_rate_tables)
+    trace.posterior.attrs['fit'] = cache_key
+    with timed_stage(manifest, 'write_outputs'):
+        write_predictions(trace)
+        if write_netcdf:
+            cache_trace(trace, cache_key)
+            write_player_traces(trace, player_names)
 
     return trace
 
 
+def split_player_trace(trace, player_name):
+    # Per-player slice of a roster fit (shared parameters included), in the same layout as a single-player fit
+    posterior = trace.posterior.sel(player=player_name, drop=True)
+    posterior.attrs['player'] = player_name
+    return az.InferenceData(posterior=posterior)
+
+
+def write_player_traces(trace, player_names):
+    for player_name in player_names:
+        save_trace(split_player_trace(trace, player_name), os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc"))
+
+
 def analyze_results(trace, player_name):
     point_draws = az.extract(trace, var_names=['pred_total_points', 'pred_total_goals', 'pred_total_assists'],
                              combined=True)
@@ -140,30 +541,159 @@ def analyze_results(trace, player_name):
     return point_draws
 
 
-def main(player_name, player_data_file, schedule_file, team_mapping_file):
+def main(player_name, player_data_file, schedule_file, team_mapping_file, chains=None, cores=None,
+         progressbar=True, use_cache=True, incremental=False, likelihood='game', n_predictive=1,
+         nuts_sampler='pymc', inference='nuts', write_netcdf=True, compile_once=False, adaptive=False,
+         opponents=None):
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     logging.info(f"Starting analysis for {player_name}")
 
-    player_df, remaining_schedule, curr_assists, curr_goals = load_and_prepare_data(player_name, player_data_file,
-                                                                                    schedule_file, team_mapping_file)
+    manifest = RunManifest(player_name, likelihood=likelihood, n_predictive=n_predictive, nuts_sampler=nuts_sampler,
+                           inference=inference, compile_once=compile_once, incremental=incremental, adaptive=adaptive,
+                           opponents=opponents, chains=chains, cores=cores)
+    with manifest.stage('load_data'):
+        player_df, remaining_schedule, curr_assists, curr_goals = load_and_prepare_data(
+            player_name, player_data_file, schedule_file, team_mapping_file)
     logging.info("Data preparation complete, starting model building and sampling")
 
-    trace = build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name)
+    results = fit_and_analyze(player_df, remaining_schedule, curr_assists, curr_goals, player_name, chains=chains,
+                              cores=cores, progressbar=progressbar, use_cache=use_cache, incremental=incremental,
+                              likelihood=likelihood, n_predictive=n_predictive,
+                              nuts_sampler=nuts_sampler, inference=inference, write_netcdf=write_netcdf,
+                              compile_once=compile_once, manifest=manifest, adaptive=adaptive, opponents=opponents)
+    logging.info(f"Run manifest written to {manifest.write()}")
+    return results
+
+
+def main_store(player_name, team_name, team_mapping_file, chains=None, cores=None, progressbar=True, use_cache=True,
+               incremental=False, likelihood='game', n_predictive=1,
+               nuts_sampler='pymc', inference='nuts', write_netcdf=True, compile_once=False, adaptive=False,
+               opponents=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Starting analysis for {player_name} from the feature store")
+
+    manifest = RunManifest(player_name, likelihood=likelihood, n_predictive=n_predictive, nuts_sampler=nuts_sampler,
+                           inference=inference, compile_once=compile_once, incremental=incremental, adaptive=adaptive,
+                           opponents=opponents, chains=chains, cores=cores)
+    with manifest.stage('load_data'):
+        player_df, remaining_schedule, curr_assists, curr_goals = load_and_prepare_from_store(
+            player_name, team_name, team_mapping_file)
+    logging.info("Data preparation complete, starting model building and sampling")
+
+    results = fit_and_analyze(player_df, remaining_schedule, curr_assists, curr_goals, player_name, chains=chains,
+                              cores=cores, progressbar=progressbar, use_cache=use_cache, incremental=incremental,
+                              likelihood=likelihood, n_predictive=n_predictive,
+                              nuts_sampler=nuts_sampler, inference=inference, write_netcdf=write_netcdf,
+                              compile_once=compile_once, manifest=manifest, adaptive=adaptive, opponents=opponents)
+    logging.info(f"Run manifest written to {manifest.write()}")
+    return results
+
+
+def fit_and_analyze(player_df, remaining_schedule, curr_assists, curr_goals, player_name, chains=None, cores=None,
+                    progressbar=True, use_cache=True, incremental=False, likelihood='game', n_predictive=1,
+                    nuts_sampler='pymc', inference='nuts', write_netcdf=True, compile_once=False, manifest=None,
+                    adaptive=False, opponents=None):
+    warm_start = None
+    previous_trace_file = os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc")
+    if incremental and os.path.exists(previous_trace_file):
+        with timed_stage(manifest, 'load_warm_start'):
+            warm_start = az.from_netcdf(previous_trace_file)
+
+    trace = build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name,
+                                   chains=chains, cores=cores, progressbar=progressbar, use_cache=use_cache,
+                                   warm_start=warm_start, likelihood=likelihood, n_predictive=n_predictive,
+                                   nuts_sampler=nuts_sampler, inference=inference, write_netcdf=write_netcdf,
+                                   compile_once=compile_once, manifest=manifest, adaptive=adaptive, opponents=opponents)
     logging.info("Model sampling complete, analyzing results")
 
-    results = analyze_results(trace, player_name)
+    with timed_stage(manifest, 'analyze'):
+        results = analyze_results(trace, player_name)
+    logging.info("Analysis completed successfully")
+
+    return results
+
+
+def main_roster(player_teams, team_mapping_file, use_store=False, chains=None, cores=None, progressbar=True,
+                use_cache=True, likelihood='game', n_predictive=1, nuts_sampler='pymc', inference='nuts',
+                write_netcdf=True):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Starting roster analysis for {len(player_teams)} players")
+
+    player_names = list(player_teams)
+    manifest = RunManifest('roster', players=player_names, use_store=use_store, likelihood=likelihood,
+                           n_predictive=n_predictive, nuts_sampler=nuts_sampler, inference=inference, chains=chains,
+                           cores=cores)
+    with manifest.stage('load_data'):
+        games, remaining_games, curr_assists, curr_goals, seasons = load_roster_games(player_teams, team_mapping_file,
+                                                                                      use_store=use_store)
+    logging.info("Data preparation complete, starting roster model building and sampling")
+
+    trace = build_and_sample_roster_model(games, remaining_games, curr_assists, curr_goals, player_names, seasons,
+                                          chains=chains, cores=cores, progressbar=progressbar, use_cache=use_cache,
+                                          likelihood=likelihood, n_predictive=n_predictive,
+                                          nuts_sampler=nuts_sampler, inference=inference, write_netcdf=write_netcdf,
+                                          manifest=manifest)
+    logging.info("Roster model sampling complete, analyzing results")
+
+    with manifest.stage('analyze'):
+        results = {player_name: analyze_results(split_player_trace(trace, player_name), player_name)
+                   for player_name in player_names}
     logging.info("Analysis completed successfully")
+    logging.info(f"Run manifest written to {manifest.write()}")
 
     return results
 
 
 if __name__ == '__main__':
-    player_names = ['Sidney Crosby', 'Jack Hughes', 'Cale Makar', 'Kirill Kaprizov', 'JT Miller', 'Matthew Tkachuk']
-    team_names = ['penguins', 'devils', 'avalanche', 'wild', 'canucks', 'panthers']
-    for player_name, team_name in zip(player_names, team_names):
-        schedule_df = format_team_schedule(team_name)
-        player_df = process_player_data(player_name, team_name)
-        player_data_file = f"{player_name}_df.csv"  # Change this to the appropriate file for each player
-        schedule_file = f"{team_name}_schedule_2425_formatted.csv"  # This might need to change depending on the player's team
-        team_mapping_file = "team_mapping.csv"
-        main(player_name, player_data_file, schedule_file, team_mapping_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Game level Bayesian projections for NHL players')
+    parser.add_argument('--batch', action='store_true',
+                        help='fit all players in one joint model instead of one model per player')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='resample every player even if a cached trace matches their inputs')
+    parser.add_argument('--incremental', action='store_true',
+                        help="warm start each player from their previous posterior with a short re-tune")
+    parser.add_argument('--likelihood', choices=['game', 'cell'], default='game',
+                        help="'cell' sums games sharing season, opponent and home flag into one Poisson term")
+    parser.add_argument('--n-predictive', type=int, default=1,
+                        help='predictive draws of the season totals per posterior draw')
+    parser.add_argument('--sampler', choices=NUTS_SAMPLERS, default='pymc',
+                        help='NUTS implementation (see benchmark_samplers.py to compare them)')
+    parser.add_argument('--inference', choices=['nuts'] + APPROX_METHODS, default='nuts',
+                        help='approximate methods give rough projections in seconds per player')
+    parser.add_argument('--no-netcdf', action='store_true',
+                        help='only write the compact predictions (outputs/predictions), not the full NetCDF traces')
+    parser.add_argument('--compile-once', action='store_true',
+                        help="compile the model once per season bucket and swap each player's data into it")
+    parser.add_argument('--adaptive', action='store_true',
+                        help='sample each player in rounds until their projections converge (see adaptive_sampling.py)')
+    parser.add_argument('--opponents', choices=OPPONENT_MODES, default=None,
+                        help='take the opponent effects from the league-wide fit (opponent_strength.py), as fixed '
+                             'offsets or tight priors, instead of estimating them per player')
+    parser.add_argument('--store', action='store_true',
+                        help='read game logs and schedules from the Parquet feature store (see feature_store.py)')
+    args = parser.parse_args()
+
+    player_names = PLAYER_NAMES
+    team_names = TEAM_NAMES
+    team_mapping_file = "team_mapping.csv"
+    if args.batch:
+        main_roster(dict(zip(player_names, team_names)), team_mapping_file, use_store=args.store,
+                    use_cache=not args.no_cache, likelihood=args.likelihood, n_predictive=args.n_predictive,
+                    nuts_sampler=args.sampler, inference=args.inference, write_netcdf=not args.no_netcdf)
+    elif args.store:
+        for player_name, team_name in zip(player_names, team_names):
+            main_store(player_name, team_name, team_mapping_file, use_cache=not args.no_cache,
+                       incremental=args.incremental, likelihood=args.likelihood, n_predictive=args.n_predictive,
+                       nuts_sampler=args.sampler, inference=args.inference, write_netcdf=not args.no_netcdf,
+                       compile_once=args.compile_once, adaptive=args.adaptive, opponents=args.opponents)
+    else:
+        for player_name, team_name in zip(player_names, team_names):
+            schedule_df = format_team_schedule(team_name)
+            player_df = process_player_data(player_name, team_name)
+            player_data_file = f"{player_name}_df.csv"  # Change this to the appropriate file for each player
+            # This might need to change depending on the player's team
+            schedule_file = f"{team_name}_schedule_2425_formatted.csv"
+            main(player_name, player_data_file, schedule_file, team_mapping_file, use_cache=not args.no_cache,
+                 incremental=args.incremental, likelihood=args.likelihood, n_predictive=args.n_predictive,
+                 nuts_sampler=args.sampler, inference=args.inference, write_netcdf=not args.no_netcdf,
+                 compile_once=args.compile_once, adaptive=args.adaptive, opponents=args.opponents)
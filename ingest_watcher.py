@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_prep_bayesian import (INPUT_DIR, GAME_LOG_SUFFIX, CURRENT_SEASON, load_team_mapping, format_game_logs,
+                                ingest_game_logs)
+from data_prep_schedules import SCHEDULE_SUFFIX, format_league_schedules, team_schedule_view, write_team_schedules
+from feature_store import (STORE_DIR, GAME_LOG_DIR, SCHEDULE_FILE, write_game_logs, append_game_logs, delete_game_logs,
+                           read_schedules, update_schedules, write_team_mapping)
+from trace_store import atomic_write
+
+# Keeps the feature store in step with the raw game logs and schedules in inputs/ as they grow during the season.
+# Each player's high-water mark is the date of their last ingested game, so only the rows dated after it are
+# formatted and appended; only the players with new games are refitted, and only the players whose remaining
+# schedule changed are re-predicted from their stored posterior.
+
+OUTPUT_DIR = os.path.join('outputs')
+# High-water marks of every watched file and the players still waiting for a refit or new predictions
+STATE_FILE = os.path.join(STORE_DIR, 'watermarks.json')
+TEAM_MAPPING_FILE = 'team_mapping.csv'
+POLL_SECONDS = 300
+
+
+def load_state(state_file=STATE_FILE):
+    if not os.path.exists(state_file):
+        return {'game_logs': {}, 'schedules': {}, 'pending': {'refit': [], 'repredict': []}}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state, state_file=STATE_FILE):
+    # An interrupted pass leaves the previous marks
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with atomic_write(state_file) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def file_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_new_rows(path, mark):
+    # Raw rows dated after the player's last ingested game, oldest first (an empty frame if there are none).
+    # The files list the newest season first, so a new season's games appear above the rows already ingested
+    # and a season's later games in the middle of the file: the whole file is parsed and the rows picked by
+    # date. None when the rows up to the mark are no longer the ones ingested (edited, removed or back-filled),
+    # and the file has to be ingested again in full.
+    raw = pd.read_csv(path, delimiter=',')
+    if (raw['Date'] <= mark['last_date']).sum() != mark['rows']:
+        return None
+    return raw[raw['Date'] > mark['last_date']].sort_values('Date', kind='stable')
+
+
+def game_log_path(player_name, input_dir=INPUT_DIR):
+    return os.path.join(input_dir, f"{player_name}{GAME_LOG_SUFFIX}")
+
+
+def ingest_full(player_teams, state, input_dir=INPUT_DIR, store_dir=GAME_LOG_DIR):
+    # Every game of these players, replacing whatever the store held for them
+    games = ingest_game_logs(player_teams, input_dir=input_dir)
+    delete_game_logs(list(player_teams), store_dir)
+    write_game_logs(games, store_dir)
+
+    for player_name, team_name in player_teams.items():
+        player_games = games[games['player'] == player_name]
+        current = player_games[player_games['season'] == CURRENT_SEASON]
+        # The season start placeholder (see season_start_rows) is the only row without ice time
+        placeholder = bool(len(current) == 1 and current['toi_seconds'].iloc[0] == 0)
+        rows = player_games[player_games['season'] != CURRENT_SEASON] if placeholder else player_games
+        state['game_logs'][player_name] = dict(
+            **file_stamp(game_log_path(player_name, input_dir)), team=team_name, games=len(player_games),
+            rows=len(rows), last_date=rows['Date'].max() if len(rows) else '', placeholder=placeholder)
+    return games
+
+
+def ingest_new_games(player_teams, state, input_dir=INPUT_DIR, store_dir=GAME_LOG_DIR):
+    # Appends the rows added to each game log since the last pass. Returns the players whose games changed.
+    _, abbrev_to_id, _ = load_team_mapping(os.path.join(input_dir, TEAM_MAPPING_FILE))
+    full, appended, replacing, changed = {}, [], [], []
+    for player_name, team_name in player_teams.items():
+        path = game_log_path(player_name, input_dir)
+        mark = state['game_logs'].get(player_name)
+        # Marks from before they were dates (byte offsets) cannot be read from
+        if mark is None or mark['team'] != team_name or 'last_date' not in mark:
+            full[player_name] = team_name
+            continue
+        stamp = file_stamp(path)
+        if stamp == {'size': mark['size'], 'mtime_ns': mark['mtime_ns']}:
+            continue
+        raw = read_new_rows(path, mark)
+        if raw is None:
+            logging.info(f"{path} no longer has the ingested rows up to {mark['last_date']}, "
+                         f"ingesting it again in full")
+            full[player_name] = team_name
+            continue
+        mark.update(stamp)
+        if raw.empty:
+            continue
+
+        games = format_game_logs(raw).assign(player=player_name)
+        games['opp_int'] = games['opponent'].map(abbrev_to_id).astype('Int64')
+        current = games['season'] == CURRENT_SEASON
+        # The season's first real games take over the placeholder's partition, numbered from its slot, and
+        # any other new rows follow them
+        replace = mark['placeholder'] and current.any()
+        if replace:
+            games = pd.concat([games[current], games[~current]])
+        first = mark['games'] if replace else mark['games'] + 1
+        games['game_number'] = np.arange(first, first + len(games))
+        if replace:
+            replacing.append(games[games['season'] == CURRENT_SEASON])
+            appended.append(games[games['season'] != CURRENT_SEASON])
+            mark['placeholder'] = False
+        else:
+            appended.append(games)
+        mark.update(games=first + len(games) - 1, rows=mark['rows'] + len(games),
+                    last_date=max(mark['last_date'], games['Date'].max()))
+        changed.append(player_name)
+        logging.info(f"{player_name}: {len(games)} new games")
+
+    if appended:
+        append_game_logs(pd.concat(appended, ignore_index=True), store_dir)
+    if replacing:
+        append_game_logs(pd.concat(replacing, ignore_index=True), store_dir, replace=True)
+    if full:
+        ingest_full(full, state, input_dir, store_dir)
+    return changed + list(full)
+
+
+def changed_schedules(team_names, state, input_dir=INPUT_DIR, schedule_file=SCHEDULE_FILE):
+    # Reformats the schedules whose raw file changed and stores those that now differ. The raw files also
+    # change when results are filled in, which leaves dates, opponents and home/away, and so the remaining
+    # schedules, as they were. Returns the teams whose schedule changed.
+    paths = {team_name: os.path.join(input_dir, f"{team_name}{SCHEDULE_SUFFIX}") for team_name in team_names}
+    touched = [team_name for team_name in team_names
+               if file_stamp(paths[team_name]) != state['schedules'].get(team_name)]
+    if not touched:
+        return []
+    league_schedule = format_league_schedules(touched, input_dir)
+    stored = read_schedules(teams=touched, schedule_file=schedule_file) if os.path.exists(schedule_file) else None
+    stored_teams = set() if stored is None else set(stored.index.get_level_values('team').astype(str))
+    changed = [team_name for team_name in touched
+               if team_name not in stored_teams or not team_schedule_view(league_schedule, team_name).equals(
+                   team_schedule_view(stored, team_name))]
+    if changed:
+        league_schedule = league_schedule[league_schedule.index.get_level_values('team').isin(changed)]
+        league_schedule.index = league_schedule.index.remove_unused_levels()
+        update_schedules(league_schedule, schedule_file)
+        write_team_schedules(league_schedule, input_dir)
+        logging.info(f"Schedules changed: {', '.join(changed)}")
+    for team_name in touched:
+        state['schedules'][team_name] = file_stamp(paths[team_name])
+    return changed
+
+
+def refresh(player_teams, state, input_dir=INPUT_DIR):
+    # One pass over the watched files: the store is brought up to date and the affected players queued
+    if not os.path.exists(os.path.join(STORE_DIR, 'team_mapping.parquet')):
+        write_team_mapping(os.path.join(input_dir, TEAM_MAPPING_FILE))
+    teams = changed_schedules(sorted(set(player_teams.values())), state, input_dir)
+    refit = ingest_new_games(player_teams, state, input_dir)
+
+    pending = state['pending']
+    pending['refit'] = list(dict.fromkeys(pending['refit'] + refit))
+    # A refit predicts against the current schedule anyway
+    repredict = [player_name for player_name, team_name in player_teams.items() if team_name in teams]
+    pending['repredict'] = [player_name for player_name in dict.fromkeys(pending['repredict'] + repredict)
+                            if player_name not in pending['refit']]
+    save_state(state)
+    return pending
+
+
+def repredict_player(player_name, team_name, n_predictive=1):
+    # New season totals from the stored posterior against the player's current remaining schedule
+    from game_level_modelling import load_and_prepare_from_store
+    from predictive import repredict
+    from prediction_store import write_predictions
+
+    _, remaining_schedule, curr_assists, curr_goals = load_and_prepare_from_store(player_name, team_name,
+                                                                                  TEAM_MAPPING_FILE)
+    trace = repredict(os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc"), remaining_schedule,
+                      curr_assists, curr_goals, n_predictive=n_predictive)
+    write_predictions(trace, player_name)
+
+
+def can_repredict(player_name):
+    # A stored posterior of the current model to draw new totals from
+    import xarray as xr
+    from predictive import indexes_team_ids
+
+    trace_file = os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc")
+    if not os.path.exists(trace_file):
+        return False
+    with xr.open_dataset(trace_file, group='posterior') as posterior:
+        return indexes_team_ids(posterior)
+
+
+def process_queue(player_teams, state, n_predictive=1, **fit_kwargs):
+    # Refits, then re-predictions; each player leaves the queue once done, so a failed or interrupted
+    # pass picks up where it stopped
+    from game_level_modelling import main_store
+
+    pending = state['pending']
+    for kind in ['refit', 'repredict']:
+        for player_name in list(pending[kind]):
+            team_name = player_teams.get(player_name)
+            if team_name is None:
+                logging.info(f"{player_name} is no longer watched, dropping them from the queue")
+            else:
+                try:
+                    if kind == 'repredict' and can_repredict(player_name):
+                        repredict_player(player_name, team_name, n_predictive)
+                    else:
+                        main_store(player_name, team_name, TEAM_MAPPING_FILE, progressbar=False,
+                                   n_predictive=n_predictive, **fit_kwargs)
+                except Exception as e:
+                    logging.error(f"{kind} of {player_name} failed: {e!r}")
+                    continue
+            pending[kind].remove(player_name)
+            save_state(state)
+
+
+def watch(player_teams, interval=POLL_SECONDS, once=False, fit=True, n_predictive=1, **fit_kwargs):
+    state = load_state()
+    while True:
+        start = time.time()
+        pending = refresh(player_teams, state)
+        logging.info(f"Store up to date in {time.time() - start:.1f}s, {len(pending['refit'])} players to refit, "
+                     f"{len(pending['repredict'])} to re-predict")
+        if fit:
+            process_queue(player_teams, state, n_predictive=n_predictive, **fit_kwargs)
+        if once:
+            return state
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest new game logs into the feature store as they arrive and '
+                                                 'refresh the projections of the players they affect')
+    parser.add_argument('--roster', help='CSV in inputs/ with player_name and team_name columns '
+                                         '(defaults to the players in game_level_modelling)')
+    parser.add_argument('--once', action='store_true', help='one pass and exit, e.g. from cron')
+    parser.add_argument('--interval', type=int, default=POLL_SECONDS, help='seconds between passes')
+    parser.add_argument('--no-fit', action='store_true', help='only update the store and the queue')
+    parser.add_argument('--incremental', action='store_true', help='warm start refits from the previous posterior')
+    parser.add_argument('--compile-once', action='store_true', help='see game_level_modelling')
+    parser.add_argument('--adaptive', action='store_true', help='see adaptive_sampling.py')
+    parser.add_argument('--opponents', choices=['fixed', 'prior'], default=None, help='see opponent_strength.py')
+    parser.add_argument('--n-predictive', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Fits save their plots without opening windows
+    os.environ['MPLBACKEND'] = 'Agg'
+    if args.roster:
+        from sweep import load_roster
+        player_names, team_names = load_roster(args.roster)
+    else:
+        from game_level_modelling import PLAYER_NAMES, TEAM_NAMES
+        player_names, team_names = PLAYER_NAMES, TEAM_NAMES
+
+    watch(dict(zip(player_names, team_names)), interval=args.interval, once=args.once, fit=not args.no_fit,
+          n_predictive=args.n_predictive, incremental=args.incremental, compile_once=args.compile_once,
+          adaptive=args.adaptive, opponents=args.opponents)
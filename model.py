@@ -1,117 +1,111 @@
+import argparse
+import os
+
 import pandas as pd
 import pymc as pm
 import numpy as np
 import matplotlib.pyplot as plt
 
-# Load the data
-df = pd.read_csv('kkupfl_scoring_2018_2023_preprocessed.csv')
-
-# Filter data for Connor McDavid
-mcdavid_data = df[df['Player Name'] == 'Connor McDavid']
-
-
-def build_and_sample_model():
-    with pm.Model() as model:
-        # Player-specific intercept
-        alpha = pm.Normal('alpha', mu=0, sigma=10)
-
-        # Slopes for each feature
-        beta_pos_d = pm.Normal('beta_Pos_D', mu=0, sigma=10)
-        beta_pos_lw = pm.Normal('beta_Pos_LW', mu=0, sigma=10)
-        beta_pos_rw = pm.Normal('beta_Pos_RW', mu=0, sigma=10)
-        beta_games = pm.Normal('beta_GP', mu=0, sigma=10)
-        beta_goals = pm.Normal('beta_G', mu=0, sigma=10)
-        beta_assists = pm.Normal('beta_A', mu=0, sigma=10)
-        beta_shots = pm.Normal('beta_SOG', mu=0, sigma=10)
-        beta_blocks = pm.Normal('beta_BS', mu=0, sigma=10)
-        beta_hits = pm.Normal('beta_Hits', mu=0, sigma=10)
-        beta_shg = pm.Normal('beta_SHG', mu=0, sigma=10)
-        beta_sha = pm.Normal('beta_SHA', mu=0, sigma=10)
-        beta_ppg = pm.Normal('beta_PPG', mu=0, sigma=10)
-        beta_ppa = pm.Normal('beta_PPA', mu=0, sigma=10)
-
-        # Expected value of fantasy points
-        mu = (alpha +
-              beta_pos_d * mcdavid_data['Pos_D_norm'] +
-              beta_pos_lw * mcdavid_data['Pos_LW_norm'] +
-              beta_pos_rw * mcdavid_data['Pos_RW_norm'] +
-              beta_games * mcdavid_data['GP_norm'] +
-              beta_goals * mcdavid_data['G_norm'] +
-              beta_assists * mcdavid_data['A_norm'] +
-              beta_shots * mcdavid_data['SOG_norm'] +
-              beta_blocks * mcdavid_data['BS_norm'] +
-              beta_hits * mcdavid_data['Hits_norm'] +
-              beta_shg * mcdavid_data['SHG_norm'] +
-              beta_sha * mcdavid_data['SHA_norm'] +
-              beta_ppg * mcdavid_data['PPG_norm'] +
-              beta_ppa * mcdavid_data['PPA_norm']
-              )
-
-        # Model error
-        sigma = pm.HalfNormal('sigma', sigma=10)
-
-        # Likelihood
-        y = pm.Normal('y', mu=mu, sigma=sigma, observed=mcdavid_data['fantasy_points'])
+from superiority import hdi
 
-        # Sample from the posterior
-        trace = pm.sample(2000, tune=1000, return_inferencedata=True)
+INPUT_DIR = os.path.join('inputs')
+OUTPUT_DIR = os.path.join('outputs')
+DATA_FILE = 'kkupfl_scoring_2018_2023_preprocessed.csv'
 
-    return trace
+# Standardized season stats the fantasy points are regressed on, one coefficient each
+FEATURES = ['Pos_D_norm', 'Pos_LW_norm', 'Pos_RW_norm', 'GP_norm', 'G_norm', 'A_norm', 'SOG_norm', 'BS_norm',
+            'Hits_norm', 'SHG_norm', 'SHA_norm', 'PPG_norm', 'PPA_norm']
 
 
-def analyze_mcdavid(trace, data):
-    # Extract posterior samples
-    alpha_samples = trace.posterior['alpha'].values.flatten()
+def load_data(data_file=DATA_FILE):
+    df = pd.read_csv(os.path.join(INPUT_DIR, data_file))
+    df['player'] = pd.Categorical(df['Player Name'])
+    return df
 
-    # Calculate expected fantasy points for the last season data
-    last_season_data = data.iloc[-1]
-    expected_points = (
-            alpha_samples.mean() +
-            trace.posterior['beta_Pos_D'].mean().values * last_season_data['Pos_D_norm'] +
-            trace.posterior['beta_Pos_LW'].mean().values * last_season_data['Pos_LW_norm'] +
-            trace.posterior['beta_Pos_RW'].mean().values * last_season_data['Pos_RW_norm'] +
-            trace.posterior['beta_GP'].mean().values * last_season_data['GP_norm'] +
-            trace.posterior['beta_G'].mean().values * last_season_data['G_norm'] +
-            trace.posterior['beta_A'].mean().values * last_season_data['A_norm'] +
-            trace.posterior['beta_SOG'].mean().values * last_season_data['SOG_norm'] +
-            trace.posterior['beta_BS'].mean().values * last_season_data['BS_norm'] +
-            trace.posterior['beta_Hits'].mean().values * last_season_data['Hits_norm'] +
-            trace.posterior['beta_SHG'].mean().values * last_season_data['SHG_norm'] +
-            trace.posterior['beta_SHA'].mean().values * last_season_data['SHA_norm'] +
-            trace.posterior['beta_PPG'].mean().values * last_season_data['PPG_norm'] +
-            trace.posterior['beta_PPA'].mean().values * last_season_data['PPA_norm']
-    )
 
-    # Calculate credible interval
-    credible_interval = pm.stats.hpd(alpha_samples)
+def build_model(df, minibatch_size=None):
+    # Fantasy points of every player season: one coefficient vector times the design matrix, plus a
+    # player intercept partially pooled towards the league mean (non-centred)
+    X = df[FEATURES].to_numpy()
+    y = df['fantasy_points'].to_numpy()
+    player_idx = df['player'].cat.codes.to_numpy()
+    coords = {'feature': FEATURES, 'player': df['player'].cat.categories}
 
-    # Calculate variance
-    variance = np.var(alpha_samples)
+    with pm.Model(coords=coords) as model:
+        mu_alpha = pm.Normal('mu_alpha', mu=0, sigma=10)
+        sigma_alpha = pm.HalfNormal('sigma_alpha', sigma=10)
+        z_alpha = pm.Normal('z_alpha', mu=0, sigma=1, dims='player')
+        alpha = pm.Deterministic('alpha', mu_alpha + sigma_alpha * z_alpha, dims='player')
+        beta = pm.Normal('beta', mu=0, sigma=10, dims='feature')
+        sigma = pm.HalfNormal('sigma', sigma=10)
 
-    return {
-        'player': 'Connor McDavid',
-        'expected_points': expected_points,
-        'credible_interval': credible_interval,
-        'variance': variance
-    }
+        if minibatch_size is not None:
+            # Each step sees a random batch of rows, scaled up to the full data by total_size
+            X, y, player_idx = pm.Minibatch(X, y, player_idx, batch_size=minibatch_size)
+        mu = alpha[player_idx] + pm.math.dot(X, beta)
+        pm.Normal('y', mu=mu, sigma=sigma, observed=y, total_size=len(df) if minibatch_size is not None else None)
+
+    return model
+
+
+def fit(df, method='nuts', draws=2000, tune=1000, minibatch_size=None, n_iter=30000, random_seed=None):
+    # 'nuts' samples the full data, 'advi' fits a mean-field approximation, on minibatches if minibatch_size is set
+    if method == 'nuts':
+        if minibatch_size is not None:
+            raise ValueError("Minibatches need method='advi', NUTS always samples the full data")
+        with build_model(df):
+            return pm.sample(draws, tune=tune, return_inferencedata=True, random_seed=random_seed)
+    with build_model(df, minibatch_size=minibatch_size):
+        approx = pm.fit(n=n_iter, method='advi', random_seed=random_seed,
+                        obj_optimizer=pm.adam(learning_rate=1e-2))
+    return approx.sample(draws, random_seed=random_seed)
+
+
+def predict_players(trace, df, random_seed=None):
+    # Expected fantasy points (and a predictive draw with the model error) for every player's latest season,
+    # as (draw, player) arrays
+    latest = df.sort_values('Year').groupby('player', observed=True).tail(1).sort_values('player')
+    posterior = trace.posterior.stack(sample=('chain', 'draw'))
+    beta = posterior['beta'].transpose('sample', 'feature').values
+    alpha = posterior['alpha'].sel(player=latest['player'].astype(str).values).transpose('sample', 'player').values
+    expected = alpha + beta @ latest[FEATURES].to_numpy().T
+    rng = np.random.default_rng(random_seed)
+    predicted = expected + rng.normal(size=expected.shape) * posterior['sigma'].values[:, None]
+    return latest['Player Name'].to_numpy(), expected, predicted
+
+
+def summarize_players(player_names, expected, hdi_prob=0.95):
+    # Vectorized over players along the draw axis
+    low, high = hdi(np.sort(expected.T, axis=1), hdi_prob)
+    summary = pd.DataFrame({'expected_points': expected.mean(axis=0), 'sd': expected.std(axis=0),
+                            f'hdi{round(hdi_prob * 100)}_low': low, f'hdi{round(hdi_prob * 100)}_high': high},
+                           index=pd.Index(player_names, name='player'))
+    return summary.sort_values('expected_points', ascending=False)
 
 
 if __name__ == '__main__':
-    # Build and sample the model
-    trace = build_and_sample_model()
-
-    # Analyze McDavid's performance
-    result = analyze_mcdavid(trace, mcdavid_data)
-
-    # Print results
-    print(f"Analysis for {result['player']}:")
-    print(f"Expected Points: {result['expected_points']:.2f}")
-    print(f"95% Credible Interval: ({result['credible_interval'][0]:.2f}, {result['credible_interval'][1]:.2f})")
-    print(f"Variance: {result['variance']:.2f}")
+    parser = argparse.ArgumentParser(description='Hierarchical season-level fantasy points model for all players')
+    parser.add_argument('--method', choices=['nuts', 'advi'], default='nuts')
+    parser.add_argument('--minibatch', type=int, default=None,
+                        help='ADVI batch size (rows per step), needs --method advi')
+    parser.add_argument('--draws', type=int, default=2000)
+    parser.add_argument('--tune', type=int, default=1000)
+    parser.add_argument('--player', default='Connor McDavid', help='player whose posterior is plotted')
+    args = parser.parse_args()
+    if args.minibatch is not None and args.method != 'advi':
+        parser.error('--minibatch needs --method advi, NUTS always samples the full data')
+
+    df = load_data()
+    trace = fit(df, method=args.method, draws=args.draws, tune=args.tune, minibatch_size=args.minibatch)
+    player_names, expected, predicted = predict_players(trace, df)
+    summary = summarize_players(player_names, expected)
+    summary.to_csv(os.path.join(OUTPUT_DIR, 'season_model_projections.csv'))
+    print(summary.head(25).round(2).to_string())
 
     # Plot the posterior distribution of expected points
+    player = list(player_names).index(args.player)
     plt.figure(figsize=(10, 6))
-    pm.plot_posterior(trace, var_names=['alpha'], rope=(-1, 1))
-    plt.title(f"Posterior Distribution of Expected Points for Connor McDavid")
+    plt.hist(expected[:, player], bins=50, density=True, alpha=0.7)
+    plt.title(f"Posterior Distribution of Expected Points for {args.player}")
     plt.xlabel("Fantasy Points")
-    plt.show()
\ No newline at end of file
+    plt.show()
@@ -0,0 +1,188 @@
+import argparse
+import logging
+import os
+import uuid
+
+import arviz as az
+import numpy as np
+import pandas as pd
+import pymc as pm
+import xarray as xr
+
+from game_level_modelling import (PLAYER_NAMES, TEAM_NAMES, PRIORS, OUTPUT_DIR, load_and_prepare_data,
+                                  prepare_roster)
+from trace_store import save_trace
+from data_prep_bayesian import NUM_TEAMS, opponent_index
+
+# Modelled stat -> game log column(s) summed into it
+STAT_COLUMNS = {
+    'goals': ['Goals'],
+    'assists': ['Assists'],
+    'shots': ['Shots'],
+    'blocks': ['Blocks'],
+    'hits': ['Hits'],
+    'sh_points': ['SHG', 'SHA'],
+}
+STATS = list(STAT_COLUMNS)
+# kkupfl scoring, as in data_prep.py
+FANTASY_WEIGHTS = {'goals': 4.5, 'assists': 3.0, 'shots': 0.5, 'blocks': 0.5, 'hits': 0.25, 'sh_points': 2.0}
+
+
+def stat_matrix(games, stats=STATS):
+    # (game, stat) counts; NaN where a stat was not recorded (hits, blocks and SH assists in older seasons)
+    columns = {stat: games[STAT_COLUMNS[stat]].astype(float).sum(axis=1, min_count=len(STAT_COLUMNS[stat]))
+               for stat in stats}
+    return pd.DataFrame(columns)[stats].to_numpy()
+
+
+def current_totals(games, stats=STATS):
+    # Totals so far in the current (last) season, per player for a roster
+    current = games[games['season2'] == games['season2'].max()]
+    counts = np.nan_to_num(stat_matrix(current, stats))
+    if 'player_idx' not in games:
+        return counts.sum(axis=0)
+    owner = current['player_idx'].to_numpy()
+    return np.stack([counts[owner == p].sum(axis=0) for p in range(games['player_idx'].max() + 1)])
+
+
+def build_multistat_model(games, stats=STATS, player_names=None):
+    # Every stat gets its own season random walk, opponent effects and home effect, and all games x stats
+    # share one Poisson likelihood (one compiled graph). Assists keep the goals-scored term of build_model.
+    # With player_names (a roster), games carry player_idx and the random walks are per player.
+    num_seasons = int(games['season2'].max())
+    coords = {'stat': stats, 'season': np.arange(num_seasons)}
+    if player_names is not None:
+        coords['player'] = player_names
+
+    counts = stat_matrix(games, stats)
+    rows, cols = np.nonzero(~np.isnan(counts))
+    season_idx = games['season2'].values.astype('int32') - 1
+    opp_idx = opponent_index(games['opp_int'])
+
+    with pm.Model(coords=coords) as model:
+        dims = ('stat', 'season') if player_names is None else ('player', 'stat', 'season')
+        mu_t = pm.GaussianRandomWalk('mu_t', sigma=PRIORS['sigma_t'], dims=dims)
+
+        sigma_team = pm.HalfNormal('sigma_team', sigma=PRIORS['sigma_team'], dims='stat')
+        rho = pm.TruncatedNormal('rho', mu=0, sigma=PRIORS['sigma_rho'], lower=0, upper=1, dims='stat')
+        mu_team = pm.AR('mu_team', rho=rho[:, None, None], sigma=sigma_team[:, None],
+                        shape=(len(stats), NUM_TEAMS, num_seasons))
+
+        b_home = pm.Normal('b_home', mu=0, sigma=PRIORS['sigma_b_home'], dims='stat')
+        beta_goal = pm.Normal('beta_goal', mu=0, sigma=PRIORS['sigma_beta_goal'])
+
+        # (game, stat) log rates
+        if player_names is None:
+            trend = mu_t[:, season_idx].T
+        else:
+            trend = mu_t[games['player_idx'].values, :, season_idx]
+        goal_term = np.zeros(len(stats))
+        if 'assists' in stats:
+            goal_term[stats.index('assists')] = 1
+        eta = (trend + mu_team[:, opp_idx, season_idx].T + games['Home'].values[:, None] * b_home +
+               np.nan_to_num(games['Goals'].values)[:, None] * beta_goal * goal_term)
+
+        # Only the recorded (game, stat) entries enter the likelihood
+        pm.Poisson('counts', mu=pm.math.exp(eta[rows, cols]), observed=counts[rows, cols])
+
+    return model
+
+
+def predict_multistat_totals(posterior, remaining_schedule, curr_totals, stats=STATS, weights=FANTASY_WEIGHTS,
+                             player_idx=None, random_seed=None):
+    # Remaining-season totals of every stat (a sum of Poissons is a Poisson with the summed rate) and the
+    # fantasy points they score, in the current (last) season
+    rng = np.random.default_rng(random_seed)
+    opp_idx = opponent_index(remaining_schedule['opp_int'])
+    home = remaining_schedule['Home'].values
+
+    mu_t = posterior['mu_t'].values
+    mu_team = posterior['mu_team'].values
+    trend = mu_t[..., None, :, -1] if player_idx is None else mu_t[..., -1][:, :, player_idx, :]
+    rate = np.exp(trend + mu_team[:, :, :, opp_idx, -1].transpose(0, 1, 3, 2) +
+                  home[:, None] * posterior['b_home'].values[:, :, None, :])
+    if player_idx is None:
+        expected = rate.sum(axis=2)
+    else:
+        game_owner = (player_idx[None, :] == np.arange(posterior.sizes['player'])[:, None]).astype(rate.dtype)
+        expected = np.einsum('pg,cdgs->cdps', game_owner, rate)
+
+    totals = np.asarray(curr_totals) + rng.poisson(expected)
+    dims = ['chain', 'draw'] + ([] if player_idx is None else ['player'])
+    predictions = {f'pred_total_{stat}': (dims, totals[..., s]) for s, stat in enumerate(stats)}
+    predictions['pred_total_fantasy_points'] = (dims, totals @ np.array([weights[stat] for stat in stats]))
+    if 'goals' in stats and 'assists' in stats:
+        predictions['pred_total_points'] = (dims, totals[..., stats.index('goals')] +
+                                            totals[..., stats.index('assists')])
+    coords = {dim: posterior[dim] for dim in dims if dim in posterior.coords}
+    return xr.Dataset(predictions, coords=coords)
+
+
+def build_and_sample_multistat_model(player_df, remaining_schedule, player_name, draws=100, tune=100, chains=None,
+                                     nuts_sampler='pymc', progressbar=True):
+    model = build_multistat_model(player_df)
+    with model:
+        trace = pm.sample(draws, tune=tune, chains=chains, nuts_sampler=nuts_sampler, return_inferencedata=True,
+                          progressbar=progressbar)
+    predictions = predict_multistat_totals(trace.posterior, remaining_schedule, current_totals(player_df))
+    trace.posterior = trace.posterior.assign(predictions)
+    trace.posterior.attrs['player'] = player_name
+    save_trace(trace, os.path.join(OUTPUT_DIR, f"{player_name}_multistat_results.nc"))
+    return trace
+
+
+def build_and_sample_multistat_roster(games, remaining_games, player_names, nuts_sampler='pymc'):
+    model = build_multistat_model(games, player_names=player_names)
+    with model:
+        trace = pm.sample(100, tune=100, nuts_sampler=nuts_sampler, return_inferencedata=True, progressbar=True)
+    predictions = predict_multistat_totals(trace.posterior, remaining_games, current_totals(games),
+                                           player_idx=remaining_games['player_idx'].values)
+    trace.posterior = trace.posterior.assign(predictions)
+    # One id for the joint fit in every player's slice, so fantasy_sim keeps their draws together
+    trace.posterior.attrs['fit'] = uuid.uuid4().hex
+    for player_name in player_names:
+        posterior = trace.posterior.sel(player=player_name, drop=True)
+        posterior.attrs['player'] = player_name
+        save_trace(az.InferenceData(posterior=posterior),
+                   os.path.join(OUTPUT_DIR, f"{player_name}_multistat_results.nc"))
+    return trace
+
+
+def summarize_fantasy(trace, player_name):
+    fantasy = trace.posterior['pred_total_fantasy_points'].values.ravel()
+    hdi = az.hdi(fantasy, hdi_prob=0.93)
+    summary = {f'{stat}_mean': trace.posterior[f'pred_total_{stat}'].values.mean() for stat in STATS}
+    summary.update({'fantasy_points_mean': fantasy.mean(), 'fantasy_points_sd': fantasy.std(),
+                    'fantasy_points_hdi93_low': hdi[0], 'fantasy_points_hdi93_high': hdi[1]})
+    return pd.Series(summary, name=player_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-stat game level model and fantasy point projections')
+    parser.add_argument('--batch', action='store_true', help='fit all players in one joint model')
+    parser.add_argument('--sampler', default='pymc', help='NUTS implementation, see game_level_modelling')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    team_mapping_file = "team_mapping.csv"
+    if args.batch:
+        from data_prep_bayesian import ingest_game_logs
+        from data_prep_schedules import format_league_schedules
+
+        player_teams = dict(zip(PLAYER_NAMES, TEAM_NAMES))
+        league_schedule = format_league_schedules(sorted(set(TEAM_NAMES)))
+        games, remaining_games, _, _, _ = prepare_roster(ingest_game_logs(player_teams, league_schedule),
+                                                         league_schedule, player_teams, team_mapping_file)
+        trace = build_and_sample_multistat_roster(games, remaining_games, PLAYER_NAMES, nuts_sampler=args.sampler)
+        summaries = [summarize_fantasy(az.InferenceData(posterior=trace.posterior.sel(player=player_name)),
+                                       player_name) for player_name in PLAYER_NAMES]
+    else:
+        summaries = []
+        for player_name, team_name in zip(PLAYER_NAMES, TEAM_NAMES):
+            player_df, remaining_schedule, _, _ = load_and_prepare_data(
+                player_name, f"{player_name}_df.csv", f"{team_name}_schedule_2425_formatted.csv", team_mapping_file)
+            trace = build_and_sample_multistat_model(player_df, remaining_schedule, player_name,
+                                                     nuts_sampler=args.sampler)
+            summaries.append(summarize_fantasy(trace, player_name))
+
+    print(pd.DataFrame(summaries).round(1).to_string())
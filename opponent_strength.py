@@ -0,0 +1,147 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from data_prep_bayesian import NUM_TEAMS
+from trace_store import atomic_write
+
+OUTPUT_DIR = os.path.join('outputs')
+# Posterior summaries of the league-wide fit, read by every single-player model that uses them
+STRENGTH_FILE = os.path.join(OUTPUT_DIR, 'opponent_strength.nc')
+STATS = ['assists', 'goals']
+# Roster model names of each stat's AR parameters
+AR_PARAMS = {'assists': ('rho_a', 'sigma_assists_team'), 'goals': ('rho_g', 'sigma_goals_team')}
+
+
+def data_key(games, settings):
+    # Everything the summaries depend on: every player's games and the fit settings
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(games[['player_idx', 'season', 'opp_int', 'Home', 'Goals', 'Assists']],
+                                        index=False).values.tobytes())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return h.hexdigest()[:32]
+
+
+def summarize_opponent_strength(posterior, seasons):
+    # Mean and sd of every opponent's effect in every league season, and the posterior means of the AR
+    # parameters, which carry the effects to seasons the fit did not cover (see team_offsets). Teams are
+    # labelled with their team_mapping.csv ids, which are also their rows.
+    strength = xr.Dataset(coords={'team': np.arange(NUM_TEAMS), 'season': np.asarray(seasons, dtype=int)})
+    for stat in STATS:
+        draws = posterior[f'mu_{stat}_team'].values.reshape(-1, NUM_TEAMS, len(seasons))
+        strength[f'{stat}_team_mean'] = (('team', 'season'), draws.mean(axis=0))
+        strength[f'{stat}_team_sd'] = (('team', 'season'), draws.std(axis=0))
+        rho, sigma = AR_PARAMS[stat]
+        strength.attrs[f'rho_{stat}'] = float(posterior[rho].mean())
+        strength.attrs[f'sigma_{stat}'] = float(posterior[sigma].mean())
+    return strength
+
+
+def load_opponent_strength(strength_file=STRENGTH_FILE):
+    if not os.path.exists(strength_file):
+        raise FileNotFoundError(f"No opponent strength in {strength_file}, fit it first with opponent_strength.py")
+    with xr.open_dataset(strength_file) as strength:
+        return strength.load()
+
+
+def fit_opponent_strength(player_teams, team_mapping_file='team_mapping.csv', use_store=False, likelihood='cell',
+                          draws=500, tune=500, chains=None, inference='nuts', strength_file=STRENGTH_FILE,
+                          force=False):
+    # One roster model over every player's games, whose shared opponent effects are estimated from all of
+    # them. Reused as long as the games and settings are unchanged.
+    import pymc as pm
+    from approximate import fit_approximation
+    from game_level_modelling import load_roster_games, build_roster_model
+
+    games, _, _, _, seasons = load_roster_games(player_teams, team_mapping_file, use_store=use_store)
+    settings = {'players': list(player_teams), 'likelihood': likelihood, 'draws': draws, 'tune': tune,
+                'chains': chains, 'inference': inference, 'num_teams': NUM_TEAMS}
+    key = data_key(games, settings)
+    if not force and os.path.exists(strength_file):
+        strength = load_opponent_strength(strength_file)
+        if strength.attrs.get('data_key') == key:
+            logging.info(f"Games unchanged, reusing the opponent strength in {strength_file}")
+            return strength
+
+    logging.info(f"Fitting opponent strength over {len(player_teams)} players and {len(seasons)} seasons")
+    model = build_roster_model(games, list(player_teams), seasons, likelihood=likelihood)
+    if inference == 'nuts':
+        with model:
+            trace = pm.sample(draws, tune=tune, chains=chains, return_inferencedata=True)
+    else:
+        trace = fit_approximation(model, inference, draws=draws)
+
+    strength = summarize_opponent_strength(trace.posterior, seasons)
+    strength.attrs.update({'data_key': key, 'inference': inference})
+    os.makedirs(os.path.dirname(strength_file), exist_ok=True)
+    with atomic_write(strength_file) as tmp_path:
+        strength.to_netcdf(tmp_path)
+    return strength
+
+
+def _season_year(season):
+    # 202324 -> 2023
+    return int(str(season)[:4])
+
+
+def team_offsets(strength, seasons, num_seasons=None):
+    # Mean and sd of every opponent's effect in each of a player's seasons (in season2 order, padded to
+    # num_seasons), as (NUM_TEAMS, num_seasons) arrays per stat with a row per team id. A season the league
+    # fit did not cover (the padding past the current season, or one before the league's first) is projected
+    # from the nearest covered season with the fitted AR(1): after k steps the mean shrinks by rho^k and the
+    # variance grows towards the stationary sigma^2 / (1 - rho^2).
+    if not np.array_equal(strength['team'].values, np.arange(NUM_TEAMS)):
+        raise ValueError("Opponent strength is not labelled by team id (fitted before the ids were used as rows), "
+                         "refit it with opponent_strength.py")
+    num_seasons = num_seasons or len(seasons)
+    years = [_season_year(season) for season in seasons]
+    years += [years[-1] + i for i in range(1, num_seasons - len(years) + 1)]
+    fitted_years = np.array([_season_year(season) for season in strength['season'].values])
+
+    nearest = np.abs(np.array(years)[:, None] - fitted_years[None, :]).argmin(axis=1)
+    steps = np.abs(np.array(years) - fitted_years[nearest])
+    offsets = {}
+    for stat in STATS:
+        rho, sigma = strength.attrs[f'rho_{stat}'], strength.attrs[f'sigma_{stat}']
+        decay = rho ** steps
+        mean = strength[f'{stat}_team_mean'].values[:, nearest] * decay
+        variance = (strength[f'{stat}_team_sd'].values[:, nearest] ** 2 * decay ** 2 +
+                    sigma ** 2 * (1 - decay ** 2) / max(1 - rho ** 2, 1e-6))
+        offsets[f'{stat}_team_mu'] = mean
+        offsets[f'{stat}_team_sigma'] = np.sqrt(variance)
+    return offsets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="League-wide opponent strength, fitted once over every player's "
+                                                 "games for the single-player models (--opponents)")
+    parser.add_argument('--roster', help='CSV in inputs/ with player_name and team_name columns '
+                                         '(defaults to the players in game_level_modelling)')
+    parser.add_argument('--store', action='store_true', help='read the games from the Parquet feature store')
+    parser.add_argument('--likelihood', choices=['game', 'cell'], default='cell')
+    parser.add_argument('--inference', default='nuts', help="'nuts' or an approximate method, see approximate.py")
+    parser.add_argument('--draws', type=int, default=500)
+    parser.add_argument('--tune', type=int, default=500)
+    parser.add_argument('--force', action='store_true', help='refit even if the games are unchanged')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.roster:
+        from sweep import load_roster
+        player_names, team_names = load_roster(args.roster)
+    else:
+        from game_level_modelling import PLAYER_NAMES, TEAM_NAMES
+        player_names, team_names = PLAYER_NAMES, TEAM_NAMES
+
+    strength = fit_opponent_strength(dict(zip(player_names, team_names)), use_store=args.store,
+                                     likelihood=args.likelihood, draws=args.draws, tune=args.tune,
+                                     inference=args.inference, force=args.force)
+    for stat in STATS:
+        print(f"{stat}: rho {strength.attrs[f'rho_{stat}']:.2f}, sigma {strength.attrs[f'sigma_{stat}']:.3f}, "
+              f"mean posterior sd of the effects {float(strength[f'{stat}_team_sd'].mean()):.3f}")
@@ -0,0 +1,108 @@
+import os
+from urllib.parse import unquote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# pyarrow.dataset, pandas and xarray are imported where they are used (writing, whole-table reads), so that
+# reading draws stays cheap to import (see query.py)
+
+OUTPUT_DIR = os.path.join('outputs')
+PREDICTIONS_DIR = os.path.join(OUTPUT_DIR, 'predictions')
+# The tables carry no model version: predictions written before opponent effects were indexed by team id
+# (game_level_modelling.MODEL_VERSION 7) put Vancouver on Edmonton's row and are stale. Refit those players
+# (which rewrites their partitions) rather than reading them.
+
+# Season totals fit comfortably in int16
+PREDICTION_SCHEMA = pa.schema([
+    ('chain', pa.int16()),
+    ('draw', pa.int32()),
+    ('predictive_draw', pa.int16()),
+    ('pred_total_points', pa.int16()),
+    ('pred_total_goals', pa.int16()),
+    ('pred_total_assists', pa.int16()),
+    ('player', pa.string()),
+])
+# Directory layout: predictions/player=Sidney Crosby/part-0.parquet, so parallel fits never write the same file
+PARTITION_PREFIX = 'player='
+
+
+def predictions_frame(trace, player_name=None):
+    # Long table of the predictive totals: one row per (player, chain, draw, predictive_draw).
+    # A roster trace carries its own player dimension, a single-player trace needs player_name.
+    from predictive import PRED_VARS
+
+    predictions = trace.posterior[PRED_VARS]
+    if 'predictive_draw' not in predictions.dims:
+        predictions = predictions.expand_dims(predictive_draw=1)
+    frame = predictions.to_dataframe().reset_index()
+    if 'player' not in frame:
+        frame['player'] = player_name
+    frame['predictive_draw'] = frame['predictive_draw'].astype(int)
+    return frame
+
+
+def write_predictions(trace, player_name=None, predictions_dir=PREDICTIONS_DIR):
+    # Replaces the partitions of the players in trace, every other player's predictions are kept
+    import pyarrow.dataset as ds
+
+    frame = predictions_frame(trace, player_name)
+    table = pa.Table.from_pandas(frame[PREDICTION_SCHEMA.names], schema=PREDICTION_SCHEMA, preserve_index=False)
+    ds.write_dataset(table, predictions_dir, format='parquet',
+                     partitioning=ds.partitioning(pa.schema([('player', pa.string())]), flavor='hive'),
+                     file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+                     existing_data_behavior='delete_matching', basename_template='part-{i}.parquet')
+
+
+def read_predictions(players=None, columns=None, predictions_dir=PREDICTIONS_DIR):
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([('player', pa.dictionary(pa.int32(), pa.string()))]),
+                                   flavor='hive', dictionaries='infer')
+    dataset = ds.dataset(predictions_dir, format='parquet', partitioning=partitioning)
+    predicate = None if players is None else pc.field('player').isin(list(players))
+    if columns is not None:
+        columns = list(dict.fromkeys(['player'] + list(columns)))
+    predictions = dataset.to_table(columns=columns, filter=predicate).to_pandas()
+    if players is not None:
+        predictions['player'] = predictions['player'].cat.set_categories(list(players))
+    return predictions
+
+
+def prediction_draws(var='pred_total_points', players=None, predictions_dir=PREDICTIONS_DIR):
+    # Draws of one total for each player, as with TraceCatalog.draws but from the compact store. Only the
+    # players' own files and the one column are read, straight with pyarrow.parquet.
+    partitions = _partitions(predictions_dir)
+    if players is None:
+        players = sorted(partitions)
+    draws = {}
+    for player_name in players:
+        if player_name not in partitions:
+            raise KeyError(f"No stored predictions for {player_name}")
+        files = sorted(os.path.join(partitions[player_name], name) for name in os.listdir(partitions[player_name])
+                       if name.endswith('.parquet'))
+        draws[player_name] = np.concatenate([_column_values(pq.ParquetFile(path).read(columns=[var]), var)
+                                             for path in files])
+    return draws
+
+
+def _column_values(table, var):
+    # The totals are integers without nulls, so their data buffers are the values. (Array.to_numpy would
+    # import pandas.)
+    return np.concatenate([np.frombuffer(chunk.buffers()[1], dtype=str(chunk.type), count=len(chunk),
+                                         offset=chunk.offset * chunk.type.bit_width // 8)
+                           for chunk in table.column(var).chunks])
+
+
+def _partitions(predictions_dir=PREDICTIONS_DIR):
+    # Player -> partition directory. Directory names are URL encoded ('Sidney%20Crosby')
+    if not os.path.exists(predictions_dir):
+        return {}
+    return {unquote(name[len(PARTITION_PREFIX):]): os.path.join(predictions_dir, name)
+            for name in os.listdir(predictions_dir) if name.startswith(PARTITION_PREFIX)}
+
+
+def stored_prediction_players(predictions_dir=PREDICTIONS_DIR):
+    return sorted(_partitions(predictions_dir))
@@ -0,0 +1,88 @@
+import numpy as np
+import xarray as xr
+
+from data_prep_bayesian import NUM_TEAMS, opponent_index
+
+PRED_VARS = ['pred_total_points', 'pred_total_goals', 'pred_total_assists']
+
+
+def indexes_team_ids(posterior):
+    # Posteriors fitted before opponent effects were indexed by team id have 31 rows, on which the ids are off
+    # by one: they cannot be predicted from and need a refit
+    return posterior['mu_assists_team'].shape[-2] == NUM_TEAMS
+
+
+def game_rates(posterior, remaining_schedule, player_idx=None):
+    # Posterior draws of the expected assists and goals in each remaining game, in the current (last) season:
+    # (chain, draw, game) arrays. For a roster fit, player_idx gives each remaining game's player.
+    if not indexes_team_ids(posterior):
+        raise ValueError(f"Posterior has {posterior['mu_assists_team'].shape[-2]} opponent effects, not one per "
+                         f"team id ({NUM_TEAMS}): it predates the current model and has to be refitted")
+    opp_idx = opponent_index(remaining_schedule['opp_int'])
+    home = remaining_schedule['Home'].values
+    b_home = posterior['b_home'].values
+
+    rates = {}
+    for stat, home_idx in [('assists', 1), ('goals', 2)]:
+        mu_t = posterior[f'mu_{stat}_t'].values
+        mu_team = posterior[f'mu_{stat}_team'].values
+        trend = mu_t[..., -1, None] if player_idx is None else mu_t[:, :, player_idx, -1]
+        rates[stat] = np.exp(trend + mu_team[:, :, opp_idx, -1] + home * b_home[..., home_idx, None])
+    return rates
+
+
+def expected_remaining(posterior, remaining_schedule, player_idx=None):
+    # Expected assists and goals over all remaining games; for a roster fit summed per player
+    expected = {}
+    for stat, rate in game_rates(posterior, remaining_schedule, player_idx).items():
+        if player_idx is None:
+            expected[stat] = rate.sum(axis=-1)
+        else:
+            game_owner = (player_idx[None, :] == np.arange(posterior.sizes['player'])[:, None]).astype(rate.dtype)
+            expected[stat] = rate @ game_owner.T
+    return expected
+
+
+def predict_totals(posterior, remaining_schedule, curr_assists, curr_goals, n_predictive=1, player_idx=None,
+                   random_seed=None):
+    # The remaining games are independent Poissons given the parameters, so their sum is a single Poisson
+    # with the summed rate: one draw per total instead of one per game
+    rng = np.random.default_rng(random_seed)
+    expected = expected_remaining(posterior, remaining_schedule, player_idx)
+
+    totals = {}
+    for stat, curr in [('assists', curr_assists), ('goals', curr_goals)]:
+        rate = expected[stat][..., None]
+        draws = rng.poisson(rate, size=rate.shape[:-1] + (n_predictive,))
+        totals[stat] = np.asarray(curr)[..., None] + draws
+    totals['points'] = totals['assists'] + totals['goals']
+
+    dims = ['chain', 'draw'] + ([] if player_idx is None else ['player']) + ['predictive_draw']
+    coords = {dim: posterior[dim] for dim in dims if dim in posterior.coords}
+    predictions = xr.Dataset({f'pred_total_{stat}': (dims, values) for stat, values in totals.items()},
+                             coords=coords)
+    if n_predictive == 1:
+        # Same (chain, draw) layout as when the totals were sampled inside the model
+        predictions = predictions.squeeze('predictive_draw', drop=True)
+    return predictions
+
+
+def add_predictions(trace, remaining_schedule, curr_assists, curr_goals, n_predictive=1, player_idx=None,
+                    random_seed=None):
+    predictions = predict_totals(trace.posterior, remaining_schedule, curr_assists, curr_goals,
+                                 n_predictive=n_predictive, player_idx=player_idx, random_seed=random_seed)
+    trace.posterior = trace.posterior.drop_vars(PRED_VARS, errors='ignore').assign(predictions)
+    trace.posterior.attrs['n_predictive'] = n_predictive
+    return trace
+
+
+def repredict(trace_file, remaining_schedule, curr_assists, curr_goals, n_predictive=1, random_seed=None):
+    # New totals against an updated schedule from a stored fit, without refitting
+    import arviz as az
+    from trace_store import save_trace
+
+    trace = az.from_netcdf(trace_file).load()
+    trace = add_predictions(trace, remaining_schedule, curr_assists, curr_goals, n_predictive=n_predictive,
+                            random_seed=random_seed)
+    save_trace(trace, trace_file)
+    return trace
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from prediction_store import prediction_draws, stored_prediction_players
+from superiority import prob_greater
+
+# Read-only questions about the stored projections (outputs/predictions), for bots and dashboards that start a
+# process per request: only NumPy and pyarrow.parquet are imported up front, matplotlib only with --plot.
+# Nothing here checks which model wrote the predictions: ones stored before opponent effects were indexed by
+# team id are wrong for every player who faces Vancouver or Edmonton, and have to be regenerated by a refit.
+
+OUTPUT_DIR = os.path.join('outputs')
+STATS = ['points', 'goals', 'assists']
+QUANTILES = [5, 25, 50, 75, 95]
+
+
+def load(players, stat):
+    return prediction_draws(f'pred_total_{stat}', players)
+
+
+def project(players, stat='points', quantiles=QUANTILES):
+    # Mean, SD and percentiles of each player's season total
+    results = {}
+    for player_name, values in load(players, stat).items():
+        result = {'mean': float(values.mean()), 'sd': float(values.std())}
+        result.update({f'q{q:02d}': float(v) for q, v in zip(quantiles, np.percentile(values, quantiles))})
+        results[player_name] = result
+    return results
+
+
+def compare(player_1, player_2, stat='points'):
+    draws = load([player_1, player_2], stat)
+    greater = prob_greater(draws[player_1], draws[player_2])
+    less = prob_greater(draws[player_2], draws[player_1])
+    return {'p_greater': greater, 'p_tie': 1 - greater - less, 'p_less': less,
+            'mean_difference': float(draws[player_1].mean() - draws[player_2].mean())}
+
+
+def percentile(player_name, stat='points', quantiles=QUANTILES, at=None):
+    # Percentiles of the total, and with at the chance of reaching at least that total
+    values = load([player_name], stat)[player_name]
+    result = {f'q{q:g}': float(v) for q, v in zip(quantiles, np.percentile(values, quantiles))}
+    if at is not None:
+        result[f'p_at_least_{at:g}'] = float((values >= at).mean())
+    return result
+
+
+def plot(players, stat='points'):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    for player_name, values in load(players, stat).items():
+        plt.hist(values, bins=50, alpha=0.5, label=player_name)
+    plt.xlabel(f'Total {stat}')
+    plt.ylabel('Frequency')
+    plt.legend()
+    path = os.path.join(OUTPUT_DIR, f'query_{stat}.png')
+    plt.savefig(path)
+    plt.close()
+    return path
+
+
+def format_rows(results):
+    # {row: {column: value}} as an aligned text table
+    columns = list(next(iter(results.values())))
+    width = max(len(str(row)) for row in results)
+    column_widths = [max(10, len(column) + 2) for column in columns]
+    lines = [' ' * width + ''.join(f'{column:>{w}}' for column, w in zip(columns, column_widths))]
+    lines += [f'{row:<{width}}' + ''.join(f'{values[column]:>{w}.3f}' for column, w in zip(columns, column_widths))
+              for row, values in results.items()]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the stored season projections without loading the models')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('players', help='players with stored projections')
+    project_parser = commands.add_parser('project', help='mean, SD and percentiles of season totals')
+    project_parser.add_argument('players', nargs='+')
+    compare_parser = commands.add_parser('compare', help='P(player 1 > player 2)')
+    compare_parser.add_argument('players', nargs=2, metavar='PLAYER')
+    percentile_parser = commands.add_parser('percentile', help='percentiles of one player\'s total')
+    percentile_parser.add_argument('player')
+    percentile_parser.add_argument('--q', type=float, nargs='+', default=QUANTILES, help='percentiles, 0-100')
+    percentile_parser.add_argument('--at', type=float, default=None, help='also P(total >= AT)')
+    for command_parser in [project_parser, compare_parser, percentile_parser]:
+        command_parser.add_argument('--stat', choices=STATS, default='points')
+    for command_parser in [project_parser, compare_parser]:
+        command_parser.add_argument('--plot', action='store_true', help=f'save histograms to {OUTPUT_DIR}/')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'players':
+            result = stored_prediction_players()
+        elif args.command == 'project':
+            result = project(args.players, args.stat)
+        elif args.command == 'compare':
+            result = compare(*args.players, args.stat)
+        else:
+            result = percentile(args.player, args.stat, args.q, args.at)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    if args.json:
+        print(json.dumps(result))
+    elif args.command == 'players':
+        print('\n'.join(result))
+    elif args.command == 'project':
+        print(format_rows(result))
+    elif args.command == 'compare':
+        print(format_rows({f'{args.players[0]} vs {args.players[1]}': result}))
+    else:
+        print(format_rows({args.player: result}))
+
+    if getattr(args, 'plot', False):
+        print(f"Histogram written to {plot(args.players, args.stat)}")
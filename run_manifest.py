@@ -0,0 +1,188 @@
+import argparse
+import glob
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+OUTPUT_DIR = os.path.join('outputs')
+MANIFEST_DIR = os.path.join(OUTPUT_DIR, 'manifests')
+# Variables whose ESS and R-hat are recorded
+HEALTH_PREFIXES = ('mu_', 'pred_total_')
+# R-hat above this counts as not converged
+RHAT_THRESHOLD = 1.01
+
+
+class RunManifest:
+    # Stage timings, sampler health and peak memory of one player's run, written as one JSON file per run
+
+    def __init__(self, player_name, **settings):
+        self.record = {'player': player_name, 'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid(),
+                       'settings': settings, 'stages': {}, 'cache_hit': False}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record['stages'][name] = self.record['stages'].get(name, 0.0) + time.perf_counter() - start
+
+    def add_sampling(self, trace):
+        # Call after the 'sample' stage: anything in it before the first draw is compilation and set up
+        self.record.update(sampler_health(trace, self.record['stages'].get('sample')))
+
+    def write(self, manifest_dir=MANIFEST_DIR):
+        self.record['wall_time'] = time.perf_counter() - self._start
+        self.record.update(peak_rss_mb())
+        os.makedirs(manifest_dir, exist_ok=True)
+        # Unique per run, so parallel sweep workers never write the same file
+        path = os.path.join(manifest_dir, f"{self.record['player']}_{time.strftime('%Y%m%dT%H%M%S')}_"
+                                          f"{os.getpid()}.json")
+        with open(path, 'w') as f:
+            json.dump(self.record, f, indent=2)
+        return path
+
+
+def timed_stage(manifest, name):
+    # manifest.stage(name), or nothing when the run is not being recorded
+    return nullcontext() if manifest is None else manifest.stage(name)
+
+
+def _finite(value):
+    # NaN (e.g. R-hat of a single chain) is not valid JSON
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def sampler_health(trace, sample_wall_time=None):
+    import arviz as az
+
+    posterior = trace.posterior
+    sampling_time = posterior.attrs.get('sampling_time')
+    n_chains, n_draws = posterior.sizes['chain'], posterior.sizes['draw']
+    health = {'chains': n_chains, 'draws': n_draws, 'tuning_steps': posterior.attrs.get('tuning_steps'),
+              'sampling_time': sampling_time}
+    if sampling_time:
+        health['draws_per_sec'] = n_chains * n_draws / sampling_time
+        if sample_wall_time is not None:
+            health['compile_time'] = sample_wall_time - sampling_time
+
+    for key in ['adaptive_rounds', 'converged']:
+        # Set by adaptive_sampling.sample_until_converged
+        if key in posterior.attrs:
+            health[key] = int(posterior.attrs[key])
+
+    if 'sample_stats' in trace:
+        stats = trace.sample_stats
+        health['divergences'] = int(stats['diverging'].sum())
+        if 'reached_max_treedepth' in stats:
+            health['max_treedepth_hits'] = int(stats['reached_max_treedepth'].sum())
+        if 'tree_depth' in stats:
+            health['max_tree_depth'] = int(stats['tree_depth'].max())
+        if 'n_steps' in stats:
+            health['mean_n_steps'] = float(stats['n_steps'].mean())
+        if 'perf_counter_diff' in stats:
+            health['mean_draw_seconds'] = float(stats['perf_counter_diff'].mean())
+
+    var_names = [var for var in posterior.data_vars if var.startswith(HEALTH_PREFIXES)]
+    ess = az.ess(trace, var_names=var_names, method='bulk')
+    rhat = az.rhat(trace, var_names=var_names)
+    health['convergence'] = {
+        var: {'ess_bulk': _finite(ess[var].min()),
+              'ess_per_sec': _finite(ess[var].min() / sampling_time) if sampling_time else None,
+              'rhat': _finite(rhat[var].max())}
+        for var in var_names}
+    return health
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process (over its whole life) and of its finished child processes, e.g.
+    # the chains of a multi-core pm.sample. ru_maxrss is in kB on Linux.
+    if resource is None:
+        return {'peak_rss_mb': None, 'peak_children_rss_mb': None}
+    return {'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_children_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+def flatten(record):
+    # One manifest -> one row: stage times as stage_<name>, worst convergence over the recorded variables
+    row = {key: value for key, value in record.items() if key not in ('settings', 'stages', 'convergence')}
+    row.update({f'setting_{key}': value for key, value in record['settings'].items()})
+    row.update({f'stage_{key}': value for key, value in record['stages'].items()})
+    convergence = record.get('convergence', {})
+    ess_per_sec = [values['ess_per_sec'] for values in convergence.values() if values['ess_per_sec'] is not None]
+    rhats = [values['rhat'] for values in convergence.values() if values['rhat'] is not None]
+    row['min_ess_per_sec'] = min(ess_per_sec, default=None)
+    row['max_rhat'] = max(rhats, default=None)
+    if ess_per_sec:
+        row['slowest_variable'] = min(convergence, key=lambda var: convergence[var]['ess_per_sec'] or np.inf)
+    return row
+
+
+def load_manifests(manifest_dir=MANIFEST_DIR, latest=True, since=None):
+    # All runs as a table, by default only each player's latest run
+    records = []
+    for path in glob.glob(os.path.join(manifest_dir, '*.json')):
+        with open(path) as f:
+            records.append(flatten(json.load(f)))
+    runs = pd.DataFrame(records)
+    if runs.empty:
+        return runs
+    runs['started'] = pd.to_datetime(runs['started'])
+    if since is not None:
+        runs = runs[runs['started'] >= pd.Timestamp(since)]
+    runs = runs.sort_values('started')
+    if latest:
+        runs = runs.groupby('player').tail(1)
+    return runs.reset_index(drop=True)
+
+
+def slowest_runs(runs, n=10):
+    columns = ['player', 'wall_time'] + [column for column in runs if column.startswith('stage_')] + \
+              [column for column in ['compile_time', 'draws_per_sec', 'peak_rss_mb'] if column in runs]
+    return runs.sort_values('wall_time', ascending=False)[columns].head(n)
+
+
+def least_healthy_runs(runs, n=10):
+    # Runs that ran NUTS (not served from the cache), worst first: any divergence, then R-hat over the
+    # threshold, then the worst R-hat, then the slowest-mixing variable
+    if 'divergences' not in runs:
+        return runs.iloc[:0]
+    sampled = runs[runs['divergences'].notna()].copy()
+    sampled['rhat_exceeded'] = sampled['max_rhat'] > RHAT_THRESHOLD
+    columns = [column for column in ['player', 'divergences', 'max_treedepth_hits', 'max_rhat', 'min_ess_per_sec',
+                                     'slowest_variable'] if column in sampled]
+    ordered = sampled.sort_values(['divergences', 'rhat_exceeded', 'max_rhat', 'min_ess_per_sec'],
+                                  ascending=[False, False, False, True])
+    return ordered[columns].head(n)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Slowest and least healthy player runs from the run manifests')
+    parser.add_argument('--all', action='store_true', help="every run, not only each player's latest")
+    parser.add_argument('--since', default=None, help='only runs started from this date/time on')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--csv', default=None, help='also write the full table to this file')
+    args = parser.parse_args()
+
+    runs = load_manifests(latest=not args.all, since=args.since)
+    if runs.empty:
+        print(f"No run manifests in {MANIFEST_DIR}")
+    else:
+        if args.csv:
+            runs.to_csv(args.csv, index=False)
+        print(f"{len(runs)} runs, {runs['cache_hit'].sum()} served from the trace cache\n")
+        print("Slowest runs:")
+        print(slowest_runs(runs, args.top).round(2).to_string(index=False))
+        print("\nLeast healthy runs:")
+        print(least_healthy_runs(runs, args.top).round(4).to_string(index=False))
@@ -0,0 +1,141 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+OUTPUT_DIR = os.path.join('outputs')
+# Upper bound on the (players x distinct values) query block searched at once, ~32 MB per int64 array
+MAX_CHUNK_ELEMENTS = 2 ** 22
+
+_draws = None
+
+
+def prob_greater(a, b):
+    # P(a > b) over every pair of draws, by counting with sorted b instead of an n_a x n_b comparison
+    b = np.sort(np.ravel(b))
+    values, counts = np.unique(np.ravel(a), return_counts=True)
+    return (np.searchsorted(b, values, side='left') * counts).sum() / (counts.sum() * b.size)
+
+
+def hdi(sorted_draws, hdi_prob):
+    # Narrowest interval holding hdi_prob of each row's (sorted) draws, as az.hdi computes it
+    n = sorted_draws.shape[1]
+    interval_width = int(np.floor(hdi_prob * n))
+    widths = sorted_draws[:, interval_width:] - sorted_draws[:, :n - interval_width]
+    lower = np.argmin(widths, axis=1)
+    rows = np.arange(len(sorted_draws))
+    return sorted_draws[rows, lower], sorted_draws[rows, lower + interval_width]
+
+
+class CompressedDraws:
+    # Every player's draws as sorted distinct values with counts, on a grid shared by all players.
+    # Season totals are integers, so a player's tens of thousands of draws collapse to ~100 values.
+    def __init__(self, draws):
+        grid = np.unique(np.concatenate([np.ravel(d) for d in draws]))
+        self.grid_size = len(grid)
+        self.ranks, self.counts = zip(*(np.unique(np.searchsorted(grid, np.ravel(d)), return_counts=True)
+                                        for d in draws))
+        self.n_draws = np.array([counts.sum() for counts in self.counts])
+        # Player j's values keyed as j * grid_size + rank are sorted across all players,
+        # so one searchsorted answers a query against many players at once
+        self.keys = np.concatenate([j * self.grid_size + ranks for j, ranks in enumerate(self.ranks)])
+        self.cum_counts = np.concatenate([[0], np.cumsum(np.concatenate(self.counts))])
+        self.starts = np.concatenate([[0], np.cumsum([len(ranks) for ranks in self.ranks])])
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def compare(self, i, j0, j1):
+        # P(player i > player j) and P(player i < player j) for j in [j0, j1)
+        players = np.arange(j0, j1)
+        queries = players[:, None] * self.grid_size + self.ranks[i][None, :]
+        below = self.cum_counts[self.starts[j0:j1]][:, None]
+        less = self.cum_counts[np.searchsorted(self.keys, queries, side='left')] - below
+        less_equal = self.cum_counts[np.searchsorted(self.keys, queries, side='right')] - below
+        n_pairs = self.n_draws[i] * self.n_draws[j0:j1]
+        return (less @ self.counts[i]) / n_pairs, 1 - (less_equal @ self.counts[i]) / n_pairs
+
+
+def _init_worker(draws):
+    global _draws
+    _draws = draws
+
+
+def _compare_rows(rows, max_chunk_elements=MAX_CHUNK_ELEMENTS):
+    # Upper triangle entries for a range of rows, in column blocks that bound the query size
+    results = []
+    for i in rows:
+        block = max(1, max_chunk_elements // len(_draws.ranks[i]))
+        for j0 in range(i + 1, len(_draws), block):
+            j1 = min(j0 + block, len(_draws))
+            greater, less = _draws.compare(i, j0, j1)
+            results.append((i, j0, j1, greater, less))
+    return results
+
+
+def _row_chunks(n_players, n_chunks):
+    # Row i has n_players - i - 1 pairs, so split the rows where the remaining pairs are balanced
+    pairs = np.cumsum(np.arange(n_players - 1, -1, -1))
+    bounds = np.searchsorted(pairs, np.linspace(0, pairs[-1], n_chunks + 1)[1:-1], side='right')
+    return [rows for rows in np.split(np.arange(n_players), np.unique(bounds)) if len(rows)]
+
+
+def superiority_matrix(draws, player_names=None, n_jobs=None):
+    # draws: one array of posterior (predictive) draws per player, any lengths.
+    # Entry [i, j] is P(player i > player j); the diagonal is NaN. Only the upper triangle is searched,
+    # the lower triangle follows from P(i < j) computed alongside.
+    global _draws
+    compressed = CompressedDraws(draws)
+    n_players = len(compressed)
+    n_jobs = n_jobs or os.cpu_count()
+    chunks = _row_chunks(n_players, 4 * n_jobs)
+
+    if n_jobs == 1:
+        _draws = compressed
+        results = [_compare_rows(rows) for rows in chunks]
+        _draws = None
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(compressed,)) as pool:
+            results = list(pool.map(_compare_rows, chunks))
+
+    matrix = np.full((n_players, n_players), np.nan)
+    for i, j0, j1, greater, less in (block for chunk in results for block in chunk):
+        matrix[i, j0:j1] = greater
+        matrix[j0:j1, i] = less
+    # pandas is only needed here, prob_greater stays cheap to import (see query.py)
+    import pandas as pd
+
+    return pd.DataFrame(matrix, index=player_names, columns=player_names)
+
+
+def rank_players(matrix):
+    # Average probability of beating each other player
+    return matrix.mean(axis=1).sort_values(ascending=False).rename('mean_superiority')
+
+
+def load_draws(player_names, var='pred_total_points'):
+    # Only the requested variable is read from each stored trace
+    from trace_catalog import TraceCatalog
+
+    return list(TraceCatalog().draws(var, player_names).values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='P(player i > player j) for every pair of fitted players')
+    parser.add_argument('players', nargs='*',
+                        help='players with a stored trace (default: game_level_modelling players)')
+    parser.add_argument('--stat', choices=['points', 'goals', 'assists'], default='points')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    if args.players:
+        player_names = args.players
+    else:
+        from game_level_modelling import PLAYER_NAMES
+        player_names = PLAYER_NAMES
+
+    matrix = superiority_matrix(load_draws(player_names, f'pred_total_{args.stat}'), player_names, n_jobs=args.jobs)
+    matrix.to_csv(os.path.join(OUTPUT_DIR, f'superiority_{args.stat}.csv'))
+    print(matrix.round(3).to_string())
+    print(rank_players(matrix).round(3).to_string())
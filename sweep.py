@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+INPUT_DIR = os.path.join('inputs')
+OUTPUT_DIR = os.path.join('outputs')
+COMPILE_DIR = os.path.join(OUTPUT_DIR, 'pytensor_compiledir')
+SWEEP_LOG = os.path.join(OUTPUT_DIR, 'sweep_progress.jsonl')
+
+
+def split_core_budget(total_cores, chains, n_players):
+    # Each worker runs its chains in parallel, so one worker costs `chains` cores
+    cores_per_worker = max(1, min(chains, total_cores))
+    n_workers = max(1, min(total_cores // cores_per_worker, n_players))
+    return n_workers, cores_per_worker
+
+
+def _init_worker(slots, compile_root):
+    # Runs before pytensor is imported in the (spawned) worker, so the flags take effect.
+    # Each worker slot keeps its own compile cache, reused across sweeps without lock contention.
+    slot = slots.get()
+    compiledir = os.path.join(compile_root, f'worker_{slot}')
+    os.makedirs(compiledir, exist_ok=True)
+    flags = os.environ.get('PYTENSOR_FLAGS', '')
+    os.environ['PYTENSOR_FLAGS'] = ','.join(filter(None, [flags, f'base_compiledir={compiledir}']))
+    os.environ['MPLBACKEND'] = 'Agg'
+
+
+def _fit_player(player_name, team_name, team_mapping_file, chains, cores, nuts_sampler='pymc', inference='nuts',
+                compile_once=False, adaptive=False, opponents=None):
+    from data_prep_bayesian import process_player_data
+    from game_level_modelling import main
+
+    start = time.time()
+    process_player_data(player_name, team_name)
+    main(player_name, f"{player_name}_df.csv", f"{team_name}_schedule_2425_formatted.csv", team_mapping_file,
+         chains=chains, cores=cores, progressbar=False, nuts_sampler=nuts_sampler,
+         inference=inference, compile_once=compile_once, adaptive=adaptive, opponents=opponents)
+    return time.time() - start
+
+
+def load_completed(log_file=SWEEP_LOG):
+    if not os.path.exists(log_file):
+        return set()
+    completed = set()
+    with open(log_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by the interruption
+                continue
+            if record['status'] == 'done':
+                completed.add(record['player'])
+    return completed
+
+
+def record_status(log_file, player_name, status, elapsed=None, error=None):
+    with open(log_file, 'a') as f:
+        f.write(json.dumps({'player': player_name, 'status': status, 'elapsed': elapsed, 'error': error}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run_sweep(player_names, team_names, team_mapping_file="team_mapping.csv", total_cores=None, chains=4,
+              resume=False, log_file=SWEEP_LOG, compile_root=COMPILE_DIR, nuts_sampler='pymc',
+              inference='nuts', compile_once=False, adaptive=False, opponents=None):
+    # With compile_once every worker keeps its compiled models for the next players it fits
+    from data_prep_schedules import format_league_schedules, write_team_schedules
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    total_cores = total_cores or os.cpu_count()
+
+    if resume:
+        completed = load_completed(log_file)
+        logging.info(f"Resuming sweep, {len(completed)} players already done")
+    else:
+        completed = set()
+        if os.path.exists(log_file):
+            os.remove(log_file)
+    todo = [(player_name, team_name) for player_name, team_name in zip(player_names, team_names)
+            if player_name not in completed]
+    if not todo:
+        logging.info("Nothing left to fit")
+        return {}
+
+    # Schedules are shared by teammates, so format them once here rather than racing in the workers
+    write_team_schedules(format_league_schedules(sorted(set(team_name for _, team_name in todo))))
+
+    n_workers, cores_per_worker = split_core_budget(total_cores, chains, len(todo))
+    logging.info(f"Fitting {len(todo)} players on {n_workers} workers x {cores_per_worker} cores "
+                 f"({chains} chains each)")
+
+    # spawn, not fork: each worker must import pytensor fresh after its compiledir is set
+    ctx = multiprocessing.get_context('spawn')
+    slots = ctx.Queue()
+    for slot in range(n_workers):
+        slots.put(slot)
+
+    elapsed = {}
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(slots, compile_root)) as pool:
+        futures = {pool.submit(_fit_player, player_name, team_name, team_mapping_file, chains,
+                               cores_per_worker, nuts_sampler, inference, compile_once, adaptive,
+                               opponents): player_name
+                   for player_name, team_name in todo}
+        for future in as_completed(futures):
+            player_name = futures[future]
+            try:
+                elapsed[player_name] = future.result()
+            except Exception as e:
+                logging.error(f"{player_name} failed: {e!r}")
+                record_status(log_file, player_name, 'failed', error=repr(e))
+            else:
+                logging.info(f"{player_name} done in {elapsed[player_name]:.1f}s")
+                record_status(log_file, player_name, 'done', elapsed=elapsed[player_name])
+
+    return elapsed
+
+
+def load_roster(roster_file):
+    roster = pd.read_csv(os.path.join(INPUT_DIR, roster_file))
+    return roster['player_name'].tolist(), roster['team_name'].tolist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit many players in parallel within a core budget')
+    parser.add_argument('--roster', help='CSV in inputs/ with player_name and team_name columns '
+                                         '(defaults to the players in game_level_modelling)')
+    parser.add_argument('--cores', type=int, default=None, help='total cores to use (default: all)')
+    parser.add_argument('--chains', type=int, default=4, help='chains per player')
+    parser.add_argument('--resume', action='store_true', help='skip players finished by an interrupted sweep')
+    parser.add_argument('--sampler', default='pymc', help='NUTS implementation, see game_level_modelling.NUTS_SAMPLERS')
+    parser.add_argument('--inference', default='nuts', help="'nuts' or an approximate method, see approximate.py")
+    parser.add_argument('--compile-once', action='store_true',
+                        help='each worker compiles the model once per season bucket, see game_level_modelling')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='sample each player until converged or out of budget, see adaptive_sampling.py')
+    parser.add_argument('--opponents', choices=['fixed', 'prior'], default=None,
+                        help='opponent effects from the league-wide fit, see opponent_strength.py')
+    args = parser.parse_args()
+
+    if args.roster:
+        player_names, team_names = load_roster(args.roster)
+    else:
+        from game_level_modelling import PLAYER_NAMES, TEAM_NAMES
+        player_names, team_names = PLAYER_NAMES, TEAM_NAMES
+
+    run_sweep(player_names, team_names, total_cores=args.cores, chains=args.chains, resume=args.resume,
+              nuts_sampler=args.sampler, inference=args.inference, compile_once=args.compile_once,
+              adaptive=args.adaptive, opponents=args.opponents)
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository and read inputs/ relative to it
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def repo_dir(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    return REPO_DIR
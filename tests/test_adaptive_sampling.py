@@ -0,0 +1,41 @@
+import numpy as np
+import pymc as pm
+import pytest
+
+import adaptive_sampling
+from adaptive_sampling import sample_until_converged
+
+
+@pytest.fixture
+def model():
+    with pm.Model() as model:
+        x = pm.Normal('x', 0, 1)
+        pm.Deterministic('constant', x * 0 + 1)
+    return model
+
+
+def sample(model, **kwargs):
+    kwargs = {'draws': 50, 'tune': 50, 'chains': 2, 'cores': 1, 'progressbar': False, 'random_seed': 1, **kwargs}
+    return sample_until_converged(model, lambda trace: trace, **kwargs)
+
+
+def test_one_chain_is_rejected(model):
+    with pytest.raises(ValueError):
+        sample(model, chains=1, var_names=['x'])
+
+
+def test_nan_diagnostics_are_not_converged(model):
+    # A constant has no defined R-hat: sampling runs to the budget and reports it unconverged
+    trace = sample(model, var_names=['constant'], target_ess=1, max_draws=100)
+    assert trace.posterior.sizes['draw'] == 100
+    assert trace.posterior.attrs['converged'] == 0
+    assert np.isnan(trace.posterior.attrs['max_rhat'])
+
+
+def test_rounds_without_step_size_tune_afresh(model, monkeypatch):
+    # As when the first round's sampler records no step size
+    monkeypatch.setattr(adaptive_sampling, 'warm_start_sample_kwargs', lambda *args: {})
+    trace = sample(model, var_names=['x'], target_ess=10 ** 6, max_draws=150)
+    assert trace.posterior.attrs['adaptive_rounds'] == 2
+    assert trace.posterior.sizes['draw'] == 150
+    assert trace.posterior.attrs['converged'] == 0
@@ -0,0 +1,14 @@
+import arviz as az
+import numpy as np
+import pytest
+
+from analysis import hdi
+
+
+@pytest.mark.parametrize('hdi_prob', [0.5, 0.8, 0.95])
+def test_hdi_matches_arviz(hdi_prob):
+    rng = np.random.default_rng(3)
+    draws = np.stack([rng.gamma(2, 10, 1000), rng.normal(0, 1, 1000), rng.poisson(70, 1000).astype(float)])
+    low, high = hdi(np.sort(draws, axis=1), hdi_prob)
+    for row, (l, h) in enumerate(zip(low, high)):
+        assert (l, h) == pytest.approx(tuple(az.hdi(draws[row], hdi_prob=hdi_prob)))
@@ -0,0 +1,43 @@
+import pytest
+
+from benchmark_suite import (TOLERANCE, compare_to_baseline, config_key, generate_synthetic_inputs, load_baselines,
+                             save_baseline)
+
+
+def result(metrics, config=None):
+    return {'config': config or {'players': 2, 'draws': 200}, 'metrics': metrics}
+
+
+def test_regressions_beyond_tolerance_are_flagged():
+    baseline = result({'time/sample': 10.0, 'time/ingest': 1.0, 'ess_per_sec/trend': 50.0, 'ess_per_sec/home': 20.0})
+    current = result({'time/sample': 10.0 * (1 + TOLERANCE) * 1.1, 'time/ingest': 1.0 * (1 + TOLERANCE) * 0.9,
+                      'ess_per_sec/trend': 50.0 / (1 + TOLERANCE) / 1.1, 'ess_per_sec/home': 40.0,
+                      'time/new_stage': 3.0})
+    comparison = compare_to_baseline(current, baseline).set_index('metric')
+    # Slower stages and lower ESS/sec regress, faster stages and higher ESS/sec do not
+    assert comparison['regression'].to_dict() == {'time/sample': True, 'time/ingest': False,
+                                                  'ess_per_sec/trend': True, 'ess_per_sec/home': False}
+    assert comparison.loc['time/sample', 'ratio'] == pytest.approx((1 + TOLERANCE) * 1.1)
+
+
+def test_baselines_are_kept_per_config(tmp_path):
+    baseline_file = str(tmp_path / 'baselines.json')
+    assert load_baselines(baseline_file) == {}
+    save_baseline(result({'time/sample': 1.0}), baseline_file)
+    save_baseline(result({'time/sample': 2.0}, {'players': 4, 'draws': 200}), baseline_file)
+    save_baseline(result({'time/sample': 3.0}), baseline_file)
+    baselines = load_baselines(baseline_file)
+    assert config_key({'draws': 200, 'players': 2}) == config_key({'players': 2, 'draws': 200})
+    assert {key: value['metrics']['time/sample'] for key, value in baselines.items()} == {
+        config_key({'players': 2, 'draws': 200}): 3.0, config_key({'players': 4, 'draws': 200}): 2.0}
+
+
+def test_synthetic_inputs_have_the_requested_size(tmp_path, repo_dir):
+    from data_prep_bayesian import ingest_game_logs
+
+    input_dir = str(tmp_path / 'inputs')
+    player_teams = generate_synthetic_inputs(input_dir, n_players=3, n_seasons=2, games_per_season=10,
+                                             current_games=4)
+    games = ingest_game_logs(player_teams, input_dir=input_dir)
+    assert games.groupby('player', observed=True).size().tolist() == [24, 24, 24]
+    assert games['opp_int'].notna().all()
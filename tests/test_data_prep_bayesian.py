@@ -0,0 +1,74 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+from data_prep_bayesian import INPUT_DIR, GAME_LOG_SUFFIX, ingest_game_logs, player_view
+from data_prep_schedules import format_league_schedules, team_schedule_view
+from game_level_modelling import PLAYER_NAMES, TEAM_NAMES
+
+# The per-player formatting ingest_game_logs replaced, row by row as it was written
+OLD_COLUMNS = ['Date', 'Team', 'Goals', 'Assists', 'Points', 'Plusminus', 'PIM', 'PPG', 'PPP', 'SHG', 'SHP', 'GWG',
+               'OTG', 'Shots', 'TOI', 'Shifts', 'Year', 'season', 'Home', 'toi2', 'toi3', 'toi_seconds', 'opponent',
+               'opp_2']
+
+
+def old_process_player_data(player_name, schedule):
+    df = pd.read_csv(os.path.join(INPUT_DIR, f'{player_name}{GAME_LOG_SUFFIX}'), delimiter=',')
+    df['Opp'] = df['Opp'].replace({'PHX': 'ARI', 'ATL': 'WPG'})
+    team_mapping = pd.read_csv(os.path.join(INPUT_DIR, "team_mapping.csv"))
+    full_name_to_abbrev = dict(zip(team_mapping['team_name'], team_mapping['abbreviation']))
+
+    def get_season(date):
+        year, month = int(date[:4]), int(date[5:7])
+        return f"{year}{year+1-2000}" if month >= 9 else f"{year-1}{year-2000}"
+
+    def time_to_seconds(time_str):
+        parts = list(map(int, time_str.split(':')))
+        return parts[0] * 60 + parts[1] if len(parts) == 2 else parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+    new_df = pd.DataFrame()
+    new_df['Date'] = df['Date']
+    new_df['Team'] = df['Unnamed: 5'].fillna('vs') + ' ' + df['Opp']
+    for column, source in [('Goals', 'G.1'), ('Assists', 'A'), ('Points', 'PTS'), ('Plusminus', '+/-'),
+                           ('PIM', 'PIM'), ('PPG', 'PP'), ('PPP', 'PP'), ('SHG', 'SH'), ('SHP', 'SH'), ('GWG', 'GW')]:
+        new_df[column] = df[source]
+    new_df['OTG'] = 0
+    new_df['Shots'] = df['S']
+    new_df['TOI'] = df['TOI']
+    new_df['Shifts'] = df['SHFT']
+    new_df['Year'] = pd.to_datetime(df['Date']).dt.year
+    new_df['season'] = df['Date'].apply(get_season)
+    new_df['Home'] = new_df['Team'].str.contains('vs').astype(int)
+    new_df['toi2'] = df['TOI']
+    new_df['toi3'] = df['TOI']
+    new_df['toi_seconds'] = df['TOI'].apply(time_to_seconds)
+    new_df['opponent'] = df['Opp'].str.replace('@', '')
+    new_df['opp_2'] = new_df['opponent']
+    new_df = new_df[OLD_COLUMNS]
+
+    first_game = schedule.iloc[0]
+    if '202425' not in new_df['season'].values:
+        opponent = full_name_to_abbrev.get(first_game['Opponent'], first_game['Opponent'])
+        dummy_row = {column: 0 for column in OLD_COLUMNS}
+        dummy_row.update({'Date': first_game['Date'], 'Team': f"{first_game['Vs']} {opponent}",
+                          'TOI': '00:00', 'toi2': '00:00', 'toi3': '00:00', 'Year': '2024', 'season': '202425',
+                          'Home': 1 if first_game['Vs'] == 'vs' else 0, 'opponent': opponent, 'opp_2': opponent})
+        new_df = pd.concat([new_df, pd.DataFrame([dummy_row])], ignore_index=True)
+    return new_df
+
+
+def as_written(df):
+    # Both versions are only ever used through the CSV files they write
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)))
+
+
+@pytest.mark.usefixtures('repo_dir')
+def test_game_logs_match_per_player_formatting():
+    player_teams = dict(zip(PLAYER_NAMES, TEAM_NAMES))
+    league_schedule = format_league_schedules(sorted(set(TEAM_NAMES)))
+    games = ingest_game_logs(player_teams, league_schedule)
+    for player_name, team_name in player_teams.items():
+        old = old_process_player_data(player_name, team_schedule_view(league_schedule, team_name))
+        pd.testing.assert_frame_equal(as_written(player_view(games, player_name)[OLD_COLUMNS]), as_written(old))
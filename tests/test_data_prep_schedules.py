@@ -0,0 +1,36 @@
+import io
+import os
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from data_prep_bayesian import INPUT_DIR
+from data_prep_schedules import available_teams, format_league_schedules, team_schedule_view
+
+
+# The per-team formatting format_league_schedules replaced, row by row as it was written
+def old_format_team_schedule(team_name):
+    schedule = pd.read_csv(os.path.join(INPUT_DIR, f"{team_name}_schedule_2425.txt"))
+    team_mapping = pd.read_csv(os.path.join(INPUT_DIR, "team_mapping.csv"))
+    team_name_mapping = dict(zip(team_mapping['team_name_2'], team_mapping['team_name']))
+    rows = []
+    for index, row in schedule.iterrows():
+        vs = "@" if pd.notna(row.iloc[3]) and row.iloc[3] == '@' else "vs"
+        opponent = 'Arizona Coyotes' if row['Opponent'] == 'Utah Hockey Club' else row['Opponent']
+        rows.append({"": str(index + 1), "Date": datetime.strptime(row['Date'], '%Y-%m-%d').strftime('%a, %b %d'),
+                     "Vs": vs, "Opponent": team_name_mapping.get(opponent, opponent)})
+    return pd.DataFrame(rows, columns=["", "Date", "Vs", "Opponent"])
+
+
+def as_written(df):
+    # Both versions are only ever used through the CSV files they write
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)))
+
+
+@pytest.mark.usefixtures('repo_dir')
+def test_league_schedules_match_per_team_formatting():
+    league_schedule = format_league_schedules()
+    for team_name in available_teams():
+        pd.testing.assert_frame_equal(as_written(team_schedule_view(league_schedule, team_name)),
+                                      as_written(old_format_team_schedule(team_name)))
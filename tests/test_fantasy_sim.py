@@ -0,0 +1,61 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from fantasy_sim import round_robin, roster_rate_tables, simulate_seasons
+
+
+@pytest.mark.parametrize('n_rosters', [2, 5, 8])
+def test_round_robin_pairs_every_roster_once(n_rosters):
+    n_weeks = n_rosters - 1 + n_rosters % 2
+    matchups = round_robin(n_rosters, n_weeks)
+    assert matchups.shape == (n_weeks, n_rosters)
+    rosters = np.arange(n_rosters)
+    for week in matchups:
+        # Opponents are mutual, and only an odd count leaves one roster with a bye
+        assert (week[week] == rosters).all()
+        assert (week == rosters).sum() == n_rosters % 2
+    met = [frozenset((r, o)) for week in matchups for r, o in enumerate(week) if r != o]
+    assert sorted(map(sorted, set(met))) == sorted(map(sorted, map(frozenset, itertools.combinations(rosters, 2))))
+
+
+def test_roster_rate_tables_match_direct_draws():
+    # Players 0 and 2 come from one roster fit and share their draw, player 1 was fitted on their own
+    rng = np.random.default_rng(0)
+    n_draws = np.array([4, 6, 4])
+    fit_groups = np.array([0, 1, 0])
+    rates = {stat: np.zeros((3, 6, 5)) for stat in ['goals', 'assists']}
+    for stat in rates:
+        for p, n in enumerate(n_draws):
+            rates[stat][p, :n] = rng.gamma(2, 0.2, (n, 5))
+    rosters = np.array([[1, 0, 1], [0, 1, 0]], dtype=float)
+
+    group_tables = roster_rate_tables(rates, n_draws, rosters, fit_groups, max_chunk_elements=7)
+    assert len(group_tables) == 2
+    for u in rng.random((200, 2)):
+        draw = (u[fit_groups] * n_draws).astype(int)
+        for stat in rates:
+            direct = rates[stat][np.arange(3), draw].T @ rosters.T
+            tabulated = sum(tables[stat][np.searchsorted(edges, group_u, side='right') - 1]
+                            for (edges, tables), group_u in zip(group_tables, u))
+            np.testing.assert_allclose(tabulated, direct)
+
+
+def test_separate_fits_are_drawn_independently():
+    # Two players with the same number of draws, fitted separately: their draws must not move together
+    n_draws = np.array([50, 50])
+    rates = {'goals': np.zeros((2, 50, 1)), 'assists': np.zeros((2, 50, 1))}
+    rates['goals'][:, :, 0] = np.arange(50)
+    rosters = np.eye(2)
+    matchups = np.zeros((1, 2), dtype=int)
+    weights = {'goals': 1.0}
+
+    def roster_correlation(fit_groups):
+        chunks = simulate_seasons(rates, n_draws, rosters, matchups, 4000, weights=weights, random_seed=0,
+                                  fit_groups=fit_groups)
+        points = np.concatenate([chunk['points'] for chunk in chunks])
+        return np.corrcoef(points.T)[0, 1]
+
+    assert abs(roster_correlation(None)) < 0.1
+    assert roster_correlation([0, 0]) > 0.5
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from scipy.stats import poisson
+
+from game_level_modelling import build_model, load_and_prepare_data, model_data
+
+
+@pytest.fixture
+def player_df(repo_dir):
+    player_df, _, _, _ = load_and_prepare_data('Jack Hughes', 'Jack Hughes_df.csv',
+                                               'devils_schedule_2425_formatted.csv', 'team_mapping.csv')
+    return player_df
+
+
+@pytest.mark.parametrize('likelihood', ['game', 'cell'])
+def test_likelihood_rate_is_the_predicted_rate(player_df, likelihood):
+    # Each row's rate is mu_t[season] + mu_team[opp, season] plus the home (and goals) terms, as in
+    # predictive.game_rates
+    model = build_model(player_df, likelihood=likelihood)
+    rng = np.random.default_rng(1)
+    point = {name: value + rng.normal(0, 0.1, value.shape) for name, value in model.initial_point().items()}
+    assists_logp, goals_logp = model.compile_logp(vars=[model['assists'], model['goals']], sum=False)(point)
+
+    data = model_data(player_df, likelihood)
+    for prefix, stat, stat_logp, home_idx in [('a', 'assists', assists_logp, 1), ('g', 'goals', goals_logp, 2)]:
+        season, opp = data[f'{prefix}_season_idx'], data[f'{prefix}_opp_idx']
+        log_rate = (point[f'mu_{stat}_t'][season] + point[f'mu_{stat}_team'][opp, season] +
+                    data[f'{prefix}_home'] * point['b_home'][home_idx])
+        if stat == 'assists':
+            log_rate = log_rate + data['a_goals'] * point['beta_goal']
+        np.testing.assert_allclose(stat_logp, poisson.logpmf(data[f'{prefix}_count'],
+                                                             data[f'{prefix}_exposure'] * np.exp(log_rate)))
@@ -0,0 +1,97 @@
+import logging
+import os
+import shutil
+
+import pytest
+
+import ingest_watcher
+from data_prep_bayesian import CURRENT_SEASON, ingest_game_logs
+from feature_store import read_game_logs
+from ingest_watcher import load_state, refresh
+
+PLAYER_TEAMS = {'Jack Hughes': 'devils'}
+GAME_LOG = os.path.join('inputs', 'Jack Hughes_df.txt')
+
+
+@pytest.fixture
+def game_log(tmp_path, repo_dir, monkeypatch):
+    # A real game log, newest season first: its header, the 2023-24 rows (in date order) and the older seasons.
+    # Only the first 40 games of 2023-24 are there when the watcher first ingests it.
+    os.makedirs(tmp_path / 'inputs')
+    for file_name in ['team_mapping.csv', 'devils_schedule_2425.txt']:
+        shutil.copy(os.path.join(repo_dir, 'inputs', file_name), tmp_path / 'inputs')
+    with open(os.path.join(repo_dir, 'inputs', 'Jack Hughes_df.txt')) as f:
+        lines = f.read().splitlines()
+    header, latest, older = lines[0], lines[1:63], lines[63:]
+    assert all(line.split(',')[1] < '2023-07-01' for line in older)
+    monkeypatch.chdir(tmp_path)
+
+    def write(rows):
+        # The raw files often lack a trailing newline
+        with open(GAME_LOG, 'w') as f:
+            f.write('\n'.join([header] + rows))
+    write(latest[:40] + older)
+    return write, latest, older
+
+
+def stored_games():
+    games = read_game_logs(list(PLAYER_TEAMS))
+    assert not games.duplicated(['Date']).any()
+    assert games['game_number'].tolist() == list(range(1, len(games) + 1))
+    return games
+
+
+def test_interrupted_pass_does_not_duplicate_games(game_log, monkeypatch):
+    write, latest, older = game_log
+    refresh(PLAYER_TEAMS, load_state())
+    # The season's next games arrive in the middle of the file, above the older seasons
+    write(latest[:50] + older)
+
+    # The pass dies after appending the new games, before it saves their high-water marks
+    def die(state, state_file=None):
+        raise KeyboardInterrupt
+    with monkeypatch.context() as patch:
+        patch.setattr(ingest_watcher, 'save_state', die)
+        with pytest.raises(KeyboardInterrupt):
+            refresh(PLAYER_TEAMS, load_state())
+
+    # More games arrive before the next pass, which reads from the old marks again
+    write(latest + older)
+    assert refresh(PLAYER_TEAMS, load_state())['refit'] == ['Jack Hughes']
+    assert len(stored_games()) == len(ingest_game_logs(PLAYER_TEAMS))
+
+
+def test_new_season_above_the_ingested_rows_replaces_the_placeholder(game_log, caplog):
+    write, latest, older = game_log
+    refresh(PLAYER_TEAMS, load_state())
+    placeholder = stored_games().query(f"season == '{CURRENT_SEASON}'")
+    assert len(placeholder) == 1 and placeholder['toi_seconds'].iloc[0] == 0
+
+    # 2024-25 games appear on top of the file, and the rest of 2023-24 arrives in the same pass
+    new_season = [line.replace(',2023-', ',2024-', 1) for line in latest[:5]]
+    write(new_season + latest + older)
+    with caplog.at_level(logging.INFO):
+        state = load_state()
+        refresh(PLAYER_TEAMS, state)
+    assert 'in full' not in caplog.text
+    assert not state['game_logs']['Jack Hughes']['placeholder']
+
+    games = stored_games()
+    assert len(games) == len(ingest_game_logs(PLAYER_TEAMS))
+    # The season's games are numbered from the placeholder's slot, the late 2023-24 games after them
+    first = placeholder['game_number'].iloc[0]
+    current = games[games['season'] == CURRENT_SEASON]
+    assert current['game_number'].tolist() == list(range(first, first + 5))
+    assert (current['toi_seconds'] > 0).all()
+    late = games[games['Date'].isin([line.split(',')[1] for line in latest[40:]])]
+    assert late['game_number'].tolist() == list(range(first + 5, first + 5 + len(latest) - 40))
+
+
+def test_edited_rows_are_ingested_again_in_full(game_log, caplog):
+    write, latest, older = game_log
+    refresh(PLAYER_TEAMS, load_state())
+    write(latest[:40] + older[1:])
+    with caplog.at_level(logging.INFO):
+        refresh(PLAYER_TEAMS, load_state())
+    assert 'in full' in caplog.text
+    assert len(stored_games()) == len(ingest_game_logs(PLAYER_TEAMS))
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from data_prep_bayesian import NUM_TEAMS, opponent_index
+from opponent_strength import summarize_opponent_strength, team_offsets
+from predictive import game_rates
+
+SEASONS = [202223, 202324, 202425]
+
+
+def test_team_ids_are_their_own_rows(repo_dir):
+    team_mapping = pd.read_csv('inputs/team_mapping.csv').set_index('abbreviation')['id']
+    assert sorted(team_mapping) == list(range(NUM_TEAMS))
+    # Vancouver (id 0) and Edmonton (id 31) used to share a row through id - 1
+    assert opponent_index(team_mapping[['VAN', 'EDM']]).tolist() == [0, 31]
+    with pytest.raises(ValueError):
+        opponent_index([3, NUM_TEAMS])
+    with pytest.raises(ValueError):
+        opponent_index([-1])
+
+
+def player_model_data(repo_dir):
+    from game_level_modelling import load_and_prepare_data, model_data
+
+    player_df, _, _, _ = load_and_prepare_data('Jack Hughes', 'Jack Hughes_df.csv',
+                                               'devils_schedule_2425_formatted.csv', 'team_mapping.csv')
+    return player_df, model_data(player_df)
+
+
+def test_player_model_has_a_row_per_team(repo_dir):
+    from game_level_modelling import build_model
+
+    player_df, data = player_model_data(repo_dir)
+    vancouver = (player_df['opponent'] == 'VAN').to_numpy()
+    assert vancouver.any()
+    assert (data['a_opp_idx'][vancouver] == 0).all()
+    initial_point = build_model(player_df).initial_point()
+    assert initial_point['mu_assists_team'].shape == (NUM_TEAMS, int(player_df['season2'].max()))
+
+
+@pytest.fixture
+def strength():
+    rng = np.random.default_rng(0)
+    posterior = xr.Dataset({
+        'mu_assists_team': (('chain', 'draw', 'team', 'season'), rng.normal(0, 0.1, (2, 50, NUM_TEAMS, 3))),
+        'mu_goals_team': (('chain', 'draw', 'team', 'season'), rng.normal(0, 0.1, (2, 50, NUM_TEAMS, 3))),
+        'rho_a': (('chain', 'draw'), np.full((2, 50), 0.5)),
+        'rho_g': (('chain', 'draw'), np.full((2, 50), 0.5)),
+        'sigma_assists_team': (('chain', 'draw'), np.full((2, 50), 0.1)),
+        'sigma_goals_team': (('chain', 'draw'), np.full((2, 50), 0.1)),
+    })
+    return posterior, summarize_opponent_strength(posterior, SEASONS)
+
+
+def test_strength_is_labelled_by_team_id(strength):
+    posterior, summary = strength
+    assert summary['team'].values.tolist() == list(range(NUM_TEAMS))
+    np.testing.assert_allclose(summary['assists_team_mean'].sel(team=0),
+                               posterior['mu_assists_team'].isel(team=0).mean(('chain', 'draw')))
+
+
+def test_team_offsets_project_uncovered_seasons(strength):
+    _, summary = strength
+    offsets = team_offsets(summary, SEASONS[1:], num_seasons=4)
+    assert offsets['goals_team_mu'].shape == (NUM_TEAMS, 4)
+    np.testing.assert_allclose(offsets['goals_team_mu'][:, :2], summary['goals_team_mean'].values[:, 1:])
+    # Two and three seasons past the last fitted one: the mean decays with rho^k
+    np.testing.assert_allclose(offsets['goals_team_mu'][:, 3], summary['goals_team_mean'].values[:, 2] * 0.5 ** 2)
+    # and the variance moves towards the stationary sigma^2 / (1 - rho^2)
+    decay = 0.5 ** 2
+    variance = summary['goals_team_sd'].values[:, 2] ** 2 * decay ** 2 + 0.1 ** 2 * (1 - decay ** 2) / (1 - 0.5 ** 2)
+    np.testing.assert_allclose(offsets['goals_team_sigma'][:, 3], np.sqrt(variance))
+
+
+def test_strength_from_before_team_ids_is_refused(strength):
+    _, summary = strength
+    with pytest.raises(ValueError):
+        team_offsets(summary.isel(team=slice(1, None)).assign_coords(team=np.arange(1, NUM_TEAMS)), SEASONS)
+
+
+def test_posterior_from_before_team_ids_is_refused():
+    old = xr.Dataset({'mu_assists_team': (('chain', 'draw', 'team', 'season'), np.zeros((1, 2, 31, 3)))})
+    with pytest.raises(ValueError):
+        game_rates(old, pd.DataFrame({'opp_int': [0], 'Home': [1]}))
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from superiority import prob_greater, CompressedDraws, superiority_matrix
+
+
+def brute_force(a, b):
+    a, b = np.ravel(a), np.ravel(b)
+    return (a[:, None] > b[None, :]).mean(), (a[:, None] < b[None, :]).mean()
+
+
+def test_prob_greater_matches_all_pairs():
+    rng = np.random.default_rng(0)
+    a, b = rng.poisson(80, 500), rng.poisson(82, 300)
+    assert prob_greater(a, b) == pytest.approx(brute_force(a, b)[0])
+
+
+def test_compare_matches_all_pairs_with_ties():
+    rng = np.random.default_rng(1)
+    draws = [rng.poisson(lam, size) for lam, size in [(50, 400), (52, 250), (50, 400), (10, 30), (51, 1)]]
+    compressed = CompressedDraws(draws)
+    for i in range(len(draws)):
+        greater, less = compressed.compare(i, 0, len(draws))
+        for j in range(len(draws)):
+            assert (greater[j], less[j]) == pytest.approx(brute_force(draws[i], draws[j]))
+
+
+def test_superiority_matrix():
+    rng = np.random.default_rng(2)
+    draws = [rng.poisson(lam, 200) for lam in [40, 45, 50, 55]]
+    matrix = superiority_matrix(draws, ['a', 'b', 'c', 'd'], n_jobs=1).to_numpy()
+    assert np.isnan(np.diag(matrix)).all()
+    for i in range(4):
+        for j in range(4):
+            if i != j:
+                assert matrix[i, j] == pytest.approx(brute_force(draws[i], draws[j])[0])
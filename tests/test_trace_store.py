@@ -0,0 +1,95 @@
+import os
+import time
+
+import arviz as az
+import numpy as np
+import pandas as pd
+import pytest
+
+from trace_store import (trace_cache_key, cache_trace, load_cached_trace, publish_cached_trace, evict_cache,
+                         cached_trace_path, atomic_write)
+
+
+@pytest.fixture
+def frames():
+    player_df = pd.DataFrame({'season2': [1, 1, 2], 'opp_int': [3, 4, 5], 'Goals': [0, 1, 2]})
+    remaining = pd.DataFrame({'opp_int': [6, 7], 'Home': [1, 0]})
+    return player_df, remaining
+
+
+def test_cache_key_is_stable(frames):
+    player_df, remaining = frames
+    settings = {'draws': 100, 'tune': 100, 'priors': {'sigma_t': 0.25, 'sigma_team': 0.08}}
+    key = trace_cache_key(player_df, remaining, 10, 5, settings)
+    reordered = {'priors': {'sigma_team': 0.08, 'sigma_t': 0.25}, 'tune': 100, 'draws': 100}
+    assert trace_cache_key(player_df.copy(), remaining.copy(), np.int64(10), 5, reordered) == key
+
+
+def test_cache_key_changes_with_inputs(frames):
+    player_df, remaining = frames
+    settings = {'draws': 100}
+    key = trace_cache_key(player_df, remaining, 10, 5, settings)
+    changed = player_df.assign(Goals=[0, 1, 3])
+    assert trace_cache_key(changed, remaining, 10, 5, settings) != key
+    assert trace_cache_key(player_df, remaining.iloc[1:], 10, 5, settings) != key
+    assert trace_cache_key(player_df, remaining, 11, 5, settings) != key
+    assert trace_cache_key(player_df, remaining, 10, 5, {'draws': 200}) != key
+    assert trace_cache_key(player_df.rename(columns={'Goals': 'Assists'}), remaining, 10, 5, settings) != key
+
+
+def test_cache_key_of_a_roster_fit(frames):
+    # One current total per roster player
+    player_df, remaining = frames
+    key = trace_cache_key(player_df, remaining, np.array([10, 4]), np.array([5, 2]), {'draws': 100})
+    assert trace_cache_key(player_df, remaining, np.array([10, 4]), np.array([5, 2]), {'draws': 100}) == key
+    assert trace_cache_key(player_df, remaining, np.array([10, 5]), np.array([5, 2]), {'draws': 100}) != key
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    trace = az.from_dict(posterior={'x': np.zeros((2, 50))})
+    for key in ['a', 'b', 'c']:
+        cache_trace(trace, key, str(tmp_path), max_bytes=10 ** 9)
+        # Distinct last-use times on coarse-grained file systems
+        os.utime(os.path.join(tmp_path, f"{key}.used"), (time.time() - 100 + ord(key), time.time() - 100 + ord(key)))
+    return str(tmp_path)
+
+
+def test_evict_drops_least_recently_used(cache_dir):
+    size = os.path.getsize(cached_trace_path('a', cache_dir))
+    # A hit makes 'a' the most recently used
+    load_cached_trace('a', cache_dir)
+    assert evict_cache(cache_dir, max_bytes=2 * size) == ['b.nc']
+    assert sorted(os.listdir(cache_dir)) == ['a.nc', 'a.used', 'c.nc', 'c.used']
+
+
+def test_evict_keeps_the_new_entry(cache_dir):
+    size = os.path.getsize(cached_trace_path('a', cache_dir))
+    assert evict_cache(cache_dir, max_bytes=size, keep='a') == ['b.nc', 'c.nc']
+    assert evict_cache(cache_dir, max_bytes=10 ** 9) == []
+
+
+def test_hit_leaves_published_file_untouched(cache_dir, tmp_path):
+    published = str(tmp_path / 'player_model_results.nc')
+    publish_cached_trace('a', published, cache_dir)
+    mtime = os.stat(published).st_mtime_ns
+    time.sleep(0.01)
+    assert load_cached_trace('a', cache_dir) is not None
+    assert os.stat(published).st_mtime_ns == mtime
+    assert load_cached_trace('missing', cache_dir) is None
+
+
+def test_failed_atomic_write_leaves_the_previous_file(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text('old')
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as tmp, open(tmp, 'w') as f:
+            f.write('half')
+            raise RuntimeError
+    assert path.read_text() == 'old'
+    assert os.listdir(tmp_path) == ['state.json']
+
+    with atomic_write(str(path)) as tmp, open(tmp, 'w') as f:
+        f.write('new')
+    assert path.read_text() == 'new'
+    assert os.listdir(tmp_path) == ['state.json']
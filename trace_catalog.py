@@ -0,0 +1,154 @@
+import argparse
+import glob
+import json
+import os
+
+import h5netcdf
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from trace_store import CACHE_DIR, atomic_write
+
+OUTPUT_DIR = os.path.join('outputs')
+INPUT_DIR = os.path.join('inputs')
+CATALOG_FILE = os.path.join(OUTPUT_DIR, 'trace_catalog.json')
+TRACE_SUFFIX = '_model_results.nc'
+# Source of player positions (latest season listed wins)
+POSITIONS_FILE = os.path.join(INPUT_DIR, 'kkupfl_scoring_2018_2023_input.csv')
+# Posterior attributes worth keeping in the index
+INDEX_ATTRS = ['player', 'fit', 'inference', 'n_predictive', 'sampling_time', 'created_at']
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def inspect_trace(path):
+    # Groups, variables (dims and shape) and a few attributes, from the file's metadata only: no draws are read
+    groups = {}
+    attrs = {}
+    with h5netcdf.File(path, 'r') as f:
+        for group_name, group in f.groups.items():
+            groups[group_name] = {name: {'dims': list(variable.dimensions), 'shape': list(variable.shape)}
+                                  for name, variable in group.variables.items()
+                                  if name not in group.dimensions}
+            if group_name == 'posterior':
+                attrs = {key: _json_value(group.attrs[key]) for key in INDEX_ATTRS if key in group.attrs}
+    return {'groups': groups, 'attrs': attrs}
+
+
+def player_positions(positions_file=POSITIONS_FILE):
+    if not os.path.exists(positions_file):
+        return {}
+    players = pd.read_csv(positions_file, usecols=['Year', 'Player Name', 'Pos']).sort_values('Year')
+    return dict(zip(players['Player Name'], players['Pos']))
+
+
+class TraceCatalog:
+    # Index of the stored traces: which players, runs (published trace and trace cache entries) and variables
+    # exist. The index is a small JSON file refreshed from file modification times, and traces are only
+    # opened to read the variables a query asks for.
+    def __init__(self, output_dir=OUTPUT_DIR, cache_dir=CACHE_DIR, catalog_file=CATALOG_FILE,
+                 positions_file=POSITIONS_FILE):
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.catalog_file = catalog_file
+        self.positions_file = positions_file
+        self._positions = None
+        self.entries = {}
+        if os.path.exists(catalog_file):
+            with open(catalog_file) as f:
+                self.entries = json.load(f)
+        self.refresh()
+
+    def refresh(self):
+        published = glob.glob(os.path.join(self.output_dir, f'*{TRACE_SUFFIX}'))
+        cached = glob.glob(os.path.join(self.cache_dir, '*.nc'))
+
+        # Published traces are hard links into the cache, the shared inode names the cache entry's player
+        # (traces written since the player was recorded in the posterior attributes carry it themselves)
+        stats = {path: os.stat(path) for path in published + cached}
+        inode_players = {(stats[path].st_dev, stats[path].st_ino): os.path.basename(path)[:-len(TRACE_SUFFIX)]
+                         for path in published}
+        inode_runs = {(stats[path].st_dev, stats[path].st_ino): os.path.basename(path)[:-len('.nc')]
+                      for path in cached}
+
+        entries = {}
+        changed = set(self.entries) != set(stats)
+        for path, stat in stats.items():
+            inode = (stat.st_dev, stat.st_ino)
+            entry = self.entries.get(path)
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                entry = {'mtime': stat.st_mtime, 'size': stat.st_size, **inspect_trace(path)}
+                changed = True
+            entry['published'] = path in published
+            entry['player'] = inode_players.get(inode, entry['attrs'].get('player'))
+            entry['run'] = inode_runs.get(inode, 'published')
+            entries[path] = entry
+        self.entries = entries
+
+        if changed:
+            with atomic_write(self.catalog_file) as tmp_path, open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+        return self
+
+    def _position_of(self, player_name):
+        if self._positions is None:
+            self._positions = player_positions(self.positions_file)
+        return self._positions.get(player_name)
+
+    def index(self):
+        # One row per stored trace
+        rows = [{**entry['attrs'], 'player': entry['player'], 'run': entry['run'], 'published': entry['published'],
+                 'position': self._position_of(entry['player']), 'size': entry['size'], 'path': path}
+                for path, entry in self.entries.items()]
+        return pd.DataFrame(rows)
+
+    def players(self, position=None):
+        players = sorted(entry['player'] for entry in self.entries.values() if entry['published'])
+        if position is not None:
+            players = [player for player in players if self._position_of(player) == position]
+        return players
+
+    def runs(self, player_name):
+        return sorted(entry['run'] for entry in self.entries.values() if entry['player'] == player_name)
+
+    def path(self, player_name, run=None):
+        for path, entry in self.entries.items():
+            if entry['player'] == player_name and (entry['published'] if run is None else entry['run'] == run):
+                return path
+        raise KeyError(f"No stored trace for {player_name}" + ('' if run is None else f" (run {run})"))
+
+    def variables(self, player_name, group='posterior', run=None):
+        return self.entries[self.path(player_name, run)]['groups'].get(group, {})
+
+    def load(self, player_name, var_names, group='posterior', run=None):
+        # Only the requested variables are decoded
+        with xr.open_dataset(self.path(player_name, run), group=group, engine='h5netcdf') as ds:
+            return ds[list(var_names)].load()
+
+    def draws(self, var, players=None, group='posterior'):
+        # Flattened draws of one variable for each player
+        players = self.players() if players is None else players
+        return {player_name: self.load(player_name, [var], group)[var].values.ravel() for player_name in players}
+
+    def quantile(self, var, q, players=None, position=None):
+        players = self.players(position) if players is None else players
+        draws = self.draws(var, players)
+        return pd.Series({player_name: np.quantile(values, q) for player_name, values in draws.items()},
+                         name=f'{var}_q{q:g}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index and query stored traces')
+    parser.add_argument('--var', default='pred_total_points')
+    parser.add_argument('--quantile', type=float, default=None, help='e.g. 0.05 for the 5th percentile')
+    parser.add_argument('--position', default=None, help="only players at this position, e.g. 'D'")
+    args = parser.parse_args()
+
+    catalog = TraceCatalog()
+    if args.quantile is None:
+        print(catalog.index().to_string(index=False))
+    else:
+        print(catalog.quantile(args.var, args.quantile, position=args.position).to_string())
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from importlib.metadata import version, PackageNotFoundError
+
+import arviz as az
+import numpy as np
+import pandas as pd
+
+OUTPUT_DIR = os.path.join('outputs')
+CACHE_DIR = os.path.join(OUTPUT_DIR, 'trace_cache')
+# Cached traces are evicted least recently used first once the cache grows past this. Only the cache
+# directory is bounded: the published outputs/{player}_model_results.nc files are one per player and are
+# hard links to cache entries, so evicting an entry frees its space only once the player is refitted.
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+# Libraries whose upgrades can change a fitted trace
+CACHE_LIBRARIES = ['pymc', 'pytensor', 'arviz', 'numpy', 'pandas']
+
+
+@contextmanager
+def atomic_write(path):
+    # Yields a temporary path next to path to write to, renamed over path once the block succeeds, so readers
+    # never see a half-written file and a failed write leaves the previous one
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_trace(trace, path):
+    with atomic_write(path) as tmp_path:
+        az.to_netcdf(trace, tmp_path)
+
+
+def library_versions():
+    versions = {}
+    for library in CACHE_LIBRARIES:
+        try:
+            versions[library] = version(library)
+        except PackageNotFoundError:
+            versions[library] = None
+    return versions
+
+
+def _hash_frame(h, df):
+    h.update(json.dumps([str(column) for column in df.columns]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+
+def trace_cache_key(player_df, remaining_schedule, curr_assists, curr_goals, settings):
+    # Everything the fitted trace depends on: the prepared data (team mapping included, through
+    # opp_int), the priors and sampler settings, and the library versions. The current totals are one
+    # number per player, or one per roster player for a roster fit.
+    h = hashlib.sha256()
+    _hash_frame(h, player_df)
+    _hash_frame(h, remaining_schedule)
+    h.update(json.dumps({'curr_assists': np.asarray(curr_assists).tolist(),
+                         'curr_goals': np.asarray(curr_goals).tolist(),
+                         'settings': settings, 'versions': library_versions()},
+                        sort_keys=True, default=str).encode())
+    return h.hexdigest()[:32]
+
+
+def cached_trace_path(cache_key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{cache_key}.nc")
+
+
+def _access_path(cache_key, cache_dir=CACHE_DIR):
+    # Side-car file whose mtime is the entry's last use. Touching the trace itself would also touch the
+    # published hard link in outputs/ (same inode), which the trace catalog would then re-inspect.
+    return os.path.join(cache_dir, f"{cache_key}.used")
+
+
+def _touch(path):
+    with open(path, 'a'):
+        os.utime(path)
+
+
+def load_cached_trace(cache_key, cache_dir=CACHE_DIR):
+    path = cached_trace_path(cache_key, cache_dir)
+    if not os.path.exists(path):
+        return None
+    # Touch on every hit so eviction drops the least recently used traces
+    _touch(_access_path(cache_key, cache_dir))
+    return az.from_netcdf(path)
+
+
+def cache_trace(trace, cache_key, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    save_trace(trace, cached_trace_path(cache_key, cache_dir))
+    _touch(_access_path(cache_key, cache_dir))
+    evict_cache(cache_dir, max_bytes, keep=cache_key)
+
+
+def publish_cached_trace(cache_key, path, cache_dir=CACHE_DIR):
+    # Expose a cached trace under the player's usual file name, as a hard link when possible
+    with atomic_write(path) as tmp_path:
+        try:
+            os.link(cached_trace_path(cache_key, cache_dir), tmp_path)
+        except OSError:
+            shutil.copyfile(cached_trace_path(cache_key, cache_dir), tmp_path)
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, keep=None):
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if not file_name.endswith('.nc'):
+            continue
+        stat = os.stat(os.path.join(cache_dir, file_name))
+        access_path = _access_path(file_name[:-len('.nc')], cache_dir)
+        # Entries cached before the side-car files existed fall back to the trace's own mtime
+        last_used = os.stat(access_path).st_mtime if os.path.exists(access_path) else stat.st_mtime
+        entries.append((last_used, stat.st_size, file_name))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, file_name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if keep is not None and file_name == f"{keep}.nc":
+            continue
+        # Published player files are hard links, so they outlive the cache entry
+        os.remove(os.path.join(cache_dir, file_name))
+        access_path = _access_path(file_name[:-len('.nc')], cache_dir)
+        if os.path.exists(access_path):
+            os.remove(access_path)
+        total -= size
+        evicted.append(file_name)
+
+    if evicted:
+        logging.info(f"Evicted {len(evicted)} cached traces, cache is now {total / 1024 ** 2:.1f} MB")
+    return evicted
@@ -0,0 +1,137 @@
+import argparse
+import logging
+import os
+
+import arviz as az
+import numpy as np
+import pandas as pd
+import pymc as pm
+import pytensor
+from pymc.step_methods.hmc.quadpotential import QuadPotentialDiagAdapt
+
+from predictive import add_predictions
+
+OUTPUT_DIR = os.path.join('outputs')
+
+# Variables compared between a warm started and a cold fit
+CHECK_VARS = ['mu_assists_t', 'mu_goals_t', 'b_home', 'beta_goal',
+              'pred_total_points', 'pred_total_goals', 'pred_total_assists']
+
+
+def _previous_draws(model, prev_trace):
+    # Stored draws of every continuous free variable, or None if the previous run does not match this model
+    # (e.g. a new season was added, or the trace came from a roster fit)
+    initial_point = model.initial_point()
+    draws = {}
+    for value_var in model.continuous_value_vars:
+        rv = model.values_to_rvs[value_var]
+        if rv.name not in prev_trace.posterior:
+            return None
+        values = prev_trace.posterior[rv.name].values
+        if values.shape[2:] != initial_point[value_var.name].shape:
+            return None
+        draws[rv.name] = values
+    return draws
+
+
+def _to_unconstrained(model, draws):
+    # NUTS works on the transformed (e.g. log sigma) values, so the mass matrix must be estimated there
+    rvs = [model.values_to_rvs[value_var] for value_var in model.continuous_value_vars]
+    inputs = [rv.type() for rv in rvs]
+    outputs = []
+    for rv, value in zip(rvs, inputs):
+        transform = model.rvs_to_transforms.get(rv)
+        outputs.append(value if transform is None else transform.forward(value, *rv.owner.inputs))
+    forward = pytensor.function(inputs, outputs, on_unused_input='ignore')
+
+    n_chains, n_draws = draws[rvs[0].name].shape[:2]
+    flat = []
+    for chain in range(n_chains):
+        for draw in range(n_draws):
+            point = forward(*[draws[rv.name][chain, draw] for rv in rvs])
+            flat.append(np.concatenate([np.ravel(value) for value in point]))
+    return np.array(flat)
+
+
+def warm_start_sample_kwargs(model, prev_trace, chains):
+    # pm.sample arguments that resume from a previous posterior: a NUTS step with the adapted step size
+    # and a mass matrix estimated from the previous draws, and one previous draw per chain as start point
+    draws = _previous_draws(model, prev_trace)
+    if draws is None or 'step_size' not in prev_trace.get('sample_stats', {}):
+        return {}
+
+    unconstrained = _to_unconstrained(model, draws)
+    n = unconstrained.shape[1]
+    potential = QuadPotentialDiagAdapt(n, unconstrained.mean(axis=0), unconstrained.var(axis=0) + 1e-8, 10)
+
+    # NUTS scales step_scale down by n ** 0.25, undo that to start from the adapted step size
+    step_size = float(prev_trace.sample_stats['step_size'].isel(draw=-1).mean())
+    with model:
+        step = pm.NUTS(vars=model.continuous_value_vars, potential=potential, step_scale=step_size * n ** 0.25)
+
+    return {'step': step, 'initvals': _last_draws(draws, chains)}
+
+
+def _last_draws(draws, chains):
+    # Start point of each chain: the last draw of the matching previous chain
+    n_prev_chains = next(iter(draws.values())).shape[0]
+    return [{name: values[chain % n_prev_chains, -1] for name, values in draws.items()} for chain in range(chains)]
+
+
+def resume_initvals(model, prev_trace, chains):
+    # Just the start points, for extending chains with a step that is already built
+    draws = _previous_draws(model, prev_trace)
+    return None if draws is None else _last_draws(draws, chains)
+
+
+def compare_warm_to_cold(warm_trace, cold_trace, var_names=CHECK_VARS, max_z=3):
+    # Difference in posterior means, in units of the combined Monte Carlo standard error.
+    # Anything beyond max_z is more than sampling noise and flags a biased warm start.
+    warm = az.summary(warm_trace, var_names=var_names)
+    cold = az.summary(cold_trace, var_names=var_names)
+    comparison = pd.DataFrame({
+        'warm_mean': warm['mean'],
+        'cold_mean': cold['mean'],
+        'cold_sd': cold['sd'],
+    })
+    comparison['z'] = (warm['mean'] - cold['mean']) / np.sqrt(warm['mcse_mean'] ** 2 + cold['mcse_mean'] ** 2)
+    comparison['biased'] = comparison['z'].abs() > max_z
+    return comparison
+
+
+def check_against_cold_fit(player_name, player_data_file, schedule_file, team_mapping_file, chains=4):
+    from game_level_modelling import load_and_prepare_data, build_and_sample_model, build_model
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    player_df, remaining_schedule, curr_assists, curr_goals = load_and_prepare_data(
+        player_name, player_data_file, schedule_file, team_mapping_file)
+
+    prev_trace = az.from_netcdf(os.path.join(OUTPUT_DIR, f"{player_name}_model_results.nc"))
+    warm_trace = build_and_sample_model(player_df, remaining_schedule, curr_assists, curr_goals, player_name,
+                                        chains=chains, warm_start=prev_trace)
+
+    # The cold reference fit is not cached or published, it only exists for the comparison
+    with build_model(player_df):
+        cold_trace = pm.sample(100, tune=100, chains=chains, return_inferencedata=True)
+    add_predictions(cold_trace, remaining_schedule, curr_assists, curr_goals)
+
+    comparison = compare_warm_to_cold(warm_trace, cold_trace)
+    n_biased = int(comparison['biased'].sum())
+    if n_biased:
+        logging.warning(f"{player_name}: {n_biased} variables differ between warm and cold fits")
+    else:
+        logging.info(f"{player_name}: warm start agrees with the cold fit")
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a warm started update against a cold fit')
+    parser.add_argument('player_name')
+    parser.add_argument('team_name')
+    parser.add_argument('--chains', type=int, default=4)
+    args = parser.parse_args()
+
+    comparison = check_against_cold_fit(args.player_name, f"{args.player_name}_df.csv",
+                                        f"{args.team_name}_schedule_2425_formatted.csv", "team_mapping.csv",
+                                        chains=args.chains)
+    print(comparison.to_string())